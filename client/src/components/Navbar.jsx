@@ -22,7 +22,7 @@ const Navbar = ({ toggleDarkMode, isDarkMode, isSidebarOpen, toggleSidebar }) =>
         if (response.ok) {
           setUserData({
             username: data.username || 'User',
-            photo: data.photo ? `data:image/jpeg;base64,${data.photo}` : null,
+            photo: data.photo || null,
           });
         } else {
           console.error('Failed to fetch user data:', data.message);
@@ -0,0 +1,239 @@
+"""
+Asynchronous analysis jobs backed by a local process pool.
+
+`/analyze/<file_id>` runs `analyze_csv_with_ai` inside the request. Jobs move
+that work into a `ProcessPoolExecutor` so a wide file no longer ties up a web
+worker. Job state lives in the `analysis_jobs` collection next to
+`analysis_results`; finished jobs point at the stored analysis document.
+No external broker is involved: jobs that were queued or running when the
+server stopped are marked as interrupted on the next start.
+
+A job is marked running when a worker process picks it up: the worker reports
+the start on a queue that a thread of the server process writes to Mongo.
+Workers are spawned rather than forked, since forking a process whose Mongo
+client already runs its monitor threads is unsafe.
+
+A queued job can be cancelled outright. A job that is already running in a
+worker process cannot be interrupted, so cancelling it discards its result
+when it finishes. With several server processes, a job owned by another
+process is only cancelled while it is still queued in the database;
+otherwise its owner discards the result.
+"""
+import datetime
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from bson.objectid import ObjectId
+from gridfs import GridFSBucket
+
+from data_access import connect
+from data_mind_ai_analysis_model import analyze_csv_with_ai
+from file_storage import BUCKET_NAME
+from frame_compaction import restore_frame
+from streaming_analysis import analyze_csv_streaming
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+# Error of the jobs and recipe runs a server restart cut short
+INTERRUPTED = 'Interrupted by server restart'
+
+# Queue of (job id, start time) in a worker process, set by _init_worker
+_started = None
+
+
+def _init_worker(started):
+    global _started
+    _started = started
+
+
+def _run_job(job_id, fn, payload, *args):
+    """
+    Runs a job in a pool process after reporting its start to the server process.
+    """
+    _started.put((job_id, datetime.datetime.utcnow()))
+    return fn(payload, *args)
+
+
+def run_analysis(frame, plot_mode='eager', approximate=False, sampling=None, top_associations=None):
+    """
+    Worker entry point; runs in a pool process and renders plots serially.
+    Args:
+        frame: Tuple of (DataFrame, compaction report or None) as returned by
+            DataFrameCache.get with `compact=True`.
+    """
+    df, report = frame
+    if report is not None:
+        df = restore_frame(df, report)
+    return analyze_csv_with_ai(df, plot_mode=plot_mode, approximate=approximate, sampling=sampling,
+                               top_associations=top_associations)
+
+
+def run_streaming_analysis(gridfs_ref, plot_mode='eager', approximate=False, read_options=None):
+    """
+    Worker entry point for files above the streaming threshold. The worker
+    reads the upload from GridFS itself, so the file never passes through
+    the server process.
+    Args:
+        gridfs_ref: Tuple of (Mongo URI, database name, GridFS file id).
+    """
+    mongo_uri, db_name, gridfs_id = gridfs_ref
+    client, _ = connect(mongo_uri, max_pool_size=1)
+    try:
+        bucket = GridFSBucket(client[db_name], bucket_name=BUCKET_NAME)
+        with bucket.open_download_stream(gridfs_id) as source:
+            results, _ = analyze_csv_streaming(source, plot_mode=plot_mode, approximate=approximate,
+                                               read_options=read_options)
+        return results
+    finally:
+        client.close()
+
+
+class AnalysisJobManager:
+    """
+    Submits analyses to a process pool and tracks them in Mongo.
+    Args:
+        jobs_collection: Collection holding one document per job.
+        on_complete: Called in the server process as `on_complete(job_doc, results)`
+            for successful jobs; returns a dict of fields to store on the job,
+            e.g. the id of the stored analysis.
+        max_workers: Number of worker processes.
+        max_pending: Maximum number of queued or running jobs per user.
+    """
+    def __init__(self, jobs_collection, on_complete, max_workers=2, max_pending=4):
+        self.jobs_collection = jobs_collection
+        self.on_complete = on_complete
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._started = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        # Created on first use so importing the app starts no workers
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context('spawn')
+                self._started = context.SimpleQueue()
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                                     initializer=_init_worker, initargs=(self._started,))
+                threading.Thread(target=self._watch_started, args=(self._started,), daemon=True).start()
+            return self._executor
+
+    def recover(self):
+        """
+        Marks jobs left over from a previous server process as interrupted.
+        """
+        result = self.jobs_collection.update_many(
+            {'status': {'$in': [QUEUED, RUNNING]}},
+            {'$set': {'status': FAILED, 'error': INTERRUPTED,
+                      'finished_at': datetime.datetime.utcnow()}}
+        )
+        return result.modified_count
+
+    def pending_count(self, email):
+        return self.jobs_collection.count_documents({'email': email, 'status': {'$in': [QUEUED, RUNNING]}})
+
+    def submit(self, file_id, email, payload, fn=run_analysis, args=(), kind='analysis', on_complete=None):
+        """
+        Queues `fn(payload, *args)` in the process pool.
+        Returns:
+            The job id as a string, or None if the user has too many pending jobs.
+        """
+        if self.pending_count(email) >= self.max_pending:
+            return None
+
+        job_doc = {
+            'file_id': file_id,
+            'email': email,
+            'kind': kind,
+            'status': QUEUED,
+            'submitted_at': datetime.datetime.utcnow()
+        }
+        job_id = self.jobs_collection.insert_one(job_doc).inserted_id
+        job_doc['_id'] = job_id
+
+        future = self.executor.submit(_run_job, job_id, fn, payload, *args)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._finish(job_doc, f, on_complete or self.on_complete))
+        return str(job_id)
+
+    def get(self, job_id, email):
+        """
+        Returns the job document, or None.
+        """
+        return self.jobs_collection.find_one({'_id': ObjectId(job_id), 'email': email})
+
+    def cancel(self, job_id, email):
+        """
+        Cancels a job.
+        Returns:
+            The job document after cancellation, or None if the job does not exist.
+        """
+        job_doc = self.get(job_id, email)
+        if job_doc is None or job_doc['status'] in FINISHED_STATES:
+            return job_doc
+
+        with self._lock:
+            future = self._futures.get(job_doc['_id'])
+        cancelled = {'cancel_requested': True, 'status': CANCELLED, 'finished_at': datetime.datetime.utcnow()}
+        if future is not None:
+            update = cancelled if future.cancel() else {'cancel_requested': True}
+            self.jobs_collection.update_one({'_id': job_doc['_id']}, {'$set': update})
+        else:
+            # Owned by another server process: cancelled only if no worker has picked it up yet
+            result = self.jobs_collection.update_one({'_id': job_doc['_id'], 'status': QUEUED}, {'$set': cancelled})
+            if result.modified_count == 0:
+                self.jobs_collection.update_one({'_id': job_doc['_id'], 'status': {'$nin': FINISHED_STATES}},
+                                                {'$set': {'cancel_requested': True}})
+        return self.get(job_id, email)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            started, self._started = self._started, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+            started.put(None)
+
+    def _watch_started(self, started):
+        while True:
+            event = started.get()
+            if event is None:
+                return
+            job_id, started_at = event
+            try:
+                self.jobs_collection.update_one({'_id': job_id, 'status': QUEUED},
+                                                {'$set': {'status': RUNNING, 'started_at': started_at}})
+            except Exception as e:
+                print(f"Could not mark analysis job {job_id} as running: {str(e)}")
+
+    def _finish(self, job_doc, future, on_complete):
+        job_id = job_doc['_id']
+        with self._lock:
+            self._futures.pop(job_id, None)
+        update = {'finished_at': datetime.datetime.utcnow()}
+        try:
+            if future.cancelled():
+                update['status'] = CANCELLED
+            else:
+                results = future.result()
+                current = self.jobs_collection.find_one({'_id': job_id}, {'cancel_requested': 1})
+                if current and current.get('cancel_requested'):
+                    update['status'] = CANCELLED
+                elif isinstance(results, dict) and 'error' in results:
+                    update.update({'status': FAILED, 'error': results['error']})
+                else:
+                    update.update(on_complete(job_doc, results) or {})
+                    update['status'] = DONE
+        except Exception as e:
+            print(f"Analysis job {job_id} failed: {str(e)}")
+            update.update({'status': FAILED, 'error': str(e)})
+        self.jobs_collection.update_one({'_id': job_id}, {'$set': update})
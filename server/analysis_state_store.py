@@ -0,0 +1,77 @@
+"""
+Persisted StreamingAnalysisState per uploaded file, for incremental re-analysis.
+
+The state (counts, moments, missing values, category frequencies, reservoirs,
+correlation sums and regression normal equations) is BSON-encoded into its own
+GridFS bucket, since value counters of wide files can outgrow a single
+document. The `analysis_states` collection keeps one pointer per file together
+with the `sha256` of the payload the state describes; a state whose hash no
+longer matches the file is ignored and rebuilt.
+"""
+import datetime
+import io
+
+import bson
+from gridfs import GridFSBucket
+from gridfs.errors import NoFile
+
+from streaming_analysis import StreamingAnalysisState
+
+STATE_BUCKET_NAME = 'analysis_state_fs'
+
+
+class AnalysisStateStore:
+    """
+    Args:
+        db: pymongo Database holding the GridFS bucket.
+        collection: Collection with one pointer document per file.
+    """
+    def __init__(self, db, collection, bucket_name=STATE_BUCKET_NAME):
+        self.collection = collection
+        self.bucket = GridFSBucket(db, bucket_name=bucket_name)
+
+    def load(self, file_id, sha256):
+        """
+        Returns:
+            The StreamingAnalysisState of the file's current payload, or None.
+        """
+        doc = self.collection.find_one({'file_id': file_id, 'sha256': sha256})
+        if doc is None:
+            return None
+        try:
+            with self.bucket.open_download_stream(doc['gridfs_id']) as grid_out:
+                return StreamingAnalysisState.from_dict(bson.decode(grid_out.read()))
+        except NoFile:
+            return None
+
+    def save(self, file_id, email, sha256, state):
+        """
+        Stores `state` as the state of the payload with hash `sha256`, replacing the previous one.
+        """
+        payload = bson.encode(state.to_dict())
+        gridfs_id = self.bucket.upload_from_stream(f'{file_id}.state', io.BytesIO(payload))
+        previous = self.collection.find_one_and_update(
+            {'file_id': file_id},
+            {'$set': {
+                'email': email,
+                'sha256': sha256,
+                'gridfs_id': gridfs_id,
+                'rows': state.rows,
+                'size': len(payload),
+                'updated_at': datetime.datetime.utcnow()
+            }},
+            upsert=True
+        )
+        if previous is not None:
+            self._delete_payload(previous)
+
+    def delete(self, file_id):
+        doc = self.collection.find_one_and_delete({'file_id': file_id})
+        if doc is not None:
+            self._delete_payload(doc)
+
+    def _delete_payload(self, doc):
+        try:
+            self.bucket.delete(doc['gridfs_id'])
+        except NoFile:
+            pass
@@ -1,20 +1,40 @@
-from flask import Flask, request, jsonify, send_file
-from pymongo import MongoClient
+from flask import Flask, request, jsonify, Response, copy_current_request_context, stream_with_context, url_for, g
 from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 import jwt
 import datetime
-import io
+import functools
+import json
+import time
 from werkzeug.utils import secure_filename
 from bson.objectid import ObjectId
 import os
 from data_mind_ai_analysis_model import analyze_csv_with_ai
-import numpy as np
+from file_storage import FileStorage, METADATA_PROJECTION, PUBLIC_PROJECTION
+from dataframe_cache import DataFrameCache
+from working_store import WorkingStore
+from auth import AuthError, Authenticator
+from data_access import QueryMetrics, collection, connect, ensure_indexes
+from revision_log import RevisionLog
+from analysis_jobs import AnalysisJobManager, DONE, run_streaming_analysis
+from plot_rendering import render_plot
+from plot_store import PlotStore
+from progress import event_stream
+from response_encoding import NumpyJSONProvider, compress_response
+from avatars import DEFAULT_AVATAR_SIZE, AvatarStore
+from streaming_analysis import analyze_csv_streaming, stream_chunks, CHUNK_ROWS
+from analysis_state_store import AnalysisStateStore
+from sampling import sampling_options
+from regression import fit_from_cache
+from csv_schema import SAMPLE_BYTES, chunk_options, infer_schema, read_csv
 import base64
+import binascii
 import model
-import pandas as pd
-from io import StringIO
+from recipes import RecipeRunner, RecipeStore
+from cleaning_pipeline import MUTATING_ACTIONS, OperationError, normalize_steps, run_operation, run_pipeline
 app = Flask(__name__)
+# jsonify encodes numpy and pandas values directly
+app.json = NumpyJSONProvider(app)
 bcrypt = Bcrypt(app)
 CORS(app, resources={
     r"/login": {"origins": "http://localhost:5173"},
@@ -28,38 +48,613 @@ CORS(app, resources={
     r"/current_files": {"origins": "http://localhost:5173"},
     r"/analyze/*": {"origins": "http://localhost:5173"},
     r"/file/*": {"origins": "http://localhost:5173"},
+    r"/cache-stats": {"origins": "http://localhost:5173"},
+    r"/jobs/*": {"origins": "http://localhost:5173"},
+    r"/analysis/*": {"origins": "http://localhost:5173"},
+    r"/plots/*": {"origins": "http://localhost:5173"},
+    r"/append/*": {"origins": "http://localhost:5173"},
+    r"/pipeline/*": {"origins": "http://localhost:5173"},
+    r"/recipes*": {"origins": "http://localhost:5173"},
+    r"/recipe-runs/*": {"origins": "http://localhost:5173"},
+    r"/history/*": {"origins": "http://localhost:5173"},
+    r"/db-stats": {"origins": "http://localhost:5173"},
+    r"/avatars/*": {"origins": "http://localhost:5173"},
 }, supports_credentials=True)
 
 # MongoDB connection
-client = MongoClient('mongodb://localhost:27017/')
+MONGO_URI = os.environ.get('DATAMIND_MONGO_URI', 'mongodb://localhost:27017/')
+# Latency of every query, reported by /db-stats; slower queries are logged
+query_metrics = QueryMetrics(slow_ms=float(os.environ.get('DATAMIND_SLOW_QUERY_MS', '100')))
+# Pool settings, also used by the async client of asgi.py
+MONGO_POOL_OPTIONS = {
+    'max_pool_size': int(os.environ.get('DATAMIND_MONGO_MAX_POOL', '100')),
+    'min_pool_size': int(os.environ.get('DATAMIND_MONGO_MIN_POOL', '0')),
+    'max_idle_ms': int(os.environ['DATAMIND_MONGO_MAX_IDLE_MS']) if 'DATAMIND_MONGO_MAX_IDLE_MS' in os.environ else None,
+    'wait_queue_timeout_ms': (int(os.environ['DATAMIND_MONGO_WAIT_QUEUE_MS'])
+                              if 'DATAMIND_MONGO_WAIT_QUEUE_MS' in os.environ else None)
+}
+client, mongo_pool_settings = connect(MONGO_URI, metrics=query_metrics, **MONGO_POOL_OPTIONS)
 db = client['datamind']
 users_collection = db['users']
-files_collection = db['user_files']
-analysis_collection = db['analysis_results']
+# Lean collections: queries without a projection leave out inline payloads and other heavy fields
+files_collection = collection(db, 'user_files')
+analysis_collection = collection(db, 'analysis_results')
+analysis_jobs_collection = db['analysis_jobs']
+plot_artifacts_collection = db['plot_artifacts']
 analysis_results_collection = db['manual_analysis_results']
-result_collection = db['result_df']
+result_collection = collection(db, 'result_df')
+result_columns_collection = db['result_df_columns']
+# Uploaded file payloads live in GridFS; user_files only keeps metadata
+file_storage = FileStorage(db, files_collection)
+# Parsed DataFrames shared by the analysis and cleaning routes
+dataframe_cache = DataFrameCache(
+    max_bytes=int(os.environ.get('DATAMIND_DF_CACHE_MB', '512')) * 1024 * 1024,
+    compact=os.environ.get('DATAMIND_COMPACT_FRAMES', '0') == '1'
+)
+# Rendered plots, stored once per content hash
+plot_store = PlotStore(plot_artifacts_collection)
+# Profile photo thumbnails, stored once per content hash
+avatar_store = AvatarStore(db['avatars'])
+# Manual cleaning working copies, stored column by column
+working_store = WorkingStore(result_collection, result_columns_collection)
+# Undo/redo log of the working copies: compact diffs, periodic snapshots and a size cap
+revision_log = RevisionLog(
+    db['result_df_history'],
+    db['result_df_snapshots'],
+    snapshot_interval=int(os.environ.get('DATAMIND_HISTORY_SNAPSHOT_INTERVAL', '10')),
+    max_entries=int(os.environ.get('DATAMIND_HISTORY_MAX_ENTRIES', '100')),
+    max_bytes=int(os.environ.get('DATAMIND_HISTORY_MAX_MB', '256')) * 1024 * 1024
+)
+# Mergeable analysis state per file, updated by /append
+analysis_states = AnalysisStateStore(db, db['analysis_states'])
 # Secret Key for JWT
 SECRET_KEY = 'your-secret-key'
+# Verified tokens and user profiles are cached for a bounded time; profile changes invalidate them
+authenticator = Authenticator(
+    SECRET_KEY, users_collection,
+    token_ttl=int(os.environ.get('DATAMIND_TOKEN_CACHE_TTL', '300')),
+    max_tokens=int(os.environ.get('DATAMIND_TOKEN_CACHE_SIZE', '10000')),
+    profile_ttl=int(os.environ.get('DATAMIND_PROFILE_CACHE_TTL', '300')),
+    max_profiles=int(os.environ.get('DATAMIND_PROFILE_CACHE_SIZE', '1000'))
+)
 ALLOWED_EXTENSIONS = {'csv', 'txt', 'pdf', 'png', 'jpg', 'jpeg'}
+# Plot rendering: 'eager' or 'lazy' by default (overridable with ?plots=), and worker processes for eager rendering
+PLOT_MODE = os.environ.get('DATAMIND_PLOT_MODE', 'eager')
+PLOT_MODES = ('eager', 'lazy')
+# Lifetime of the signed links to lazy plots, in seconds
+PLOT_URL_TTL = int(os.environ.get('DATAMIND_PLOT_URL_TTL', str(24 * 3600)))
+# Sketch-based quartiles and categorical statistics unless a request asks otherwise
+APPROXIMATE_STATS = os.environ.get('DATAMIND_APPROXIMATE_STATS', '0') == '1'
+# Default row budget for the regression and correlation (0 uses every row)
+SAMPLE_ROWS = int(os.environ.get('DATAMIND_SAMPLE_ROWS', '0'))
+PLOT_WORKERS = int(os.environ.get('DATAMIND_PLOT_WORKERS', '1'))
+# CSVs above this size are analyzed chunk by chunk instead of being loaded whole
+STREAMING_THRESHOLD_BYTES = int(os.environ.get('DATAMIND_STREAMING_THRESHOLD_MB', '100')) * 1024 * 1024
+# Page size of /files-history when `limit` is not given with a cursor, and its upper bound
+FILES_PAGE_DEFAULT = 100
+FILES_PAGE_MAX = 500
+DOWNLOAD_MIMETYPES = {'csv': 'text/csv', 'txt': 'text/plain', 'pdf': 'application/pdf'}
+
+def require_auth(view):
+    """
+    Route decorator: answers CORS preflight requests, rejects requests without
+    a valid token with 401 and exposes the caller's email as `g.email`.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method == 'OPTIONS':
+            return jsonify({}), 200
+        try:
+            g.email = authenticator.verify(request.headers.get('Authorization'))
+        except AuthError as e:
+            return jsonify({'message': e.message}), 401
+        return view(*args, **kwargs)
+    return wrapper
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Helper function to convert numpy types to Python types
-def convert_numpy_types(obj):
-    if isinstance(obj, np.integer):
-        return int(obj)
-    elif isinstance(obj, np.floating):
-        return float(obj)
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    elif isinstance(obj, dict):
-        return {k: convert_numpy_types(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_numpy_types(item) for item in obj]
-    elif isinstance(obj, tuple):
-        return tuple(convert_numpy_types(item) for item in obj)
-    return obj
+def requested_plot_mode():
+    """
+    Reads `?plots=eager|lazy` of an analysis request.
+    Raises:
+        ValueError: For any other value.
+    """
+    plot_mode = request.args.get('plots', PLOT_MODE)
+    if plot_mode not in PLOT_MODES:
+        raise ValueError(f"plots must be one of {', '.join(PLOT_MODES)}")
+    return plot_mode
+
+def issue_token(email):
+    """
+    Session token returned by /login and by a profile update that changes the email.
+    """
+    token = jwt.encode(
+        {'email': email, 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)},
+        SECRET_KEY,
+        algorithm='HS256'
+    )
+    return token if isinstance(token, str) else token.decode('utf-8')
+
+def plot_url_token(analysis_id):
+    """
+    Signed, short-lived capability for the plots of one analysis. Lazy plot URLs carry it
+    because the client loads them with <img> and fetch, which send no Authorization header.
+    """
+    return jwt.encode({
+        'analysis_id': str(analysis_id),
+        'scope': 'plots',
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=PLOT_URL_TTL)
+    }, SECRET_KEY, algorithm='HS256')
+
+def plot_url_token_valid(token, analysis_id):
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+    except jwt.InvalidTokenError:
+        return False
+    return payload.get('scope') == 'plots' and payload.get('analysis_id') == analysis_id
+
+def approximate_requested():
+    """
+    Reads the opt-in `?approximate=1` flag of an analysis request.
+    """
+    value = request.args.get('approximate')
+    if value is None:
+        return APPROXIMATE_STATS
+    return value.lower() in ('1', 'true', 'yes')
+
+def requested_sampling():
+    """
+    Reads the sampling options of an analysis request: `?sample_rows=<budget>`,
+    `&sampling=uniform|stratified`, `&seed=<int>` and `&stratify_by=<column>`.
+    Raises:
+        ValueError: For a malformed option.
+    """
+    return sampling_options(
+        rows=int(request.args.get('sample_rows', SAMPLE_ROWS)),
+        method=request.args.get('sampling', 'uniform'),
+        seed=int(request.args.get('seed', 42)),
+        stratify_by=request.args.get('stratify_by')
+    )
+
+def requested_top_associations():
+    """
+    Reads `?top_associations=<k>` of an analysis request: report the k strongest
+    column pairs instead of the full association matrix.
+    Raises:
+        ValueError: For a value that is not a positive integer.
+    """
+    value = request.args.get('top_associations')
+    if value is None:
+        return None
+    top_k = int(value)
+    if top_k <= 0:
+        raise ValueError('top_associations must be positive')
+    return top_k
+
+def analysis_request(file_doc):
+    """
+    Shared start of /analyze/<file_id> and /analyze/<file_id>/jobs: migrates a
+    legacy upload and reads the analysis options of the request.
+    Returns:
+        Tuple of (file metadata, dict of plot_mode, approximate, sampling and top_associations).
+    Raises:
+        LookupError: If the file was deleted meanwhile.
+        ValueError: For an invalid option; the message is the response message.
+    """
+    file_doc = migrated_file(file_doc)
+    try:
+        plot_mode = requested_plot_mode()
+    except ValueError as e:
+        raise ValueError(f'Invalid plot options: {str(e)}')
+    try:
+        sampling = requested_sampling()
+    except ValueError as e:
+        raise ValueError(f'Invalid sampling options: {str(e)}')
+    try:
+        top_associations = requested_top_associations()
+    except ValueError as e:
+        raise ValueError(f'Invalid association options: {str(e)}')
+    return file_doc, {
+        'plot_mode': plot_mode,
+        'approximate': approximate_requested(),
+        'sampling': sampling,
+        'top_associations': top_associations
+    }
+
+def requested_date(args, name):
+    value = datetime.datetime.fromisoformat(args[name])
+    if value.tzinfo is not None:
+        # Upload dates are stored as naive UTC
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+def requested_files_query(email, args):
+    """
+    Files query of a /files-history request: `?filetype=csv,txt` and the upload
+    date range `&from=<ISO date>&to=<ISO date>` (`to` exclusive).
+    Raises:
+        ValueError: For a malformed date.
+    """
+    query = {'email': email}
+    filetypes = [value.strip().lower() for value in args.get('filetype', '').split(',') if value.strip()]
+    if filetypes:
+        query['filetype'] = {'$in': filetypes}
+    dates = {}
+    if args.get('from'):
+        dates['$gte'] = requested_date(args, 'from')
+    if args.get('to'):
+        dates['$lt'] = requested_date(args, 'to')
+    if dates:
+        query['upload_date'] = dates
+    return query
+
+def encode_files_cursor(file_doc):
+    """
+    Opaque keyset cursor pointing after `file_doc` in (upload_date, _id) descending order.
+    """
+    position = f"{file_doc['upload_date'].isoformat()}|{file_doc['_id']}"
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+def files_cursor_query(cursor):
+    """
+    Raises:
+        ValueError: For a cursor that encode_files_cursor did not produce.
+    """
+    try:
+        upload_date, file_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        upload_date, file_id = datetime.datetime.fromisoformat(upload_date), ObjectId(file_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+    return {'$or': [
+        {'upload_date': {'$lt': upload_date}},
+        {'upload_date': upload_date, '_id': {'$lt': file_id}}
+    ]}
+
+def file_to_json(file_doc):
+    file_doc['_id'] = str(file_doc['_id'])
+    file_doc['upload_date'] = file_doc['upload_date'].isoformat()
+    return file_doc
+
+# Newest first, served by the (email, upload_date, _id) index
+FILES_SORT = [('upload_date', -1), ('_id', -1)]
+
+def files_history_request(email, args, ndjson_accepted):
+    """
+    Reads a /files-history request; shared by the Flask route and the async one of asgi.py.
+    Args:
+        args: Query string mapping.
+        ndjson_accepted: Whether application/x-ndjson is the client's preferred response type.
+    Returns:
+        Dict with the Mongo `query`, the `page` size (None when not paginated),
+        and the `paginated` and `stream` flags.
+    Raises:
+        ValueError: With the message of the 400 response.
+    """
+    try:
+        query = requested_files_query(email, args)
+        if args.get('cursor'):
+            query = {'$and': [query, files_cursor_query(args['cursor'])]}
+        page = int(args['limit']) if args.get('limit') else None
+    except ValueError as e:
+        raise ValueError(f'Invalid files query: {str(e)}')
+    if page is not None and page <= 0:
+        raise ValueError('limit must be positive')
+    paginated = page is not None or 'cursor' in args
+    if paginated:
+        page = min(page or FILES_PAGE_DEFAULT, FILES_PAGE_MAX)
+    return {
+        'query': query,
+        'page': page,
+        'paginated': paginated,
+        'stream': args.get('stream', '').lower() in ('1', 'true', 'yes') or ndjson_accepted
+    }
+
+def files_page(docs, page):
+    """
+    Response body of a paginated /files-history request from up to `page + 1` documents.
+    """
+    # The cursor is taken before file_to_json converts the documents in place
+    next_cursor = encode_files_cursor(docs[page - 1]) if len(docs) > page else None
+    return {
+        'files': [file_to_json(file) for file in docs[:page]],
+        'next_cursor': next_cursor,
+        'message': 'File history retrieved successfully'
+    }
+
+def ndjson_line(obj):
+    return json.dumps(obj) + '\n'
+
+def events_requested():
+    """
+    Whether a long-running request asked for server-sent progress events
+    (`?events=1` or Accept: text/event-stream) instead of one JSON response.
+    """
+    return (request.args.get('events', '').lower() in ('1', 'true', 'yes')
+            or request.accept_mimetypes.best == 'text/event-stream')
+
+def progress_events(work):
+    """
+    Streams a job as server-sent events (see progress.event_stream).
+    Args:
+        work: Called with a StageProgress in a background thread that has a copy of
+            the request context; returns (response body, status).
+    """
+    return Response(event_stream(copy_current_request_context(work), app.json.dumps), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def infer_file_schema(head, complete):
+    """
+    Schema profile of a CSV upload from its first bytes, or None if the head does not parse.
+    """
+    try:
+        return infer_schema(head, complete=complete)
+    except Exception as e:
+        print(f"Schema inference failed: {str(e)}")
+        return None
+
+def migrated_file(file_doc):
+    """
+    Raises:
+        LookupError: If the file was deleted before its legacy payload could be migrated.
+    """
+    file_doc = file_storage.migrate_inline_file(file_doc)
+    if file_doc is None:
+        raise LookupError('File not found')
+    return file_doc
+
+def ensure_schema(file_doc):
+    """
+    Returns the file's stored schema, inferring and storing it for files uploaded without one.
+    """
+    if 'schema' in file_doc or file_doc.get('filetype') != 'csv':
+        return file_doc.get('schema')
+    file_doc = migrated_file(file_doc)
+    head = b''.join(file_storage.iter_range(file_doc, 0, min(file_doc['size'], SAMPLE_BYTES)))
+    schema = infer_file_schema(head, complete=file_doc['size'] <= SAMPLE_BYTES)
+    files_collection.update_one({'_id': file_doc['_id']}, {'$set': {'schema': schema}})
+    file_doc['schema'] = schema
+    return schema
+
+def load_csv_frame(file_doc, compact=False):
+    """
+    Parsed DataFrame of an uploaded CSV, keyed in the cache by file id and content hash.
+    The returned frame is shared and must not be modified. With `compact=True`
+    returns (frame, compaction report or None) as DataFrameCache.get does.
+    """
+    file_doc = migrated_file(file_doc)
+    key = (str(file_doc['_id']), file_doc['sha256'])
+    return dataframe_cache.get_or_load(
+        key, lambda: read_csv(file_storage.read_bytes(file_doc), ensure_schema(file_doc)), compact=compact
+    )
+
+def working_cache_key(file_id, email, revision):
+    return (file_id, f'working:{email}:{revision}')
+
+def load_working_df(file_id, email, file_doc):
+    """
+    Loads the manual cleaning working copy, creating it from the upload on first use.
+    Returns:
+        Tuple of (shared DataFrame, undo log position, revision number).
+    """
+    query = {"file_id": ObjectId(file_id), "email": email}
+    file = result_collection.find_one(query, {'result_df': 0, 'history': 0})
+    if not file:
+        df = working_store.save(
+            ObjectId(file_id), email, load_csv_frame(file_doc),
+            extra={'log_position': 0, 'created_at': datetime.datetime.utcnow()}
+        )
+        dataframe_cache.put(working_cache_key(file_id, email, 0), df)
+        return df, 0, 0
+
+    revision = file.get('revision', 0)
+    df = dataframe_cache.get_or_load(
+        working_cache_key(file_id, email, revision),
+        lambda: working_store.load(file)
+    )
+    if 'log_position' not in file:
+        return df, import_legacy_history(query, df), revision
+    return df, file['log_position'], revision
+
+def import_legacy_history(query, df):
+    """
+    Moves the `history` revert list of a working copy saved before the undo log
+    existed into the log; entries the log cannot rebuild are discarded.
+    Returns:
+        The undo log position of the working copy.
+    """
+    legacy = result_collection.find_one(query, {'history': 1}) or {}
+    history = legacy.get('history') or []
+    position = revision_log.import_history(query['file_id'], query['email'], df, history)
+    result_collection.update_one({**query, 'log_position': {'$exists': False}},
+                                 {'$set': {'log_position': position}, '$unset': {'history': ''}})
+    print(f"Imported {position} of {len(history)} legacy history entries of {query['file_id']}")
+    return position
+
+def save_working_df(file_id, email, result_df, log_position, revision, previous_df=None):
+    """
+    Persists a new revision of the working copy and caches it for the next request.
+    Only the columns that differ from `previous_df` are rewritten.
+    """
+    new_revision = revision + 1
+    result_df = working_store.save(
+        ObjectId(file_id), email, result_df, old_df=previous_df,
+        revision=new_revision, extra={'log_position': log_position}
+    )
+    dataframe_cache.discard(working_cache_key(file_id, email, revision))
+    dataframe_cache.put(working_cache_key(file_id, email, new_revision), result_df)
+    return new_revision
+
+def commit_working_df(file_id, email, previous_df, result_df, log_position, revision, operations):
+    """
+    Records a change in the undo log and persists its result as the next revision.
+    Args:
+        result_df: Result of the change, with the index labels of the kept rows of `previous_df`.
+        operations: Summaries of the operations that made the change.
+    Returns:
+        Tuple of (new revision, new undo log position).
+    """
+    new_position = revision_log.record(ObjectId(file_id), email, log_position, previous_df, result_df, operations)
+    return save_working_df(file_id, email, result_df, new_position, revision, previous_df), new_position
+
+def step_summaries(step_results):
+    return [{'action': step['action'], 'column': step['column']} for step in step_results]
+
+def store_analysis(file_id, email, results):
+    """
+    Stores the output of analyze_csv_with_ai in analysis_collection. numpy values
+    are encoded by the collection's codec (see data_access.NUMPY_CODEC_OPTIONS)
+    and by jsonify, so the results are not converted first.
+    Returns:
+        Tuple of (analysis id, results with plots replaced by their stored references).
+    """
+    # Rendered plots go to the plot store; the analysis only keeps references
+    analysis_id = ObjectId()
+    results['plots'] = [store_plot(plot, analysis_id) for plot in results['plots']]
+
+    analysis_doc = {
+        '_id': analysis_id,
+        'file_id': file_id,
+        'email': email,
+        'insights': results['insights'],
+        'predictions': results['predictions'],
+        'plots': results['plots'],
+        'created_at': datetime.datetime.utcnow()
+    }
+    for key in ('streaming', 'approximate', 'sketches', 'sampling', 'incremental', 'regression'):
+        if key in results:
+            analysis_doc[key] = results[key]
+    print("Inserting into analysis_collection...")
+    analysis_result = analysis_collection.insert_one(analysis_doc)
+    return str(analysis_result.inserted_id), results
+
+def store_plot(plot, analysis_id):
+    """
+    Moves a rendered {"name", "data"} plot of an analysis into the plot store.
+    Returns:
+        The {"name", "sha256"} reference kept in the analysis; lazy plot specs are returned unchanged.
+    """
+    if 'data' not in plot:
+        return plot
+    return {'name': plot['name'], 'sha256': plot_store.put(base64.b64decode(plot['data']), analysis_id)}
+
+def delete_analyses(file_id, email):
+    """
+    Deletes the stored analyses of a file and the plot images only they referenced.
+    """
+    query = {'file_id': file_id, 'email': email}
+    analysis_ids = [analysis['_id'] for analysis in analysis_collection.find(query, {'_id': 1})]
+    analysis_collection.delete_many(query)
+    print(f"Deleted {len(analysis_ids)} analyses and {plot_store.release(analysis_ids)} plots of file {file_id}")
+
+def analysis_client_results(analysis, analysis_id):
+    """
+    Shapes stored analysis results for the client, with plots as image URLs.
+    Stored plots link to /plots/<sha256>.png, plots that have not been rendered yet (lazy mode)
+    to /analysis/<id>/plots/<name>; analyses saved before the plot store keep base64 URLs.
+    """
+    plots = []
+    for plot in analysis['plots']:
+        if 'sha256' in plot:
+            plots.append(url_for('plot_artifact', digest=plot['sha256'], _external=True))
+        elif 'data' in plot:
+            plots.append(f"data:image/png;base64,{plot['data']}")
+        else:
+            plots.append(url_for('analysis_plot', analysis_id=analysis_id, name=plot['name'],
+                                 token=plot_url_token(analysis_id), _external=True))
+    client_results = {
+        'insights': analysis['insights'],
+        'predictions': analysis['predictions'],
+        'plots': plots
+    }
+    for key in ('approximate', 'sampling', 'incremental'):
+        if key in analysis:
+            client_results[key] = analysis[key]
+    return client_results
+
+def user_avatar(user):
+    """
+    Avatar thumbnail references of a user, converting a photo stored as base64
+    by earlier versions on first use.
+    Returns:
+        Dict of size to digest, or None for users without a usable photo.
+    """
+    if 'avatar' in user or not user.get('photo'):
+        return user.get('avatar')
+    update = {'$set': {'avatar': None}}
+    try:
+        avatar = avatar_store.put_photo(base64.b64decode(user['photo']))
+        update = {'$set': {'avatar': avatar}, '$unset': {'photo': ''}}
+    except (ValueError, binascii.Error) as e:
+        # The original stays in place; it is just not offered as an avatar
+        print(f"Could not convert photo of {user['email']}: {str(e)}")
+        avatar = None
+    users_collection.update_one({'email': user['email']}, update)
+    authenticator.invalidate_user(user['email'])
+    return avatar
+
+def avatar_urls(avatar):
+    return {size: url_for('avatar_image', digest=digest, _external=True) for size, digest in (avatar or {}).items()}
+
+def job_to_json(job_doc):
+    job = {k: v for k, v in job_doc.items() if k not in ('_id', 'email')}
+    job['job_id'] = str(job_doc['_id'])
+    for key in ('submitted_at', 'started_at', 'finished_at'):
+        if job.get(key):
+            job[key] = job[key].isoformat()
+    return job
+
+# Background analysis jobs; the pool size and per-user queue limit are configurable
+analysis_jobs = AnalysisJobManager(
+    analysis_jobs_collection,
+    on_complete=lambda job, results: {'analysis_id': store_analysis(job['file_id'], job['email'], results)[0]},
+    max_workers=int(os.environ.get('DATAMIND_ANALYSIS_WORKERS', '2')),
+    max_pending=int(os.environ.get('DATAMIND_ANALYSIS_MAX_PENDING', '4'))
+)
+
+def load_recipe_file(file_id, email):
+    """
+    Loads a file's working copy for a recipe run.
+    Returns:
+        Tuple of (frame for the worker, state for persist_recipe_file).
+    """
+    file_doc = files_collection.find_one({'_id': ObjectId(file_id), 'email': email}, METADATA_PROJECTION)
+    if not file_doc:
+        raise LookupError('File not found or you do not have access')
+    if file_doc['filetype'] != 'csv':
+        raise ValueError('Only CSV files can be cleaned')
+    cached_df, log_position, revision = load_working_df(file_id, email, file_doc)
+    # The frame is pickled into the worker, so the shared cached frame is never modified
+    return cached_df, (cached_df, log_position, revision)
+
+def persist_recipe_file(file_id, email, loaded, output):
+    """
+    Saves the result of a recipe as the next working copy revision, as the
+    last step of a one-at-a-time cleaning session would.
+    """
+    cached_df, log_position, revision = loaded
+    current = result_collection.find_one({'file_id': ObjectId(file_id), 'email': email}, {'revision': 1})
+    if current and current.get('revision', 0) != revision:
+        raise RuntimeError('The working copy changed while the recipe ran')
+    new_revision, _ = commit_working_df(file_id, email, cached_df, output['df'], log_position, revision,
+                                       step_summaries(output['steps']))
+    return {'revision': new_revision}
+
+# Versioned cleaning recipes, replayed over batches of files in the analysis process pool
+recipes = RecipeStore(db['recipes'])
+recipe_runner = RecipeRunner(
+    collection(db, 'recipe_runs'),
+    executor=lambda: analysis_jobs.executor,
+    load=load_recipe_file,
+    persist=persist_recipe_file,
+    max_parallel=int(os.environ.get('DATAMIND_RECIPE_PARALLEL_FILES', '2'))
+)
+
+def recipe_to_json(recipe):
+    recipe = dict(recipe)
+    recipe['_id'] = str(recipe['_id'])
+    recipe['created_at'] = recipe['created_at'].isoformat()
+    return recipe
 
 # Register route with photo upload
 @app.route('/register', methods=['POST', 'OPTIONS'])
@@ -78,16 +673,20 @@ def register():
         if users_collection.find_one({'email': email}):
             return jsonify({'message': 'Email already exists'}), 400
 
-        photo_data = None
+        avatar = None
         if photo and allowed_file(photo.filename):
-            photo_data = base64.b64encode(photo.read()).decode('utf-8')
+            try:
+                avatar = avatar_store.put_photo(photo.read())
+            except ValueError as e:
+                # The account is created without an avatar
+                print(f"Ignoring photo of {email}: {str(e)}")
 
         hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
         users_collection.insert_one({
             'email': email,
             'password': hashed_password,
             'username': username,
-            'photo': photo_data
+            'avatar': avatar
         })
         return jsonify({'message': 'User registered successfully'}), 201
     except Exception as e:
@@ -108,63 +707,42 @@ def login():
         if not user or not bcrypt.check_password_hash(user['password'], password):
             return jsonify({'message': 'Invalid credentials'}), 401
 
-        token = jwt.encode(
-            {'email': email, 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)},
-            SECRET_KEY,
-            algorithm='HS256'
-        )
-        token = token if isinstance(token, str) else token.decode('utf-8')
-        return jsonify({'token': token, 'message': 'Login successful'}), 200
+        return jsonify({'token': issue_token(email), 'message': 'Login successful'}), 200
     except Exception as e:
         print(f"Login error: {str(e)}")
         return jsonify({'message': f'Unexpected error: {str(e)}'}), 500
 
 # Dashboard route - Return username and photo
 @app.route('/dashboard', methods=['GET', 'OPTIONS'])
+@require_auth
 def dashboard():
-    if request.method == 'OPTIONS':
-        return jsonify({}), 200
     try:
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({'message': 'Token is missing'}), 401
-
-        token = token.split()[1]
-        data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        email = data['email']
-        user = users_collection.find_one({'email': email})
+        email = g.email
+        user = authenticator.profile(email)
 
         if not user:
             return jsonify({'message': 'User not found'}), 404
 
+        # The photo is served by /avatars; only its URLs are returned
+        photos = avatar_urls(user_avatar(user))
         return jsonify({
             'username': user.get('username', 'User'),
             'email': user.get('email', ''),
-            'photo': user.get('photo', None),
+            'photo': photos.get(str(DEFAULT_AVATAR_SIZE)),
+            'photo_sizes': photos,
             'message': 'powered by cynor'
         }), 200
-    except jwt.ExpiredSignatureError:
-        return jsonify({'message': 'Token has expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'message': 'Invalid token'}), 401
     except Exception as e:
         print(f"Dashboard error: {str(e)}")
         return jsonify({'message': f'Error: {str(e)}'}), 500
 
 # Update Profile route
 @app.route('/update-profile', methods=['PATCH', 'OPTIONS'])
+@require_auth
 def update_profile():
-    if request.method == 'OPTIONS':
-        return jsonify({}), 200
     try:
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({'message': 'Token is missing'}), 401
-
-        token = token.split()[1]
-        data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        email = data['email']
-        user = users_collection.find_one({'email': email})
+        email = g.email
+        user = authenticator.profile(email)
 
         if not user:
             return jsonify({'message': 'User not found'}), 404
@@ -184,46 +762,35 @@ def update_profile():
         if password:
             update_data['password'] = bcrypt.generate_password_hash(password).decode('utf-8')
         if photo and allowed_file(photo.filename):
-            photo_data = base64.b64encode(photo.read()).decode('utf-8')
-            update_data['photo'] = photo_data
+            try:
+                update_data['avatar'] = avatar_store.put_photo(photo.read())
+            except ValueError as e:
+                # The current avatar is kept
+                print(f"Ignoring photo of {email}: {str(e)}")
 
         if not update_data:
             return jsonify({'message': 'No updates provided'}), 400
 
-        users_collection.update_one({'email': email}, {'$set': update_data})
+        update = {'$set': update_data}
+        if 'avatar' in update_data:
+            update['$unset'] = {'photo': ''}
+        users_collection.update_one({'email': email}, update)
+        authenticator.invalidate_user(email, update_data.get('email', email))
 
         if new_email and new_email != email:
-            token = jwt.encode(
-                {'email': new_email, 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)},
-                SECRET_KEY,
-                algorithm='HS256'
-            )
-            token = token if isinstance(token, str) else token.decode('utf-8')
-            return jsonify({'message': 'Profile updated successfully', 'new_token': token}), 200
+            return jsonify({'message': 'Profile updated successfully', 'new_token': issue_token(new_email)}), 200
 
         return jsonify({'message': 'Profile updated successfully'}), 200
-    except jwt.ExpiredSignatureError:
-        return jsonify({'message': 'Token has expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'message': 'Invalid token'}), 401
     except Exception as e:
         print(f"Update profile error: {str(e)}")
         return jsonify({'message': f'Error: {str(e)}'}), 500
 
 # File upload route
 @app.route('/upload', methods=['POST', 'OPTIONS'])
+@require_auth
 def upload_file():
-    if request.method == 'OPTIONS':
-        return jsonify({}), 200
-    token = request.headers.get('Authorization')
-    if not token:
-        print("No Authorization header provided")
-        return jsonify({'message': 'Token is missing'}), 401
-
     try:
-        token = token.split()[1]
-        data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        email = data['email']
+        email = g.email
 
         if 'file' not in request.files:
             return jsonify({'message': 'No file part'}), 400
@@ -236,148 +803,172 @@ def upload_file():
             return jsonify({'message': 'File type not allowed. Only CSV, TXT, PDF permitted'}), 400
 
         filename = secure_filename(file.filename)
-        file_data = file.read()
         filetype = filename.rsplit('.', 1)[1].lower() if '.' in filename else 'unknown'
 
+        # Profile CSVs once from their first bytes; later parses reuse the schema
+        schema = None
+        if filetype == 'csv':
+            head = file.stream.read(SAMPLE_BYTES + 1)
+            file.stream.seek(0)
+            schema = infer_file_schema(head[:SAMPLE_BYTES], complete=len(head) <= SAMPLE_BYTES)
+
+        # Stream the upload into GridFS instead of reading it into memory
+        stored = file_storage.store_stream(file.stream, filename, metadata={'email': email})
+
         file_doc = {
             'email': email,
             'filename': filename,
-            'data': file_data,
+            'gridfs_id': stored['gridfs_id'],
+            'size': stored['size'],
+            'sha256': stored['sha256'],
             'filetype': filetype,
             'upload_date': datetime.datetime.utcnow()
         }
+        if schema is not None:
+            file_doc['schema'] = schema
         files_collection.insert_one(file_doc)
         print(f"File uploaded successfully for email: {email}, filename: {filename}")
         return jsonify({'message': 'File uploaded successfully'}), 201
-    except jwt.ExpiredSignatureError:
-        return jsonify({'message': 'Token has expired'}), 401
-    except jwt.InvalidTokenError as e:
-        return jsonify({'message': 'Invalid token'}), 401
     except Exception as e:
         print(f"Upload error: {str(e)}")
         return jsonify({'message': f'Error: {str(e)}'}), 500
 
 # Files history route
 @app.route('/files-history', methods=['GET', 'OPTIONS'])
+@require_auth
 def files_history():
-    if request.method == 'OPTIONS':
-        return jsonify({}), 200
     try:
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({'message': 'Token is missing'}), 401
-
-        token = token.split()[1]
-        data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        email = data['email']
-
-        files = list(files_collection.find({'email': email}, {'data': 0}))
-        for file in files:
-            file['_id'] = str(file['_id'])
-            file['upload_date'] = file['upload_date'].isoformat()
+        email = g.email
 
-        return jsonify({'files': files, 'message': 'File history retrieved successfully'}), 200
-    except jwt.ExpiredSignatureError:
-        return jsonify({'message': 'Token has expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'message': 'Invalid token'}), 401
+        try:
+            plan = files_history_request(email, request.args, request.accept_mimetypes.best == 'application/x-ndjson')
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        query, page, paginated = plan['query'], plan['page'], plan['paginated']
+
+        if not paginated and not plan['stream']:
+            # Unpaginated requests get every file in one response, as before
+            files = [file_to_json(file) for file in files_collection.find(query, PUBLIC_PROJECTION)]
+            return jsonify({'files': files, 'message': 'File history retrieved successfully'}), 200
+
+        cursor = files_collection.find(query, PUBLIC_PROJECTION).sort(FILES_SORT)
+        if paginated:
+            cursor = cursor.limit(page + 1)
+
+        if plan['stream']:
+            def generate():
+                # One file per line as the cursor yields it; a page ends with a {"next_cursor"} line
+                sent, last = 0, None
+                for file in cursor.batch_size(FILES_PAGE_DEFAULT):
+                    if paginated and sent == page:
+                        yield ndjson_line({'next_cursor': encode_files_cursor(last)})
+                        break
+                    last = dict(file)
+                    yield ndjson_line(file_to_json(file))
+                    sent += 1
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+        return jsonify(files_page(list(cursor), page)), 200
     except Exception as e:
         print(f"Files history error: {str(e)}")
         return jsonify({'message': f'Error: {str(e)}'}), 500
 
 # Download route
 @app.route('/download/<file_id>', methods=['GET', 'OPTIONS'])
+@require_auth
 def download_file(file_id):
-    if request.method == 'OPTIONS':
-        return jsonify({}), 200
     try:
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({'message': 'Token is missing'}), 401
-
-        token = token.split()[1]
-        data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        email = data['email']
+        email = g.email
 
-        file_doc = files_collection.find_one({'_id': ObjectId(file_id), 'email': email})
+        file_doc = files_collection.find_one({'_id': ObjectId(file_id), 'email': email}, METADATA_PROJECTION)
         if not file_doc:
             return jsonify({'message': 'File not found or you do not have access'}), 404
 
-        file_data = io.BytesIO(file_doc['data'])
-        response = send_file(
-            file_data,
-            as_attachment=True,
-            download_name=file_doc['filename'],
-            mimetype={'csv': 'text/csv', 'txt': 'text/plain', 'pdf': 'application/pdf'}.get(file_doc['filetype'], 'application/octet-stream')
+        # Legacy inline documents get their size and hash on migration
+        file_doc = file_storage.migrate_inline_file(file_doc)
+        if not file_doc:
+            return jsonify({'message': 'File not found or you do not have access'}), 404
+        size = file_doc['size']
+        etag = file_doc['sha256']
+        headers = {
+            'ETag': f'"{etag}"',
+            'Accept-Ranges': 'bytes',
+            'Cache-Control': 'private, no-cache',
+            'Content-Disposition': f'attachment; filename="{file_doc["filename"]}"'
+        }
+        mimetype = DOWNLOAD_MIMETYPES.get(file_doc['filetype'], 'application/octet-stream')
+
+        # Repeated download of unchanged content
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+
+        # Resumed download: serve a single byte range, ignore multi-range and stale If-Range requests.
+        # No Last-Modified is sent, so an If-Range date cannot be validated and gets the full file.
+        start, stop, status = 0, size, 200
+        byte_range = request.range
+        if_range = request.if_range
+        range_valid = if_range.date is None and (if_range.etag is None or if_range.etag == etag)
+        if byte_range is not None and len(byte_range.ranges) == 1 and range_valid:
+            bounds = byte_range.range_for_length(size)
+            if bounds is None:
+                headers['Content-Range'] = f'bytes */{size}'
+                return Response(status=416, headers=headers)
+            start, stop = bounds
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+        headers['Content-Length'] = str(stop - start)
+        return Response(
+            stream_with_context(file_storage.iter_range(file_doc, start, stop)),
+            status=status,
+            mimetype=mimetype,
+            headers=headers,
+            direct_passthrough=True
         )
-        return response
-    except jwt.ExpiredSignatureError:
-        return jsonify({'message': 'Token has expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'message': 'Invalid token'}), 401
     except Exception as e:
         print(f"Download error: {str(e)}")
         return jsonify({'message': f'Error: {str(e)}'}), 500
 
 # Delete route
 @app.route('/delete/<file_id>', methods=['DELETE', 'OPTIONS'])
+@require_auth
 def delete_file(file_id):
-    if request.method == 'OPTIONS':
-        return jsonify({}), 200
     try:
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({'message': 'Token is missing'}), 401
-
-        token = token.split()[1]
-        data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        email = data['email']
+        email = g.email
 
         # Check if the file exists and belongs to the user
-        file_doc = files_collection.find_one({'_id': ObjectId(file_id), 'email': email})
+        file_doc = files_collection.find_one({'_id': ObjectId(file_id), 'email': email}, METADATA_PROJECTION)
         if not file_doc:
             return jsonify({'message': 'File not found or you do not have access'}), 404
 
-        # Delete the file from the database
+        # Delete the file and its GridFS payload from the database
         files_collection.delete_one({'_id': ObjectId(file_id), 'email': email})
+        file_storage.delete_data(file_doc)
+        dataframe_cache.invalidate(file_id)
+        working_store.delete(ObjectId(file_id), email)
+        revision_log.delete(ObjectId(file_id), email)
+        analysis_states.delete(ObjectId(file_id))
+        delete_analyses(file_id, email)
 
         return jsonify({'message': f'File {file_doc["filename"]} deleted successfully'}), 200
-    except jwt.ExpiredSignatureError:
-        return jsonify({'message': 'Token has expired'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'message': 'Invalid token'}), 401
     except Exception as e:
         print(f"Delete error: {str(e)}")
         return jsonify({'message': f'Error: {str(e)}'}), 500
 
 @app.route('/current_files', methods=['GET', 'OPTIONS'])
+@require_auth
 def current_files():
-    if request.method == 'OPTIONS':
-        return jsonify({}), 200
     try:
-        token = request.headers.get('Authorization')
-        if not token:
-            print("No token provided in current_files")
-            return jsonify({'message': 'Token is missing'}), 401
-
-        token = token.split()[1]
-        data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        email = data['email']
+        email = g.email
         print(f"Fetching current file for email: {email}")
 
-        files = list(files_collection.find({'email': email}, {'data': 0}).sort('upload_date', -1).limit(1))
+        files = list(files_collection.find({'email': email}, PUBLIC_PROJECTION).sort('upload_date', -1).limit(1))
         for file in files:
             file['_id'] = str(file['_id'])
             file['upload_date'] = file['upload_date'].isoformat()
         print(f"Current files response: {files}")
 
         return jsonify({'files': files, 'message': 'File history retrieved successfully'}), 200
-    except jwt.ExpiredSignatureError:
-        print("Token expired in current_files")
-        return jsonify({'message': 'Token has expired'}), 401
-    except jwt.InvalidTokenError:
-        print("Invalid token in current_files")
-        return jsonify({'message': 'Invalid token'}), 401
     except Exception as e:
         print(f"Current files error: {str(e)}")
         return jsonify({'message': f'Error: {str(e)}'}), 500
@@ -385,21 +976,13 @@ def current_files():
 
 # New endpoint to fetch a specific file by ID
 @app.route('/file/<file_id>', methods=['GET', 'OPTIONS'])
+@require_auth
 def get_file(file_id):
-    if request.method == 'OPTIONS':
-        return jsonify({}), 200
     try:
-        token = request.headers.get('Authorization')
-        if not token:
-            print("No token provided in get_file")
-            return jsonify({'message': 'Token is missing'}), 401
-
-        token = token.split()[1]
-        data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        email = data['email']
+        email = g.email
         print(f"Fetching file for email: {email}, file_id: {file_id}")
 
-        file_doc = files_collection.find_one({'_id': ObjectId(file_id), 'email': email}, {'data': 0})
+        file_doc = files_collection.find_one({'_id': ObjectId(file_id), 'email': email}, PUBLIC_PROJECTION)
         if not file_doc:
             return jsonify({'message': 'File not found or you do not have access'}), 404
 
@@ -408,12 +991,6 @@ def get_file(file_id):
         print(f"File response: {file_doc}")
 
         return jsonify({'file': file_doc, 'message': 'File retrieved successfully'}), 200
-    except jwt.ExpiredSignatureError:
-        print("Token expired in get_file")
-        return jsonify({'message': 'Token has expired'}), 401
-    except jwt.InvalidTokenError:
-        print("Invalid token in get_file")
-        return jsonify({'message': 'Invalid token'}), 401
     except Exception as e:
         print(f"Get file error: {str(e)}")
         return jsonify({'message': f'Error: {str(e)}'}), 500
@@ -421,96 +998,386 @@ def get_file(file_id):
 
 # Analyze route
 @app.route('/analyze/<file_id>', methods=['GET', 'OPTIONS'])
+@require_auth
 def analyze_file(file_id):
-    if request.method == 'OPTIONS':
-        return jsonify({}), 200
     try:
-        token = request.headers.get('Authorization')
-        if not token:
-            print("No token provided in analyze")
-            return jsonify({'message': 'Token is missing'}), 401
-
-        token = token.split()[1]
-        data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        email = data['email']
+        email = g.email
         print(f"Analyzing file for email: {email}, file_id: {file_id}")
 
-        file_doc = files_collection.find_one({'_id': ObjectId(file_id), 'email': email})
+        file_doc = files_collection.find_one({'_id': ObjectId(file_id), 'email': email}, METADATA_PROJECTION)
         if not file_doc:
             return jsonify({'message': 'File not found or you do not have access'}), 404
 
         if file_doc['filetype'] != 'csv':
             return jsonify({'message': 'Only CSV files can be analyzed'}), 400
 
-        print("Type of file_doc['data']:", type(file_doc['data']))
-        print("file_doc['data'] (first 100 chars):", file_doc['data'][:100] if isinstance(file_doc['data'], (str, bytes)) else "Not a string or bytes")
+        try:
+            file_doc, options = analysis_request(file_doc)
+        except LookupError:
+            return jsonify({'message': 'File not found or you do not have access'}), 404
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        plot_mode, approximate = options['plot_mode'], options['approximate']
+        sampling, top_associations = options['sampling'], options['top_associations']
+
+        def analyze(progress=None):
+            # Returns (response body, status)
+            if file_doc['size'] > STREAMING_THRESHOLD_BYTES:
+                print(f"File is {file_doc['size']} bytes, using streaming analysis...")
+                with file_storage.open_stream(file_doc) as source:
+                    results, state = analyze_csv_streaming(source, plot_mode=plot_mode, plot_workers=PLOT_WORKERS,
+                                                           approximate=approximate,
+                                                           read_options=chunk_options(ensure_schema(file_doc)),
+                                                           progress=progress)
+                if state is not None and 'error' not in results:
+                    # Keep the state so appends only pay for the new rows
+                    analysis_states.save(file_doc['_id'], email, file_doc['sha256'], state)
+            else:
+                try:
+                    df = load_csv_frame(file_doc)
+                except LookupError:
+                    return {'message': 'File not found or you do not have access'}, 404
+                except Exception as e:
+                    return {'message': f'Error reading CSV: {str(e)}'}, 400
+                print("DataFrame cache:", {k: v for k, v in dataframe_cache.stats().items() if k != 'entry_bytes'})
+
+                print("Calling analyze_csv_with_ai...")
+                results = analyze_csv_with_ai(df, plot_mode=plot_mode, plot_workers=PLOT_WORKERS,
+                                              approximate=approximate, sampling=sampling,
+                                              top_associations=top_associations, progress=progress)
+            print("Results from analyze_csv_with_ai:", results)
+
+            if 'error' in results:
+                return {'message': results['error']}, 400
+
+            analysis_id, converted_results = store_analysis(file_id, email, results)
+
+            print("Converting plots to base64 URLs...")
+            converted_results = analysis_client_results(converted_results, analysis_id)
+
+            return {
+                'message': 'Analysis completed successfully',
+                'results': converted_results,
+                'analysis_id': analysis_id
+            }, 200
+
+        # `?events=1` or Accept: text/event-stream reports the stages as they finish
+        if events_requested():
+            return progress_events(analyze)
+        body, status = analyze()
+        return jsonify(body), status
+    except Exception as e:
+        print(f"Analyze error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
 
-        csv_data = file_doc['data'].decode('utf-8') if isinstance(file_doc['data'], bytes) else file_doc['data']
-        print("CSV Data (first 100 chars):", csv_data[:100])
+# Append rows to an uploaded CSV and update its analysis from the persisted state
+@app.route('/append/<file_id>', methods=['POST', 'OPTIONS'])
+@require_auth
+def append_rows(file_id):
+    try:
+        email = g.email
+        print(f"Appending to file for email: {email}, file_id: {file_id}")
 
-        if not isinstance(csv_data, str):
-            return jsonify({'message': 'Invalid data format: Expected raw CSV data, got a dictionary or other type'}), 400
+        file_doc = files_collection.find_one({'_id': ObjectId(file_id), 'email': email}, METADATA_PROJECTION)
+        if not file_doc:
+            return jsonify({'message': 'File not found or you do not have access'}), 404
+        if file_doc['filetype'] != 'csv':
+            return jsonify({'message': 'Only CSV files can be appended to'}), 400
+        if 'file' not in request.files or request.files['file'].filename == '':
+            return jsonify({'message': 'No file part'}), 400
+        delta = request.files['file'].stream
 
-        print("Calling analyze_csv_with_ai...")
-        results = analyze_csv_with_ai(csv_data)
-        print("Results from analyze_csv_with_ai:", results)
+        # None when the file was deleted meanwhile
+        file_doc = file_storage.migrate_inline_file(file_doc)
+        if not file_doc:
+            return jsonify({'message': 'File not found or you do not have access'}), 404
+        try:
+            plot_mode = requested_plot_mode()
+        except ValueError as e:
+            return jsonify({'message': f'Invalid plot options: {str(e)}'}), 400
+        state = analysis_states.load(file_doc['_id'], file_doc['sha256'])
+        if state is None:
+            # First append: one full pass over the current payload builds the state
+            print("No analysis state for this file yet, building it...")
+            with file_storage.open_stream(file_doc) as source:
+                results, state = analyze_csv_streaming(source, plot_mode='lazy', approximate=approximate_requested(),
+                                                       read_options=chunk_options(ensure_schema(file_doc)))
+            if 'error' in results:
+                return jsonify({'message': results['error']}), 400
+
+        # Only the new rows are parsed and folded into the state
+        appended_rows = 0
+        try:
+            for chunk in stream_chunks(delta, chunk_rows=CHUNK_ROWS, **chunk_options(ensure_schema(file_doc))):
+                if list(chunk.columns) != state.columns:
+                    return jsonify({'message': f'Appended rows must have the columns {state.columns}'}), 400
+                state.update(chunk)
+                appended_rows += len(chunk)
+        except Exception as e:
+            return jsonify({'message': f'Error reading CSV: {str(e)}'}), 400
+        if appended_rows == 0:
+            return jsonify({'message': 'No rows to append'}), 400
+
+        # Store the rows without their header line after the current payload
+        delta.seek(0)
+        delta.readline()
+        stored = file_storage.store_appended(file_doc, delta)
+        updated = files_collection.update_one(
+            {'_id': file_doc['_id'], 'sha256': file_doc['sha256']},
+            {'$set': stored}
+        )
+        if updated.modified_count == 0:
+            file_storage.delete_data(stored)
+            return jsonify({'message': 'File was modified concurrently, please retry'}), 409
+        file_storage.delete_data(file_doc)
+        dataframe_cache.invalidate(file_id)
+        analysis_states.save(file_doc['_id'], email, stored['sha256'], state)
+
+        results = state.results(plot_mode=plot_mode, plot_workers=PLOT_WORKERS)
+        results['incremental'] = {'appended_rows': appended_rows, 'total_rows': state.rows}
+        analysis_id, converted_results = store_analysis(file_id, email, results)
+        converted_results = analysis_client_results(converted_results, analysis_id)
+        return jsonify({
+            'message': f'Appended {appended_rows} rows',
+            'results': converted_results,
+            'analysis_id': analysis_id
+        }), 200
+    except Exception as e:
+        print(f"Append error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
+
+# Plot of a stored analysis; lazy plots are rendered on first request and kept
+# Authenticated by the signed `?token=` of the URL (see plot_url_token) or, without one, a Bearer token
+@app.route('/analysis/<analysis_id>/plots/<name>', methods=['GET', 'OPTIONS'])
+def analysis_plot(analysis_id, name):
+    if request.method == 'OPTIONS':
+        return jsonify({}), 200
+    try:
+        query = {'_id': ObjectId(analysis_id)}
+        if request.args.get('token'):
+            if not plot_url_token_valid(request.args['token'], analysis_id):
+                return jsonify({'message': 'Plot link is invalid or has expired'}), 401
+        else:
+            try:
+                query['email'] = authenticator.verify(request.headers.get('Authorization'))
+            except AuthError as e:
+                return jsonify({'message': e.message}), 401
+
+        analysis = analysis_collection.find_one(query, {'plots': {'$elemMatch': {'name': name}}})
+        if not analysis or not analysis.get('plots'):
+            return jsonify({'message': 'Plot not found or you do not have access'}), 404
+
+        plot = analysis['plots'][0]
+        if 'sha256' in plot:
+            digest = plot['sha256']
+            image = plot_store.get(digest)
+        elif 'data' in plot:
+            image = base64.b64decode(plot['data'])
+            digest = plot_store.put(image, analysis['_id'])
+        else:
+            image = render_plot(plot)
+            digest = plot_store.put(image, analysis['_id'])
+            analysis_collection.update_one(
+                {'_id': ObjectId(analysis_id), 'plots.name': name},
+                {'$set': {'plots.$.sha256': digest}}
+            )
+        if image is None:
+            return jsonify({'message': 'Plot not found'}), 404
+
+        return Response(image, mimetype='image/png', headers={
+            'ETag': f'"{digest}"',
+            'Cache-Control': 'private, max-age=86400'
+        })
+    except Exception as e:
+        print(f"Analysis plot error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
 
-        if 'error' in results:
-            return jsonify({'message': results['error']}), 400
+# Regression of any numerical target from the Gram matrices stored with the analysis
+@app.route('/analysis/<analysis_id>/regression', methods=['GET', 'OPTIONS'])
+@require_auth
+def analysis_regression(analysis_id):
+    try:
+        email = g.email
+
+        target = request.args.get('target')
+        if not target:
+            return jsonify({'message': 'Missing target column'}), 400
+        features = request.args.get('features')
+        if features is not None:
+            features = [col for col in features.split(',') if col]
+
+        analysis = analysis_collection.find_one(
+            {'_id': ObjectId(analysis_id), 'email': email},
+            {'regression': 1}
+        )
+        if not analysis:
+            return jsonify({'message': 'Analysis not found or you do not have access'}), 404
+        if not analysis.get('regression'):
+            return jsonify({'message': 'No regression data stored for this analysis'}), 404
 
-        print("Converting numpy types in results...")
-        converted_results = convert_numpy_types(results)
+        try:
+            prediction = fit_from_cache(analysis['regression'], target, features)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
 
-        analysis_doc = {
-            'file_id': file_id,
-            'email': email,
-            'insights': converted_results['insights'],
-            'predictions': converted_results['predictions'],
-            'plots': converted_results['plots'],
-            'created_at': datetime.datetime.utcnow()
+        return jsonify({'prediction': prediction, 'message': 'Regression computed successfully'}), 200
+    except Exception as e:
+        print(f"Analysis regression error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
+
+# Content-addressed plot images; the URL changes with the content, so they can be cached forever
+@app.route('/plots/<digest>.png', methods=['GET', 'OPTIONS'])
+def plot_artifact(digest):
+    if request.method == 'OPTIONS':
+        return jsonify({}), 200
+    try:
+        headers = {
+            'ETag': f'"{digest}"',
+            'Cache-Control': 'public, max-age=31536000, immutable'
         }
-        print("Inserting into analysis_collection...")
-        analysis_result = analysis_collection.insert_one(analysis_doc)
-        analysis_id = str(analysis_result.inserted_id)
+        if request.if_none_match.contains(digest):
+            return Response(status=304, headers=headers)
+
+        if len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+            return jsonify({'message': 'Plot not found'}), 404
+        image = plot_store.get(digest)
+        if image is None:
+            return jsonify({'message': 'Plot not found'}), 404
+
+        return Response(image, mimetype='image/png', headers=headers)
+    except Exception as e:
+        print(f"Plot artifact error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
+
+# Profile photo thumbnails, addressed by content hash and cacheable forever
+@app.route('/avatars/<digest>', methods=['GET', 'OPTIONS'])
+def avatar_image(digest):
+    if request.method == 'OPTIONS':
+        return jsonify({}), 200
+    try:
+        headers = {
+            'ETag': f'"{digest}"',
+            'Cache-Control': 'public, max-age=31536000, immutable'
+        }
+        if request.if_none_match.contains(digest):
+            return Response(status=304, headers=headers)
+
+        if len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+            return jsonify({'message': 'Avatar not found'}), 404
+        stored = avatar_store.get(digest)
+        if stored is None:
+            return jsonify({'message': 'Avatar not found'}), 404
+
+        image, mimetype = stored
+        return Response(image, mimetype=mimetype, headers=headers)
+    except Exception as e:
+        print(f"Avatar error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
 
-        print("Converting plots to base64 URLs...")
-        converted_results['plots'] = [f"data:image/png;base64,{plot['data']}" for plot in converted_results['plots']]
+# Submit an analysis job to the worker pool
+@app.route('/analyze/<file_id>/jobs', methods=['POST', 'OPTIONS'])
+@require_auth
+def submit_analysis_job(file_id):
+    try:
+        email = g.email
+
+        file_doc = files_collection.find_one({'_id': ObjectId(file_id), 'email': email}, METADATA_PROJECTION)
+        if not file_doc:
+            return jsonify({'message': 'File not found or you do not have access'}), 404
+
+        if file_doc['filetype'] != 'csv':
+            return jsonify({'message': 'Only CSV files can be analyzed'}), 400
+
+        try:
+            file_doc, options = analysis_request(file_doc)
+        except LookupError:
+            return jsonify({'message': 'File not found or you do not have access'}), 404
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        plot_mode, approximate = options['plot_mode'], options['approximate']
+        sampling, top_associations = options['sampling'], options['top_associations']
+        if file_doc['size'] > STREAMING_THRESHOLD_BYTES:
+            # The worker streams the file from GridFS itself
+            job_id = analysis_jobs.submit(
+                file_id, email, (MONGO_URI, db.name, file_doc['gridfs_id']),
+                fn=run_streaming_analysis, args=(plot_mode, approximate, chunk_options(ensure_schema(file_doc)))
+            )
+        else:
+            try:
+                # The worker restores the dtypes, so the request only pickles the compact frame
+                frame = load_csv_frame(file_doc, compact=True)
+            except LookupError:
+                return jsonify({'message': 'File not found or you do not have access'}), 404
+            except Exception as e:
+                return jsonify({'message': f'Error reading CSV: {str(e)}'}), 400
+            job_id = analysis_jobs.submit(file_id, email, frame, args=(plot_mode, approximate, sampling, top_associations))
+        if job_id is None:
+            return jsonify({'message': 'Too many analysis jobs in progress'}), 429
+
+        print(f"Submitted analysis job {job_id} for email: {email}, file_id: {file_id}")
+        return jsonify({'message': 'Analysis job submitted', 'job_id': job_id, 'status': 'queued'}), 202
+    except Exception as e:
+        print(f"Submit analysis job error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
+
+# Job status and cancellation
+@app.route('/jobs/<job_id>', methods=['GET', 'DELETE', 'OPTIONS'])
+@require_auth
+def analysis_job(job_id):
+    try:
+        email = g.email
+
+        if request.method == 'DELETE':
+            job_doc = analysis_jobs.cancel(job_id, email)
+        else:
+            job_doc = analysis_jobs.get(job_id, email)
+        if not job_doc:
+            return jsonify({'message': 'Job not found or you do not have access'}), 404
+
+        return jsonify({'job': job_to_json(job_doc), 'message': 'Job retrieved successfully'}), 200
+    except Exception as e:
+        print(f"Analysis job error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
+
+# Result of a finished analysis job, in the same shape as /analyze/<file_id>
+@app.route('/jobs/<job_id>/result', methods=['GET', 'OPTIONS'])
+@require_auth
+def analysis_job_result(job_id):
+    try:
+        email = g.email
+
+        job_doc = analysis_jobs.get(job_id, email)
+        if not job_doc:
+            return jsonify({'message': 'Job not found or you do not have access'}), 404
+        if job_doc['status'] != DONE:
+            return jsonify({'message': f"Job is {job_doc['status']}", 'job': job_to_json(job_doc)}), 409
+
+        analysis = analysis_collection.find_one({'_id': ObjectId(job_doc['analysis_id']), 'email': email})
+        if not analysis:
+            return jsonify({'message': 'Analysis result not found'}), 404
 
         return jsonify({
             'message': 'Analysis completed successfully',
-            'results': converted_results,
-            'analysis_id': analysis_id
+            'results': analysis_client_results(analysis, job_doc['analysis_id']),
+            'analysis_id': job_doc['analysis_id']
         }), 200
     except Exception as e:
-        print(f"Analyze error: {str(e)}")
+        print(f"Analysis job result error: {str(e)}")
         return jsonify({'message': f'Error: {str(e)}'}), 500
     
 @app.route('/analyze_missing_value/<file_id>', methods=['POST', 'OPTIONS'])
+@require_auth
 def analyze_missing_value(file_id):
-    # Handle CORS preflight request
-    if request.method == 'OPTIONS':
-        return jsonify({}), 200
-
     # Allow only POST requests
     if request.method != 'POST':
         return jsonify({'message': f'Method {request.method} not allowed'}), 405
 
     try:
-        # Token validation
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({'message': 'Token is missing'}), 401
-
-        try:
-            token = token.replace('Bearer ', '').strip()
-            data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-            email = data['email']
-        except jwt.InvalidTokenError as e:
-            return jsonify({'message': 'Invalid token'}), 401
+        email = g.email
 
         # Fetch file metadata from files_collection (just to validate existence)
         try:
-            file_doc = files_collection.find_one({'_id': ObjectId(file_id), 'email': email})
+            file_doc = files_collection.find_one({'_id': ObjectId(file_id), 'email': email}, METADATA_PROJECTION)
             if not file_doc:
                 return jsonify({'message': 'File not found or you do not have access'}), 404
         except Exception as e:
@@ -519,41 +1386,18 @@ def analyze_missing_value(file_id):
         # Check file type
         if file_doc['filetype'] != 'csv':
             return jsonify({'message': 'Only CSV files can be analyzed'}), 400
+        # Load the working copy; it is only parsed on a DataFrame cache miss
         try:
-            csv_data = file_doc['data'].decode('utf-8') if isinstance(file_doc['data'], bytes) else file_doc['data']
-            if not isinstance(csv_data, str):
-                return jsonify({'message': 'Invalid data format: Expected raw CSV data'}), 400
-        except Exception as e:
+            cached_df, log_position, revision = load_working_df(file_id, email, file_doc)
+        except LookupError:
+            return jsonify({'message': 'File not found or you do not have access'}), 404
+        except UnicodeDecodeError:
             return jsonify({'message': 'Error decoding CSV data'}), 400
-
-        # Read CSV into DataFrame
-        try:
-            df = pd.read_csv(StringIO(csv_data))
-            df_dict = df.to_dict('records')
         except Exception as e:
             return jsonify({'message': f'Error reading CSV: {str(e)}'}), 400
-        
-        # result_collection.insert_one({
-        #     'file_id': ObjectId(file_id),
-        #     'email': email,
-        #     'result_df': df_dict,
-        #     'created_at': datetime.datetime.utcnow()
-        # })
-        # Fetch DataFrame and history from result_collection
-        file = result_collection.find_one({"file_id": ObjectId(file_id), "email": email})
-        if not file:
-         result_collection.insert_one({
-            'file_id': ObjectId(file_id),
-            'email': email,
-            'result_df': df_dict,
-            'created_at': datetime.datetime.utcnow()
-         }) 
-        # if not file:
-        #     return jsonify({'message': 'DataFrame not found. Please upload the file again.'}), 404
 
-        # Load the DataFrame
-        df = pd.DataFrame(file["result_df"])
-        history = file.get("history", [])  # Fetch history list, default to empty if not present
+        # Cached frames are shared between requests, so operate on a private copy
+        df = cached_df.copy()
 
         # Get form data
         form_data = request.json
@@ -568,59 +1412,26 @@ def analyze_missing_value(file_id):
 
         action = form_data['action']
         column = form_data['column']
-        fill_method = form_data['fill_method']
-        method = form_data['method']
-        outlier_method = form_data['outlier_method']
-        value = form_data['value']
         changes = form_data['changes']
-        typee = form_data['type']
-        target_type = form_data['target_type']
-        standardize_to= form_data['standardize_to']
-        rule = form_data['rule']
-        list_columns = form_data['list_columns']
-        list_row = form_data['list_row']
-
-        # Handle revert
-        if changes == "revert":
-            result_collection.update_one(
-                {"file_id": ObjectId(file_id), "email": email},
-                {"$set": {
-                    "result_df": df.to_dict('records'),
-                    "history": history
-                }}
-            )
-            if not history:
-                return jsonify({'message': 'No more changes to revert'}), 400
-
-            # Pop the latest change from history
-            last_change = history.pop()
-            operation = last_change.get("operation")
-
-            # Undo the operation
-            if operation == "delete_column":
-                deleted_column = last_change.get("column")
-                deleted_data = last_change.get("data")
-                # Reconstruct the column and add it back to DataFrame
-                column_data = pd.Series([row.get(deleted_column) for row in deleted_data], index=df.index)
-                df[deleted_column] = column_data
-
-            elif operation == "fill_missing":
-                affected_column = last_change.get("column")
-                old_values = last_change.get("old_values", [])
-                # Revert filled values to their original (null) state
-                for entry in old_values:
-                    idx = entry.get("index")
-                    df.at[idx, affected_column] = None
-
-            # Update result_collection with the reverted DataFrame and history
+
+        # Undo or redo the latest change through the undo log
+        if changes in ("revert", "redo"):
+            target = log_position - 1 if changes == "revert" else log_position + 1
+            try:
+                restored_df = revision_log.checkout(ObjectId(file_id), email, log_position, cached_df, target)
+            except LookupError:
+                return jsonify({'message': f"No more changes to {'revert' if changes == 'revert' else 'redo'}"}), 400
+            new_revision = save_working_df(file_id, email, restored_df, target, revision, cached_df)
 
             result_dict = {
                 'status': 'success',
-                'message': 'Changes reverted successfully',
+                'message': 'Changes reverted successfully' if changes == "revert" else 'Changes restored successfully',
                 'affected_rows': 0,
                 'affected_columns': 0,
                 'removed_row': 'none',
                 'removed_column': 'none',
+                'revision': new_revision,
+                'history_position': target,
                 'form_data': form_data
             }
             return jsonify(result_dict), 200
@@ -631,263 +1442,19 @@ def analyze_missing_value(file_id):
                 'message': f'Column {column} not found in current DataFrame. It might have been deleted.'
             }), 400
 
-        # Call model.missing_handler with the updated DataFrame
+        # Run the operation on the working copy
         try:
-            # Prepare change entry for history before performing the operation
-            change_entry = {}
-            if method == "remove" and typee == "column":
-                # Store the column data before deleting
-                change_entry = {
-                    "operation": "delete_column",
-                    "column": column,
-                    "data": df[[column]].to_dict('records')
-                }
-            elif fill_method != "none":
-                # Store the original (null) values before filling
-                null_indices = df[df[column].isna()].index.tolist()
-                old_values = [{"index": idx, "value": None} for idx in null_indices]
-                change_entry = {
-                    "operation": "fill_missing",
-                    "column": column,
-                    "method": fill_method,
-                    "old_values": old_values
-                }
-
-            # Call missing_handler
-            if action == 'handel_missing_values':
-
-                result = model.missing_handler(
-                    df,
-                    column=column,
-                    Fill_Method=fill_method,
-                    value=value,
-                    method=method,
-                    type=typee
-                )
-                result_df = result.get('flagged_df')
-                if result_df is None:
-                    return jsonify({'message': 'Analysis failed: flagged_df not returned'}), 500
-    
-                # Handle NaN values before saving to MongoDB
-                result_df = result_df.where(pd.notnull(result_df), None)
-    
-                # Update history if there was a change
-                if change_entry:
-                    history.append(change_entry)
-    
-                # Update result_collection with the new result_df and history
-                result_collection.update_one(
-                    {"file_id": ObjectId(file_id), "email": email},
-                    {"$set": {
-                        "result_df": result_df.to_dict('records'),
-                        "history": history
-                    }}
-                )
-                result_dict = {
-                     'status': result.get('status', 'unknown'),
-                     'affected_rows': int(result.get('affected_rows', 0)) if result.get('affected_rows') else 0,
-                     'affected_columns': result.get('affected_columns', 0),
-                     'removed_row': result.get('removed_row', 'none'),
-                     'removed_column': result.get('removed_column', 'none'),
-                     'form_data': form_data
-                    }
-
-                return jsonify(result_dict), 200
-                
-            if action == 'remove_duplicates':
+            if action in MUTATING_ACTIONS:
                 try:
-                    result = model.remove_duplicates(df,column=column,typee=typee) 
-                except Exception as e:
-                    return jsonify({'message': f'Error in analysis: {str(e)}'}), 500 
-                result_df = result.get('flagged_df')
-                if result_df is None:
-                    return jsonify({'message': 'Analysis failed: flagged_df not returned'}), 500
-    
-                # Handle NaN values before saving to MongoDB
-                result_df = result_df.where(pd.notnull(result_df), None)
-    
-                # Update history if there was a change
-                if change_entry:
-                    history.append(change_entry)
-    
-                # Update result_collection with the new result_df and history
-                result_collection.update_one(
-                    {"file_id": ObjectId(file_id), "email": email},
-                    {"$set": {
-                        "result_df": result_df.to_dict('records'),
-                        "history": history
-                    }}
-                )
-                result_dict = {
-                       'status': result.get('status', ['unknown'])[0] if isinstance(result.get('status'), list) else result.get('status', 'unknown'),
-                       'message': result.get('message', ['none'])[0] if isinstance(result.get('message'), list) else result.get('message', 'none'),
-                       'error': str(result.get('error', 'none'))
-                    }                   
-                return jsonify(result_dict), 200
+                    result_df, result_dict = run_operation(df, form_data)
+                except OperationError as e:
+                    return jsonify({'message': e.message}), e.status
 
-
-            if action == 'outlier':
-                try:
-                    result = model.out_lier(df,column=column,fill_method=fill_method,method=outlier_method) 
-                except Exception as e:
-                    return jsonify({'message': f'Error in analysis: {str(e)}'}), 500 
-                result_df = result.get('flagged_df')
-                if result_df is None:
-                    return jsonify({'message': 'Analysis failed: flagged_df not returned'}), 500
-    
-                # Handle NaN values before saving to MongoDB
-                result_df = result_df.where(pd.notnull(result_df), None)
-    
-                # Update history if there was a change
-                if change_entry:
-                    history.append(change_entry)
-    
-                # Update result_collection with the new result_df and history
-                result_collection.update_one(
-                    {"file_id": ObjectId(file_id), "email": email},
-                    {"$set": {
-                        "result_df": result_df.to_dict('records'),
-                        "history": history
-                    }}
-                )
-    
-                result_dict = {
-                        'status': result.get('status', 'unknown'),
-                        'message': result.get('message', 'none'),
-                        'outliers': result.get('outliers', []).tolist(),
-                        'z_scores': result.get('z_scores', []).tolist() if result.get('z_scores') is not None else None,
-                        'stats': result.get('stats', {}),
-                        'outlier_indices': result.get('outlier_indices', [])
-                    }
-
-                return jsonify(result_dict), 200
-                
-            if action == 'fix_datatypes':
-                try:
-                    result = model.fix_datatypes(df,column=column,target_type = target_type) 
-                except Exception as e:
-                    return jsonify({'message': f'Error in analysis: {str(e)}'}), 500 
-                result_df = result.get('flagged_df')
-                if result_df is None:
-                    return jsonify({'message': 'Analysis failed: flagged_df not returned'}), 500
-    
-                # Handle NaN values before saving to MongoDB
-                result_df = result_df.where(pd.notnull(result_df), None)
-    
-                # Update history if there was a change
-                if change_entry:
-                    history.append(change_entry)
-    
-                # Update result_collection with the new result_df and history
-                result_collection.update_one(
-                    {"file_id": ObjectId(file_id), "email": email},
-                    {"$set": {
-                        "result_df": result_df.to_dict('records'),
-                        "history": history
-                    }}
-                )
-                result_dict = {
-                        'status': result.get('status', 'unknown'),
-                        'message': result.get('message', 'none'),
-                        'error': str(result.get('error', 'none'))
-                    }
-                return jsonify(result_dict), 200
-            if action == 'correct_data':
-                    try:
-                         result = model.correct_data(df,column=column,standardize_to= standardize_to) 
-                    except Exception as e:
-                            return jsonify({'message': f'Error in analysis: {str(e)}'}), 500 
-                    result_df = result.get('flagged_df')
-                    if result_df is None:
-                      return jsonify({'message': 'Analysis failed: flagged_df not returned'}), 500
-    
-                # Handle NaN values before saving to MongoDB
-                    result_df = result_df.where(pd.notnull(result_df), None)
-        
-                    # Update history if there was a change
-                    if change_entry:
-                        history.append(change_entry)
-        
-                    # Update result_collection with the new result_df and history
-                    result_collection.update_one(
-                        {"file_id": ObjectId(file_id), "email": email},
-                        {"$set": {
-                            "result_df": result_df.to_dict('records'),
-                            "history": history
-                        }}
-                    )
-                    result_dict = {
-                                  'status': result.get('status', 'unknown'),
-                                  'message': result.get('message', 'none'),
-                                  'error': str(result.get('error', 'none'))
-                                }
-                    return jsonify(result_dict), 200
-
-            if action == 'standardize_data':
-                try:
-                    result = model.standardize_data(df,column=column,rule=rule) 
-                except Exception as e:
-                    return jsonify({'message': f'Error in analysis: {str(e)}'}), 500 
-                result_df = result.get('flagged_df')
-                if result_df is None:
-                    return jsonify({'message': 'Analysis failed: flagged_df not returned'}), 500
-    
-                # Handle NaN values before saving to MongoDB
-                result_df = result_df.where(pd.notnull(result_df), None)
-    
-                # Update history if there was a change
-                if change_entry:
-                    history.append(change_entry)
-    
-                # Update result_collection with the new result_df and history
-                result_collection.update_one(
-                    {"file_id": ObjectId(file_id), "email": email},
-                    {"$set": {
-                        "result_df": result_df.to_dict('records'),
-                        "history": history
-                    }}
-                )
-                result_dict = {
-                        'status': result.get('status', 'unknown'),
-                        'message': result.get('message', 'none'),
-                        'error': str(result.get('error', 'none'))
-                    }
+                # Record the change in the undo log and persist the new working copy revision
+                commit_working_df(file_id, email, cached_df, result_df, log_position, revision,
+                                  [{'action': action, 'column': column}])
                 return jsonify(result_dict), 200
 
-            if action == 'remove_data':
-                try:
-                    result = model.remove_data(df,list_columns=list_columns,list_row=list_row) 
-                except Exception as e:
-                    return jsonify({'message': f'Error in analysis: {str(e)}'}), 500 
-                
-
-                result_df = result.get('flagged_df')
-                if result_df is None:
-                    return jsonify({'message': 'Analysis failed: flagged_df not returned'}), 500
-    
-                # Handle NaN values before saving to MongoDB
-                result_df = result_df.where(pd.notnull(result_df), None)
-    
-                # Update history if there was a change
-                if change_entry:
-                    history.append(change_entry)
-    
-                # Update result_collection with the new result_df and history
-                result_collection.update_one(
-                    {"file_id": ObjectId(file_id), "email": email},
-                    {"$set": {
-                        "result_df": result_df.to_dict('records'),
-                        "history": history
-                    }}
-                )
-                result_dict = {
-                            'status': result.get('status', 'unknown'),
-                            'removed_columns': result.get('removed_columns', 'none'),
-                            'removed_rowes': result.get('removed_rowes', 'none'),
-                            'message': result.get('message', 'none'),
-                            'error': str(result.get('error', 'none'))
-                        }
-                return jsonify(result_dict), 200
             if action == 'summary_data':
                 result = model.summary_csv(
                     df
@@ -926,16 +1493,303 @@ def analyze_missing_value(file_id):
 
 
 
+# Apply an ordered list of cleaning operations with one load and one persist
+@app.route('/pipeline/<file_id>', methods=['POST', 'OPTIONS'])
+@require_auth
+def run_cleaning_pipeline(file_id):
+    try:
+        started = time.perf_counter()
+        email = g.email
+
+        try:
+            file_doc = files_collection.find_one({'_id': ObjectId(file_id), 'email': email}, METADATA_PROJECTION)
+            if not file_doc:
+                return jsonify({'message': 'File not found or you do not have access'}), 404
+        except Exception:
+            return jsonify({'message': 'Invalid file ID format'}), 400
+
+        if file_doc['filetype'] != 'csv':
+            return jsonify({'message': 'Only CSV files can be analyzed'}), 400
+
+        try:
+            steps = normalize_steps((request.json or {}).get('steps'))
+        except ValueError as e:
+            return jsonify({'message': f'Invalid pipeline: {str(e)}'}), 400
+
+        def apply(progress=None):
+            # Returns (response body, status)
+            try:
+                cached_df, log_position, revision = load_working_df(file_id, email, file_doc)
+            except LookupError:
+                return {'message': 'File not found or you do not have access'}, 404
+            except UnicodeDecodeError:
+                return {'message': 'Error decoding CSV data'}, 400
+            except Exception as e:
+                return {'message': f'Error reading CSV: {str(e)}'}, 400
+            loaded = time.perf_counter()
+            if progress is not None:
+                progress('load', rows=int(cached_df.shape[0]), columns=int(cached_df.shape[1]))
+
+            # One private copy for the whole pipeline; cached frames are shared between requests
+            try:
+                result_df, step_results = run_pipeline(cached_df.copy(), steps, progress=progress)
+            except OperationError as e:
+                # Nothing is persisted when a step fails
+                return {
+                    'message': e.message,
+                    'failed_step': e.step,
+                    'steps': e.step_results
+                }, e.status
+            applied = time.perf_counter()
+
+            new_revision, _ = commit_working_df(file_id, email, cached_df, result_df, log_position, revision,
+                                                step_summaries(step_results))
+            persisted = time.perf_counter()
+
+            print(f"Pipeline of {len(steps)} steps on file {file_id}: "
+                  f"{sum(step['fused'] for step in step_results)} fused, {persisted - started:.3f}s")
+            return {
+                'status': 'success',
+                'message': 'Pipeline applied successfully',
+                'revision': new_revision,
+                'rows': int(result_df.shape[0]),
+                'columns': int(result_df.shape[1]),
+                'steps': step_results,
+                'timings': {
+                    'load': round(loaded - started, 6),
+                    'steps': round(applied - loaded, 6),
+                    'persist': round(persisted - applied, 6),
+                    'total': round(persisted - started, 6)
+                }
+            }, 200
+
+        # `?events=1` or Accept: text/event-stream reports every step as it finishes
+        if events_requested():
+            return progress_events(apply)
+        body, status = apply()
+        return jsonify(body), status
+    except Exception as e:
+        print(f"Pipeline error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
+
+# Undo log of a working copy: GET lists it, POST {"position": n} moves the working copy to an entry
+@app.route('/history/<file_id>', methods=['GET', 'POST', 'OPTIONS'])
+@require_auth
+def working_history(file_id):
+    try:
+        email = g.email
+
+        try:
+            file_doc = files_collection.find_one({'_id': ObjectId(file_id), 'email': email}, METADATA_PROJECTION)
+            if not file_doc:
+                return jsonify({'message': 'File not found or you do not have access'}), 404
+        except Exception:
+            return jsonify({'message': 'Invalid file ID format'}), 400
+
+        if request.method == 'GET':
+            current = result_collection.find_one({'file_id': ObjectId(file_id), 'email': email},
+                                                 {'log_position': 1, 'revision': 1})
+            if current and 'log_position' not in current:
+                # Saved before the undo log existed; loading imports its revert list
+                current['log_position'] = load_working_df(file_id, email, file_doc)[1]
+            position = current.get('log_position', 0) if current else 0
+            history = revision_log.history(ObjectId(file_id), email, position)
+            history['revision'] = current.get('revision', 0) if current else 0
+            return jsonify({'history': history, 'message': 'History retrieved successfully'}), 200
+
+        try:
+            target = int((request.json or {})['position'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'message': 'position must be an integer'}), 400
+        try:
+            cached_df, log_position, revision = load_working_df(file_id, email, file_doc)
+        except LookupError:
+            return jsonify({'message': 'File not found or you do not have access'}), 404
+        try:
+            restored_df = revision_log.checkout(ObjectId(file_id), email, log_position, cached_df, target)
+        except LookupError as e:
+            return jsonify({'message': str(e)}), 400
+        new_revision = save_working_df(file_id, email, restored_df, target, revision, cached_df)
+        return jsonify({
+            'status': 'success',
+            'message': f'Working copy moved to history position {target}',
+            'revision': new_revision,
+            'history_position': target,
+            'rows': int(restored_df.shape[0]),
+            'columns': int(restored_df.shape[1])
+        }), 200
+    except Exception as e:
+        print(f"History error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
+
+# Saved cleaning recipes: POST stores a new version, GET lists the latest versions
+@app.route('/recipes', methods=['GET', 'POST', 'OPTIONS'])
+@require_auth
+def recipe_collection():
+    try:
+        email = g.email
+
+        if request.method == 'GET':
+            return jsonify({
+                'recipes': [recipe_to_json(recipe) for recipe in recipes.list(email)],
+                'message': 'Recipes retrieved successfully'
+            }), 200
+
+        form_data = request.json or {}
+        try:
+            recipe = recipes.save(email, form_data.get('name'), form_data.get('steps'),
+                                  description=form_data.get('description', ''))
+        except ValueError as e:
+            return jsonify({'message': f'Invalid recipe: {str(e)}'}), 400
+        print(f"Saved recipe {recipe['name']} v{recipe['version']} for email: {email}")
+        return jsonify({'recipe': recipe_to_json(recipe), 'message': 'Recipe saved successfully'}), 201
+    except Exception as e:
+        print(f"Recipes error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
+
+# One recipe, the latest version unless ?version=<n> is given
+@app.route('/recipes/<name>', methods=['GET', 'OPTIONS'])
+@require_auth
+def get_recipe(name):
+    try:
+        email = g.email
+
+        try:
+            recipe = recipes.get(email, name, request.args.get('version'))
+        except ValueError:
+            return jsonify({'message': 'Invalid recipe version'}), 400
+        if not recipe:
+            return jsonify({'message': 'Recipe not found'}), 404
+        return jsonify({'recipe': recipe_to_json(recipe), 'message': 'Recipe retrieved successfully'}), 200
+    except Exception as e:
+        print(f"Recipe error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
+
+# Apply a recipe to a batch of files: {"file_ids": [...], "version": <n, optional>}
+@app.route('/recipes/<name>/runs', methods=['POST', 'OPTIONS'])
+@require_auth
+def start_recipe_run(name):
+    try:
+        email = g.email
+
+        form_data = request.json or {}
+        file_ids = form_data.get('file_ids')
+        if not isinstance(file_ids, list) or not file_ids:
+            return jsonify({'message': 'file_ids must be a non-empty list'}), 400
+        if len(set(file_ids)) != len(file_ids):
+            return jsonify({'message': 'file_ids must not repeat a file'}), 400
+        if not all(isinstance(file_id, str) and ObjectId.is_valid(file_id) for file_id in file_ids):
+            return jsonify({'message': 'Invalid file ID format'}), 400
+
+        try:
+            recipe = recipes.get(email, name, form_data.get('version'))
+        except ValueError:
+            return jsonify({'message': 'Invalid recipe version'}), 400
+        if not recipe:
+            return jsonify({'message': 'Recipe not found'}), 404
+
+        run_id = recipe_runner.start(email, recipe, file_ids)
+        print(f"Started recipe run {run_id} ({recipe['name']} v{recipe['version']}, {len(file_ids)} files)")
+        return jsonify({
+            'run_id': run_id,
+            'recipe': recipe['name'],
+            'version': recipe['version'],
+            'status': 'running',
+            'message': 'Recipe run started'
+        }), 202
+    except Exception as e:
+        print(f"Recipe run error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
+
+# Progress and per-file results of a recipe run
+@app.route('/recipe-runs/<run_id>', methods=['GET', 'OPTIONS'])
+@require_auth
+def recipe_run(run_id):
+    try:
+        email = g.email
+
+        run = recipe_runner.get(run_id, email)
+        if not run:
+            return jsonify({'message': 'Recipe run not found or you do not have access'}), 404
+
+        run = {k: v for k, v in run.items() if k not in ('_id', 'email')}
+        run['run_id'] = run_id
+        for entry in [run] + run['files']:
+            for key in ('submitted_at', 'started_at', 'finished_at'):
+                if entry.get(key):
+                    entry[key] = entry[key].isoformat()
+        return jsonify({'run': run, 'message': 'Recipe run retrieved successfully'}), 200
+    except Exception as e:
+        print(f"Recipe run error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
+
+# DataFrame cache statistics
+@app.route('/cache-stats', methods=['GET', 'OPTIONS'])
+@require_auth
+def cache_stats():
+    try:
+        stats = dataframe_cache.stats()
+        if dataframe_cache.compact:
+            # Before/after memory per column of every cached frame
+            stats['compaction'] = dataframe_cache.compaction_reports()
+        return jsonify({'dataframe_cache': stats, 'auth_cache': authenticator.stats(), 'message': 'Cache statistics retrieved successfully'}), 200
+    except Exception as e:
+        print(f"Cache stats error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
+
+# MongoDB connection pool settings and per-query latency
+@app.route('/db-stats', methods=['GET', 'OPTIONS'])
+@require_auth
+def db_stats():
+    try:
+        return jsonify({
+            'pool': mongo_pool_settings,
+            'metrics': query_metrics.stats(),
+            'message': 'Database statistics retrieved successfully'
+        }), 200
+    except Exception as e:
+        print(f"DB stats error: {str(e)}")
+        return jsonify({'message': f'Error: {str(e)}'}), 500
+
+# JSON bodies above this size are gzip/brotli compressed for clients that accept it
+COMPRESS_MIN_BYTES = int(os.environ.get('DATAMIND_COMPRESS_MIN_BYTES', '1024'))
+
+@app.after_request
+def compress_json_response(response):
+    return compress_response(response, request.accept_encodings, min_bytes=COMPRESS_MIN_BYTES)
 
 # CORS middleware
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': 'http://localhost:5173',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, Range, If-None-Match, If-Range',
+    'Access-Control-Expose-Headers': 'ETag, Content-Range, Content-Disposition',
+    'Access-Control-Allow-Methods': 'GET, POST, PATCH, DELETE, OPTIONS',
+    'Access-Control-Allow-Credentials': 'true'
+}
+
 @app.after_request
 def add_cors_headers(response):
-    response.headers['Access-Control-Allow-Origin'] = 'http://localhost:5173'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PATCH, DELETE, OPTIONS'
-    response.headers['Access-Control-Allow-Credentials'] = 'true'
+    response.headers.update(CORS_HEADERS)
     return response
 
+def prepare_server():
+    """
+    One-off startup work, run once before serving (and before any worker processes start).
+    """
+    # Indexes for the routes' queries; creating an existing index is a no-op
+    if os.environ.get('DATAMIND_CREATE_INDEXES', '1') == '1':
+        ensure_indexes(db)
+    # Move any pre-GridFS uploads out of their inline `data` field before serving
+    if os.environ.get('DATAMIND_MIGRATE_INLINE_FILES') == '1':
+        print(f"Migrated {file_storage.migrate_inline_files()} inline files to GridFS")
+    # Jobs from a previous run died with their worker processes
+    print(f"Marked {analysis_jobs.recover()} interrupted analysis jobs as failed")
+    print(f"Marked {recipe_runner.recover()} interrupted recipe runs as failed")
+    # Plot images stored before their owners were tracked
+    print(f"Recorded the owners of {plot_store.adopt(analysis_collection)} plot images")
+
 if __name__ == '__main__':
+    # Development server; production runs asgi.py
+    prepare_server()
     app.run(debug=True, port=5000)
 
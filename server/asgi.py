@@ -0,0 +1,280 @@
+"""
+Production entry point: serves the API over ASGI with uvicorn.
+
+    pip install -r requirements.txt
+    python asgi.py
+
+Routes that mostly wait on MongoDB (login and registration, file history,
+the current file, file metadata and the undo/redo history of a working copy)
+are answered by coroutines on a Motor client, so a slow query holds no
+thread; their CPU-bound parts (password hashing, avatar thumbnails) run in
+Starlette's thread pool. Every other route runs the Flask app of app.py in a
+bounded thread pool, which is where the CPU-bound pandas and `model` work happens; the event
+loop keeps serving the async routes while those threads are busy, and long
+analyses can still be sent to the process pool of /analyze/<file_id>/jobs.
+Tokens are checked against the authenticator's cache, so authentication does
+not block the loop either. Moving a working copy through its history (POST
+/history/<file_id>) stays a Flask route. The async routes answer with the same bodies,
+status codes and headers as their Flask counterparts, which stay in app.py for
+the development server.
+
+Settings (environment):
+    DATAMIND_HOST, DATAMIND_PORT: Bind address (default 0.0.0.0:5000).
+    DATAMIND_WORKERS: Server processes (default 1).
+    DATAMIND_WSGI_THREADS: Threads per process running Flask routes (default 8).
+    DATAMIND_MAX_CONCURRENCY: Connections per process before new ones get 503 (default unlimited).
+    DATAMIND_SHUTDOWN_TIMEOUT: Seconds in-flight requests get to finish on shutdown (default 30).
+    DATAMIND_SHUTDOWN_WAIT_JOBS: '1' (default) lets running analysis jobs finish on shutdown,
+        '0' abandons them; they are marked as interrupted on the next start.
+"""
+import functools
+import os
+from contextlib import asynccontextmanager
+
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route, Router
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from app import (COMPRESS_MIN_BYTES, CORS_HEADERS, FILES_PAGE_DEFAULT, FILES_SORT, MONGO_POOL_OPTIONS, MONGO_URI,
+                 allowed_file, analysis_jobs, app, authenticator, avatar_store, bcrypt, db, encode_files_cursor,
+                 file_to_json, files_history_request, files_page, issue_token, load_working_df, ndjson_line,
+                 prepare_server, query_metrics)
+from auth import AuthError
+from data_access import connect
+from file_storage import METADATA_PROJECTION, PUBLIC_PROJECTION
+from response_encoding import compress_response
+from revision_log import ENTRY_SUMMARY_PROJECTION, SNAPSHOT_SUMMARY_PROJECTION, history_summary
+
+HOST = os.environ.get('DATAMIND_HOST', '0.0.0.0')
+PORT = int(os.environ.get('DATAMIND_PORT', '5000'))
+WORKERS = int(os.environ.get('DATAMIND_WORKERS', '1'))
+WSGI_THREADS = int(os.environ.get('DATAMIND_WSGI_THREADS', '8'))
+MAX_CONCURRENCY = int(os.environ['DATAMIND_MAX_CONCURRENCY']) if 'DATAMIND_MAX_CONCURRENCY' in os.environ else None
+SHUTDOWN_TIMEOUT = int(os.environ.get('DATAMIND_SHUTDOWN_TIMEOUT', '30'))
+SHUTDOWN_WAIT_JOBS = os.environ.get('DATAMIND_SHUTDOWN_WAIT_JOBS', '1') == '1'
+
+# Motor collections of this process, opened on startup inside the event loop
+mongo = {}
+
+
+@asynccontextmanager
+async def lifespan(router):
+    mongo['client'], _ = connect(MONGO_URI, metrics=query_metrics, client_class=AsyncIOMotorClient,
+                                 **MONGO_POOL_OPTIONS)
+    database = mongo['client'][db.name]
+    mongo['users'] = database['users']
+    mongo['files'] = database['user_files']
+    mongo['results'] = database['result_df']
+    mongo['history'] = database['result_df_history']
+    mongo['snapshots'] = database['result_df_snapshots']
+    yield
+    # uvicorn has drained in-flight requests by now
+    mongo['client'].close()
+    analysis_jobs.shutdown(wait=SHUTDOWN_WAIT_JOBS)
+
+
+def json_response(request, body, status=200):
+    """
+    Renders a JSON response exactly like the Flask routes: same encoder, compression and CORS headers.
+    """
+    response = app.json.response(body)
+    response.status_code = status
+    response = compress_response(response, parse_accept_header(request.headers.get('accept-encoding')),
+                                 min_bytes=COMPRESS_MIN_BYTES)
+    response.headers.update(CORS_HEADERS)
+    return Response(response.get_data(), status_code=status, headers=dict(response.headers))
+
+
+def require_auth(view):
+    """
+    Async counterpart of app.require_auth; the view is called with the caller's email.
+    """
+    @functools.wraps(view)
+    async def wrapper(request):
+        if request.method == 'OPTIONS':
+            return json_response(request, {})
+        try:
+            email = authenticator.verify(request.headers.get('authorization'))
+        except AuthError as e:
+            return json_response(request, {'message': e.message}, 401)
+        return await view(request, email)
+    return wrapper
+
+
+async def register(request):
+    if request.method == 'OPTIONS':
+        return json_response(request, {})
+    try:
+        form = await request.form()
+        email = form.get('email')
+        password = form.get('password')
+        username = form.get('username')
+        photo = form.get('photo')
+
+        if not email or not password or not username:
+            return json_response(request, {'message': 'Email, Password, and Username are required'}, 400)
+
+        if await mongo['users'].find_one({'email': email}):
+            return json_response(request, {'message': 'Email already exists'}, 400)
+
+        avatar = None
+        if isinstance(photo, UploadFile) and allowed_file(photo.filename or ''):
+            try:
+                avatar = await run_in_threadpool(avatar_store.put_photo, await photo.read())
+            except ValueError as e:
+                # The account is created without an avatar
+                print(f"Ignoring photo of {email}: {str(e)}")
+
+        hashed_password = (await run_in_threadpool(bcrypt.generate_password_hash, password)).decode('utf-8')
+        await mongo['users'].insert_one({
+            'email': email,
+            'password': hashed_password,
+            'username': username,
+            'avatar': avatar
+        })
+        return json_response(request, {'message': 'User registered successfully'}, 201)
+    except Exception as e:
+        print(f"Register error: {str(e)}")
+        return json_response(request, {'message': f'Error: {str(e)}'}, 500)
+
+
+async def login(request):
+    if request.method == 'OPTIONS':
+        return json_response(request, {})
+    try:
+        data = await request.json()
+        email = data.get('email')
+        password = data.get('password')
+
+        user = await mongo['users'].find_one({'email': email})
+        if not user or not await run_in_threadpool(bcrypt.check_password_hash, user['password'], password):
+            return json_response(request, {'message': 'Invalid credentials'}, 401)
+
+        return json_response(request, {'token': issue_token(email), 'message': 'Login successful'})
+    except Exception as e:
+        print(f"Login error: {str(e)}")
+        return json_response(request, {'message': f'Unexpected error: {str(e)}'}, 500)
+
+
+@require_auth
+async def files_history(request, email):
+    try:
+        accept = parse_accept_header(request.headers.get('accept'), MIMEAccept)
+        try:
+            plan = files_history_request(email, request.query_params, accept.best == 'application/x-ndjson')
+        except ValueError as e:
+            return json_response(request, {'message': str(e)}, 400)
+        files = mongo['files']
+        query, page, paginated = plan['query'], plan['page'], plan['paginated']
+
+        if not paginated and not plan['stream']:
+            docs = await files.find(query, PUBLIC_PROJECTION).to_list(length=None)
+            return json_response(request, {'files': [file_to_json(file) for file in docs],
+                                           'message': 'File history retrieved successfully'})
+
+        cursor = files.find(query, PUBLIC_PROJECTION).sort(FILES_SORT)
+        if paginated:
+            cursor = cursor.limit(page + 1)
+
+        if plan['stream']:
+            async def generate():
+                sent, last = 0, None
+                async for file in cursor.batch_size(FILES_PAGE_DEFAULT):
+                    if paginated and sent == page:
+                        yield ndjson_line({'next_cursor': encode_files_cursor(last)})
+                        break
+                    last = dict(file)
+                    yield ndjson_line(file_to_json(file))
+                    sent += 1
+            return StreamingResponse(generate(), media_type='application/x-ndjson', headers=CORS_HEADERS)
+
+        return json_response(request, files_page(await cursor.to_list(length=page + 1), page))
+    except Exception as e:
+        print(f"Files history error: {str(e)}")
+        return json_response(request, {'message': f'Error: {str(e)}'}, 500)
+
+
+@require_auth
+async def current_files(request, email):
+    try:
+        cursor = mongo['files'].find({'email': email}, PUBLIC_PROJECTION).sort('upload_date', -1).limit(1)
+        files = [file_to_json(file) for file in await cursor.to_list(length=1)]
+        return json_response(request, {'files': files, 'message': 'File history retrieved successfully'})
+    except Exception as e:
+        print(f"Current files error: {str(e)}")
+        return json_response(request, {'message': f'Error: {str(e)}'}, 500)
+
+
+@require_auth
+async def get_file(request, email):
+    try:
+        file_id = request.path_params['file_id']
+        file_doc = await mongo['files'].find_one({'_id': ObjectId(file_id), 'email': email}, PUBLIC_PROJECTION)
+        if not file_doc:
+            return json_response(request, {'message': 'File not found or you do not have access'}, 404)
+        return json_response(request, {'file': file_to_json(file_doc), 'message': 'File retrieved successfully'})
+    except Exception as e:
+        print(f"Get file error: {str(e)}")
+        return json_response(request, {'message': f'Error: {str(e)}'}, 500)
+
+
+@require_auth
+async def working_history(request, email):
+    try:
+        try:
+            file_id = ObjectId(request.path_params['file_id'])
+            file_doc = await mongo['files'].find_one({'_id': file_id, 'email': email}, METADATA_PROJECTION)
+            if not file_doc:
+                return json_response(request, {'message': 'File not found or you do not have access'}, 404)
+        except Exception:
+            return json_response(request, {'message': 'Invalid file ID format'}, 400)
+
+        key = {'file_id': file_id, 'email': email}
+        current = await mongo['results'].find_one(key, {'log_position': 1, 'revision': 1})
+        if current and 'log_position' not in current:
+            # Saved before the undo log existed; loading imports its revert list
+            _, current['log_position'], _ = await run_in_threadpool(load_working_df, str(file_id), email, file_doc)
+        position = current.get('log_position', 0) if current else 0
+        entries = await mongo['history'].find(key, ENTRY_SUMMARY_PROJECTION).sort('seq', 1).to_list(length=None)
+        snapshots = await (mongo['snapshots'].find({**key, 'name': None}, SNAPSHOT_SUMMARY_PROJECTION)
+                           .sort('seq', 1).to_list(length=None))
+        history = history_summary(position, entries, snapshots)
+        history['revision'] = current.get('revision', 0) if current else 0
+        return json_response(request, {'history': history, 'message': 'History retrieved successfully'})
+    except Exception as e:
+        print(f"History error: {str(e)}")
+        return json_response(request, {'message': f'Error: {str(e)}'}, 500)
+
+
+flask_routes = WSGIMiddleware(app, workers=WSGI_THREADS)
+
+# Async routes first; everything else goes to Flask in the thread pool
+application = Router(
+    routes=[
+        Route('/register', register, methods=['POST', 'OPTIONS']),
+        Route('/login', login, methods=['POST', 'OPTIONS']),
+        Route('/files-history', files_history, methods=['GET', 'OPTIONS']),
+        Route('/current_files', current_files, methods=['GET', 'OPTIONS']),
+        Route('/file/{file_id}', get_file, methods=['GET', 'OPTIONS']),
+        Route('/history/{file_id}', working_history, methods=['GET', 'OPTIONS']),
+        # Restoring a history position rebuilds the frame, which is pandas work
+        Route('/history/{file_id}', flask_routes, methods=['POST'])
+    ],
+    default=flask_routes,
+    lifespan=lifespan,
+    # Flask answers unknown trailing-slash variants with 404; do not redirect them
+    redirect_slashes=False
+)
+
+if __name__ == '__main__':
+    # Startup work runs once here, not in every worker process
+    prepare_server()
+    uvicorn.run('asgi:application', host=HOST, port=PORT, workers=WORKERS, lifespan='on',
+                limit_concurrency=MAX_CONCURRENCY, timeout_graceful_shutdown=SHUTDOWN_TIMEOUT)
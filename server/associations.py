@@ -0,0 +1,301 @@
+"""
+Mixed-type association measures for analyze_csv_with_ai.
+
+Each pair of columns gets the measure that fits its types:
+    - numeric / numeric: Pearson correlation over pairwise-complete rows
+      (as DataFrame.corr), in [-1, 1],
+    - categorical / categorical: Cramér's V of the contingency table, in [0, 1],
+    - numeric / categorical: correlation ratio (eta) of the numeric column
+      grouped by the categorical one, in [0, 1].
+
+Everything is computed with matrix products instead of per-pair loops over
+rows: numeric columns are centred floats with a missing-value mask, and
+categorical columns are one-hot matrices (built in row chunks), so
+contingency tables and per-level sums for whole blocks of columns come out of
+one product each.
+Categorical blocks hold at most BLOCK_LEVELS levels in total.
+Columns are processed in blocks of BLOCK_COLUMNS, so peak memory depends on
+the block size rather than on the width of the file, and `top_pairs` keeps
+only the strongest pairs instead of a full k x k matrix.
+
+Categorical columns with more than MAX_LEVELS distinct values keep their
+MAX_LEVELS - 1 most frequent values and fold the rest into one level.
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+BLOCK_COLUMNS = 64
+MAX_LEVELS = 100
+# Categorical blocks are sized so that the dense contingency tables of two blocks stay small
+BLOCK_LEVELS = 1024
+# One-hot matrices are materialised in row chunks of this many cells
+CHUNK_CELLS = 1 << 22
+
+MEASURES = {
+    'numeric-numeric': 'pearson',
+    'categorical-categorical': 'cramers_v',
+    'numeric-categorical': 'correlation_ratio'
+}
+
+
+def _blocks(columns, size):
+    return [columns[start:start + size] for start in range(0, len(columns), size)]
+
+
+def _numeric_block(df, cols):
+    """
+    Returns:
+        Tuple of (centred values with 0 for missing, 0/1 presence mask), both n x len(cols).
+    """
+    values = df[cols].to_numpy(dtype=float, na_value=np.nan)
+    present = ~np.isnan(values)
+    with warnings.catch_warnings():
+        # All-missing columns have no mean; they are masked out entirely
+        warnings.simplefilter('ignore', RuntimeWarning)
+        means = np.nanmean(values, axis=0)
+    centred = np.where(present, values - np.nan_to_num(means), 0.0)
+    return centred, present.astype(float)
+
+
+def _codes(series, max_levels=MAX_LEVELS):
+    codes, uniques = pd.factorize(series)
+    levels = len(uniques)
+    if levels > max_levels:
+        # Keep the most frequent values, fold the tail into one level
+        counts = np.bincount(codes[codes >= 0], minlength=levels)
+        keep = np.argsort(-counts, kind='stable')[:max_levels - 1]
+        remap = np.full(levels, max_levels - 1)
+        remap[keep] = np.arange(max_levels - 1)
+        codes = np.where(codes >= 0, remap[np.maximum(codes, 0)], -1)
+        levels = max_levels
+    return codes, levels
+
+
+def _categorical_block(codes):
+    """
+    Args:
+        codes: List of (codes, levels) of the block's columns, from _codes.
+    Returns:
+        Tuple of (n x len(codes) matrix of level indices numbered across the
+        block, -1 for missing values; level offsets of each column, length len(codes) + 1).
+    """
+    offsets = np.concatenate([[0], np.cumsum([levels for _, levels in codes])]).astype(np.intp)
+    levels = np.column_stack([
+        np.where(column_codes >= 0, column_codes + offset, -1)
+        for (column_codes, _), offset in zip(codes, offsets[:-1])
+    ]).astype(np.int32)
+    return levels, offsets
+
+
+def _one_hot(levels, width):
+    one_hot = np.zeros((len(levels), width))
+    flat = np.arange(len(levels))[:, None] * width + levels
+    one_hot.ravel()[flat[levels >= 0]] = 1.0
+    return one_hot
+
+
+def _level_sums(categorical, right, right_width):
+    """
+    Sums of `right` per level of a categorical block, i.e. one_hot.T @ right,
+    with the one-hot matrix built in row chunks of at most CHUNK_CELLS cells.
+    Args:
+        right: Callable (start, stop) -> dense rows of the right-hand matrix.
+    """
+    levels, offsets = categorical
+    width = offsets[-1]
+    step = max(1, CHUNK_CELLS // max(width, right_width, 1))
+    total = np.zeros((width, right_width))
+    for start in range(0, len(levels), step):
+        total += _one_hot(levels[start:start + step], width).T @ right(start, start + step)
+    return total
+
+
+def _pearson(a, b):
+    xa, ma = a
+    xb, mb = b
+    n = ma.T @ mb
+    sa = xa.T @ mb
+    sb = ma.T @ xb
+    saa = (xa * xa).T @ mb
+    sbb = ma.T @ (xb * xb)
+    sab = xa.T @ xb
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = (n * saa - sa * sa) * (n * sbb - sb * sb)
+        r = (n * sab - sa * sb) / np.sqrt(var)
+    r[(n < 2) | ~(var > 0)] = np.nan
+    return np.clip(r, -1.0, 1.0)
+
+
+def _segment_sum(values, offsets, axis):
+    """
+    Sums `values` over each column's levels, i.e. over the slices between
+    consecutive `offsets` along `axis`. Columns without levels sum to 0.
+    """
+    sizes = np.diff(offsets)
+    shape = list(values.shape)
+    shape[axis] = len(sizes)
+    result = np.zeros(shape)
+    if (sizes > 0).any():
+        # reduceat cannot express empty slices; skipping them leaves the others intact
+        sums = np.add.reduceat(values, offsets[:-1][sizes > 0], axis=axis)
+        np.moveaxis(result, axis, 0)[sizes > 0] = np.moveaxis(sums, axis, 0)
+    return result
+
+
+def _cramers_block(a, b):
+    """
+    Cramér's V for every pair of columns of two categorical blocks, from all
+    their contingency tables at once: the tables are the sub-blocks of A^T B
+    for the one-hot matrices A and B.
+    """
+    offsets_a = a[1]
+    levels_b, offsets_b = b
+    tables = _level_sums(a, lambda start, stop: _one_hot(levels_b[start:stop], offsets_b[-1]), offsets_b[-1])
+    owner_a = np.repeat(np.arange(len(offsets_a) - 1), np.diff(offsets_a))
+    owner_b = np.repeat(np.arange(len(offsets_b) - 1), np.diff(offsets_b))
+
+    # Row totals of table (i, j) for each level of i, column totals for each level of j
+    row_totals = _segment_sum(tables, offsets_b, axis=1)
+    col_totals = _segment_sum(tables, offsets_a, axis=0)
+    n = _segment_sum(row_totals, offsets_a, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = row_totals[:, owner_b] * col_totals[owner_a, :]
+        ratio = np.where(tables > 0, tables * tables / expected, 0.0)
+        chi2 = n * (_segment_sum(_segment_sum(ratio, offsets_b, axis=1), offsets_a, axis=0) - 1)
+        # Levels that never co-occur with the other column do not count towards the table size
+        k = np.minimum(_segment_sum((row_totals > 0).astype(float), offsets_a, axis=0),
+                       _segment_sum((col_totals > 0).astype(float), offsets_b, axis=1))
+        v = np.sqrt(np.clip(chi2, 0.0, None) / (n * (k - 1)))
+    v[(n == 0) | (k < 2)] = np.nan
+    return np.clip(v, 0.0, 1.0)
+
+
+def _correlation_ratio(categorical, numeric):
+    offsets = categorical[1]
+    values, present = numeric
+    p = values.shape[1]
+    stacked = _level_sums(categorical, lambda start, stop: np.hstack([
+        present[start:stop], values[start:stop], values[start:stop] ** 2
+    ]), 3 * p)
+    counts, sums, squares = stacked[:, :p], stacked[:, p:2 * p], stacked[:, 2 * p:]
+    n = _segment_sum(counts, offsets, axis=0)
+    total = _segment_sum(sums, offsets, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between_terms = np.where(counts > 0, sums * sums / counts, 0.0)
+        correction = total * total / n
+        ss_total = _segment_sum(squares, offsets, axis=0) - correction
+        ss_between = _segment_sum(between_terms, offsets, axis=0) - correction
+        eta = np.sqrt(np.clip(ss_between, 0.0, None) / ss_total)
+    eta[(n < 2) | ~(ss_total > 0)] = np.nan
+    return np.clip(eta, 0.0, 1.0)
+
+
+class AssociationEngine:
+    """
+    Association measures between the given columns of a DataFrame.
+    Args:
+        df: The analysed frame; it is only read, never copied as a whole.
+        numerical_cols, categorical_cols: Column groups from the analysis.
+        block_size: Columns per block.
+    """
+    def __init__(self, df, numerical_cols, categorical_cols, block_size=BLOCK_COLUMNS):
+        self.df = df
+        numerical, categorical = set(numerical_cols), set(categorical_cols)
+        self.columns = [col for col in df.columns if col in numerical or col in categorical]
+        self.numerical_cols = [col for col in self.columns if col in numerical]
+        self.categorical_cols = [col for col in self.columns if col in categorical]
+        self.block_size = block_size
+        self.position = {col: i for i, col in enumerate(self.columns)}
+        self._codes = {}
+
+    @property
+    def size(self):
+        return len(self.columns)
+
+    def _categorical(self, cols):
+        # Factorising is the expensive part; the codes are kept for the blocks that come back
+        for col in cols:
+            if col not in self._codes:
+                codes, levels = _codes(self.df[col])
+                self._codes[col] = (codes.astype(np.int32), levels)
+        return _categorical_block([self._codes[col] for col in cols])
+
+    def iter_blocks(self):
+        """
+        Yields (row columns, column columns, values) for every block of the upper
+        triangle of the association matrix, diagonal blocks included.
+        """
+        numeric_blocks = _blocks(self.numerical_cols, self.block_size)
+        categorical_blocks = _blocks(self.categorical_cols, max(1, min(self.block_size, BLOCK_LEVELS // MAX_LEVELS)))
+
+        for i, cols_a in enumerate(numeric_blocks):
+            block_a = _numeric_block(self.df, cols_a)
+            for cols_b in numeric_blocks[i:]:
+                block_b = block_a if cols_b is cols_a else _numeric_block(self.df, cols_b)
+                yield cols_a, cols_b, _pearson(block_a, block_b)
+            for cols_b in categorical_blocks:
+                eta = _correlation_ratio(self._categorical(cols_b), block_a)
+                yield cols_a, cols_b, eta.T
+
+        for i, cols_a in enumerate(categorical_blocks):
+            block_a = self._categorical(cols_a)
+            for cols_b in categorical_blocks[i:]:
+                block_b = block_a if cols_b is cols_a else self._categorical(cols_b)
+                yield cols_a, cols_b, _cramers_block(block_a, block_b)
+
+    def matrix(self):
+        """
+        Returns:
+            Symmetric DataFrame of association values in the frame's column order.
+        """
+        k = self.size
+        values = np.full((k, k), np.nan)
+        for cols_a, cols_b, block in self.iter_blocks():
+            rows = [self.position[col] for col in cols_a]
+            cols = [self.position[col] for col in cols_b]
+            values[np.ix_(rows, cols)] = block
+            values[np.ix_(cols, rows)] = block.T
+        # Exactly 1 for columns with at least two distinct values, NaN for constant or empty ones
+        diagonal = np.diag_indices(k)
+        values[diagonal] = np.where(np.isnan(values[diagonal]), np.nan, 1.0)
+        return pd.DataFrame(values, index=self.columns, columns=self.columns)
+
+    def measure(self, col_a, col_b):
+        numeric = (col_a in self.numerical_cols) + (col_b in self.numerical_cols)
+        return MEASURES[('categorical-categorical', 'numeric-categorical', 'numeric-numeric')[numeric]]
+
+    def top_pairs(self, k):
+        """
+        The k column pairs with the strongest association (largest absolute value),
+        found block by block without building the full matrix.
+        Returns:
+            List of {"columns": [a, b], "measure", "value"} dicts, strongest first.
+        """
+        best_values = np.empty(0)
+        best_pairs = []
+        for cols_a, cols_b, block in self.iter_blocks():
+            rows = np.array([self.position[col] for col in cols_a])
+            cols = np.array([self.position[col] for col in cols_b])
+            keep = ~np.isnan(block)
+            if cols_a is cols_b:
+                # Diagonal block: upper triangle only, so each pair counts once
+                keep &= rows[:, None] < cols[None, :]
+            ii, jj = np.nonzero(keep)
+            if len(ii) == 0:
+                continue
+            pairs = np.sort(np.column_stack([rows[ii], cols[jj]]), axis=1)
+            candidates = np.concatenate([best_values, block[ii, jj]])
+            candidate_pairs = np.concatenate([np.asarray(best_pairs, dtype=np.intp).reshape(-1, 2), pairs])
+            if len(candidates) > k:
+                keep = np.argpartition(-np.abs(candidates), k - 1)[:k]
+                candidates, candidate_pairs = candidates[keep], candidate_pairs[keep]
+            best_values, best_pairs = candidates, candidate_pairs.tolist()
+
+        order = np.argsort(-np.abs(best_values), kind='stable')
+        top = []
+        for index in order:
+            a, b = (self.columns[i] for i in best_pairs[index])
+            top.append({'columns': [a, b], 'measure': self.measure(a, b), 'value': float(best_values[index])})
+        return top
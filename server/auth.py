@@ -0,0 +1,132 @@
+"""
+Authentication of API requests.
+
+`Authenticator.verify` turns the `Authorization` header of a request into the
+caller's email. Verified tokens are kept in a bounded TTL cache keyed by the
+token string, so a repeated request costs a dictionary lookup instead of a
+signature check; a cached token never outlives its own `exp` claim, so expiry
+is reported exactly as before. User profiles are cached the same way and
+dropped by `invalidate_user` whenever a profile changes.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+
+
+class AuthError(Exception):
+    """
+    A request that cannot be authenticated; answered with 401.
+    """
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+class TTLCache:
+    """
+    Bounded mapping whose entries expire; the least recently used entry goes first when it is full.
+    Args:
+        max_entries: Entries kept at most.
+        ttl: Default lifetime of an entry in seconds.
+    """
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, ttl=None):
+        lifetime = self.ttl if ttl is None else min(ttl, self.ttl)
+        if lifetime <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + lifetime)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries,
+                    'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses}
+
+
+class Authenticator:
+    """
+    Verifies bearer tokens and serves user profiles, both through TTL caches.
+    Args:
+        secret_key: Key the tokens are signed with.
+        users_collection: Collection of user documents, keyed by email.
+        token_ttl, max_tokens: Lifetime and size of the verified-token cache.
+        profile_ttl, max_profiles: Lifetime and size of the profile cache.
+    """
+    def __init__(self, secret_key, users_collection, token_ttl=300, max_tokens=10000,
+                 profile_ttl=300, max_profiles=1000):
+        self.secret_key = secret_key
+        self.users_collection = users_collection
+        self.tokens = TTLCache(max_tokens, token_ttl)
+        self.profiles = TTLCache(max_profiles, profile_ttl)
+
+    def verify(self, header):
+        """
+        Returns:
+            The email of a valid `Authorization` header ("Bearer <token>" or the bare token).
+        Raises:
+            AuthError: For a missing, expired or invalid token.
+        """
+        if not header or not header.split():
+            raise AuthError('Token is missing')
+        token = header.split()[-1]
+        email = self.tokens.get(token)
+        if email is not None:
+            return email
+        try:
+            payload = jwt.decode(token, self.secret_key, algorithms=['HS256'])
+        except jwt.ExpiredSignatureError:
+            raise AuthError('Token has expired')
+        except jwt.InvalidTokenError:
+            raise AuthError('Invalid token')
+        if 'email' not in payload:
+            raise AuthError('Invalid token')
+        remaining = payload['exp'] - time.time() if 'exp' in payload else None
+        self.tokens.put(token, payload['email'], ttl=remaining)
+        return payload['email']
+
+    def profile(self, email):
+        """
+        Returns:
+            The user document without its password hash, or None. Shared; do not modify.
+        """
+        user = self.profiles.get(email)
+        if user is None:
+            user = self.users_collection.find_one({'email': email}, {'password': 0})
+            if user is not None:
+                self.profiles.put(email, user)
+        return user
+
+    def invalidate_user(self, *emails):
+        for email in emails:
+            self.profiles.discard(email)
+
+    def stats(self):
+        return {'tokens': self.tokens.stats(), 'profiles': self.profiles.stats()}
@@ -0,0 +1,98 @@
+"""
+Profile photo thumbnails.
+
+Uploaded photos are decoded once, turned upright according to their EXIF
+orientation, cropped to a square and resized to each of AVATAR_SIZES. The
+thumbnails are stored as binary in the `avatars` collection under the SHA-256
+of their bytes, like rendered plots in plot_store, and user documents only
+keep `{"<size>": "<sha256>"}` references. The client loads them from
+`/avatars/<sha256>`, which can be cached indefinitely because the URL changes
+with the content.
+"""
+import datetime
+import hashlib
+import io
+
+from bson.binary import Binary
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+AVATAR_SIZES = (64, 128, 256)
+# Size returned as `photo` by /dashboard
+DEFAULT_AVATAR_SIZE = 128
+MAX_PHOTO_BYTES = 10 * 1024 * 1024
+JPEG_QUALITY = 85
+
+
+def make_thumbnails(data, sizes=AVATAR_SIZES):
+    """
+    Decodes a photo and renders its square thumbnails.
+    Returns:
+        Dict of size to (image bytes, mimetype); PNG for images with transparency, JPEG otherwise.
+    Raises:
+        ValueError: If the data is too large or not a decodable image.
+    """
+    if len(data) > MAX_PHOTO_BYTES:
+        raise ValueError(f'Photo is larger than {MAX_PHOTO_BYTES // (1024 * 1024)} MB')
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ValueError('Photo is not a valid image') from e
+
+    image = ImageOps.exif_transpose(image)
+    transparent = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if transparent else 'RGB')
+
+    thumbnails = {}
+    for size in sizes:
+        thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        if transparent:
+            thumbnail.save(buffer, format='PNG', optimize=True)
+            thumbnails[size] = (buffer.getvalue(), 'image/png')
+        else:
+            thumbnail.save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            thumbnails[size] = (buffer.getvalue(), 'image/jpeg')
+    return thumbnails
+
+
+class AvatarStore:
+    """
+    Stores avatar thumbnails keyed by their content hash.
+    Args:
+        collection: Collection with one document per distinct thumbnail.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+
+    def put_photo(self, data):
+        """
+        Renders and stores the thumbnails of an uploaded photo.
+        Returns:
+            Dict of size (as a string) to digest, as kept in the user document.
+        Raises:
+            ValueError: If the photo cannot be used (see make_thumbnails).
+        """
+        avatar = {}
+        for size, (image, mimetype) in make_thumbnails(data).items():
+            digest = hashlib.sha256(image).hexdigest()
+            self.collection.update_one(
+                {'_id': digest},
+                {'$setOnInsert': {
+                    'data': Binary(image),
+                    'size': len(image),
+                    'mimetype': mimetype,
+                    'created_at': datetime.datetime.utcnow()
+                }},
+                upsert=True
+            )
+            avatar[str(size)] = digest
+        return avatar
+
+    def get(self, digest):
+        """
+        Returns:
+            Tuple of (image bytes, mimetype), or None if the digest is unknown.
+        """
+        doc = self.collection.find_one({'_id': digest}, {'data': 1, 'mimetype': 1})
+        return (bytes(doc['data']), doc['mimetype']) if doc else None
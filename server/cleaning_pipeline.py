@@ -0,0 +1,282 @@
+"""
+Cleaning operations on the working copy, one at a time or as a pipeline.
+
+`run_operation` calls the `model` function behind an action of
+/analyze_missing_value and shapes its response. `run_pipeline` applies an
+ordered list of such steps to one in-memory frame, so a batch costs a single
+load and a single persist instead of one of each per step.
+
+Column-wise steps (filling missing values, outliers, data types, corrections
+and standardisation of one column) are fused: a run of consecutive column-wise
+steps works on narrow one-column frames, and the changed columns are written
+back into the full frame once at the end of the run. If a model function
+does not behave column-wise after all (it drops rows, or fails on the narrow
+frame), the run is written back and the step is repeated on the full frame.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+import model
+from progress import StageProgress
+from revision_log import row_positions
+
+# Form fields of /analyze_missing_value with the values used when a pipeline step leaves them out
+STEP_DEFAULTS = {
+    'column': None,
+    'fill_method': 'none',
+    'method': 'none',
+    'value': None,
+    'changes': 'none',
+    'type': 'none',
+    'target_type': None,
+    'outlier_method': None,
+    'standardize_to': None,
+    'rule': None,
+    'list_columns': [],
+    'list_row': []
+}
+MUTATING_ACTIONS = ('handel_missing_values', 'remove_duplicates', 'outlier', 'fix_datatypes',
+                    'correct_data', 'standardize_data', 'remove_data')
+# Fill methods computed from the column alone; anything else runs on the full frame
+COLUMN_FILL_METHODS = ('none', 'mean', 'median', 'mode', 'custom')
+COLUMN_OUTLIER_FILLS = ('none', 'mean', 'median')
+
+
+class OperationError(Exception):
+    """
+    A failed operation, with the HTTP status the endpoints answer with.
+    """
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _first(value, default):
+    # Some model functions wrap their status and message in a one-element list
+    if value is None:
+        return default
+    return value[0] if isinstance(value, list) else value
+
+
+def _to_list(value):
+    return value.tolist() if isinstance(value, (np.ndarray, pd.Series, pd.Index)) else list(value)
+
+
+def run_operation(df, form_data):
+    """
+    Runs one mutating action of /analyze_missing_value.
+    Args:
+        df: Frame to operate on; model functions may modify it.
+        form_data: The request fields (see STEP_DEFAULTS).
+    Returns:
+        Tuple of (resulting DataFrame, response dict).
+    Raises:
+        OperationError: When the model function fails or returns no frame.
+    """
+    action = form_data['action']
+    column = form_data['column']
+    try:
+        if action == 'handel_missing_values':
+            result = model.missing_handler(
+                df,
+                column=column,
+                Fill_Method=form_data['fill_method'],
+                value=form_data['value'],
+                method=form_data['method'],
+                type=form_data['type']
+            )
+        elif action == 'remove_duplicates':
+            result = model.remove_duplicates(df, column=column, typee=form_data['type'])
+        elif action == 'outlier':
+            result = model.out_lier(df, column=column, fill_method=form_data['fill_method'],
+                                    method=form_data['outlier_method'])
+        elif action == 'fix_datatypes':
+            result = model.fix_datatypes(df, column=column, target_type=form_data['target_type'])
+        elif action == 'correct_data':
+            result = model.correct_data(df, column=column, standardize_to=form_data['standardize_to'])
+        elif action == 'standardize_data':
+            result = model.standardize_data(df, column=column, rule=form_data['rule'])
+        elif action == 'remove_data':
+            result = model.remove_data(df, list_columns=form_data['list_columns'], list_row=form_data['list_row'])
+        else:
+            raise OperationError(f'Unknown action: {action}', 400)
+    except OperationError:
+        raise
+    except Exception as e:
+        raise OperationError(f'Error in analysis: {str(e)}')
+
+    result_df = result.get('flagged_df')
+    if result_df is None:
+        raise OperationError('Analysis failed: flagged_df not returned')
+
+    if action == 'handel_missing_values':
+        response = {
+            'status': result.get('status', 'unknown'),
+            'affected_rows': int(result.get('affected_rows', 0)) if result.get('affected_rows') else 0,
+            'affected_columns': result.get('affected_columns', 0),
+            'removed_row': result.get('removed_row', 'none'),
+            'removed_column': result.get('removed_column', 'none'),
+            'form_data': form_data
+        }
+    elif action == 'remove_duplicates':
+        response = {
+            'status': _first(result.get('status'), 'unknown'),
+            'message': _first(result.get('message'), 'none'),
+            'error': str(result.get('error', 'none'))
+        }
+    elif action == 'outlier':
+        response = {
+            'status': result.get('status', 'unknown'),
+            'message': result.get('message', 'none'),
+            'outliers': _to_list(result.get('outliers', [])),
+            'z_scores': _to_list(result['z_scores']) if result.get('z_scores') is not None else None,
+            'stats': result.get('stats', {}),
+            'outlier_indices': result.get('outlier_indices', [])
+        }
+    elif action == 'remove_data':
+        response = {
+            'status': result.get('status', 'unknown'),
+            'removed_columns': result.get('removed_columns', 'none'),
+            'removed_rowes': result.get('removed_rowes', 'none'),
+            'message': result.get('message', 'none'),
+            'error': str(result.get('error', 'none'))
+        }
+    else:
+        response = {
+            'status': result.get('status', 'unknown'),
+            'message': result.get('message', 'none'),
+            'error': str(result.get('error', 'none'))
+        }
+    return result_df, response
+
+
+def is_column_wise(step):
+    """
+    Whether a step only rewrites the values of its own column, keeping every row.
+    """
+    action = step['action']
+    if action == 'handel_missing_values':
+        return step['method'] != 'remove' and step['fill_method'] in COLUMN_FILL_METHODS
+    if action == 'outlier':
+        return step['fill_method'] in COLUMN_OUTLIER_FILLS
+    return action in ('fix_datatypes', 'correct_data', 'standardize_data')
+
+
+def normalize_steps(steps):
+    """
+    Fills in defaults and validates the steps of a pipeline request.
+    Raises:
+        ValueError: For a malformed step.
+    """
+    if not isinstance(steps, list) or not steps:
+        raise ValueError('steps must be a non-empty list')
+    normalized = []
+    for index, step in enumerate(steps):
+        if not isinstance(step, dict) or 'action' not in step:
+            raise ValueError(f'Step {index} has no action')
+        if step['action'] not in MUTATING_ACTIONS:
+            raise ValueError(f"Step {index}: action {step['action']} cannot run in a pipeline")
+        if step.get('changes') in ('revert', 'redo'):
+            raise ValueError(f"Step {index}: {step['changes']} cannot run in a pipeline")
+        normalized.append({**STEP_DEFAULTS, **step})
+    return normalized
+
+
+class _FusedRun:
+    """
+    Narrow one-column frames for a run of column-wise steps.
+    """
+    def __init__(self, df):
+        self.df = df
+        self.frames = {}
+
+    def frame(self, column):
+        if column not in self.frames:
+            self.frames[column] = self.df[[column]]
+        return self.frames[column]
+
+    def flush(self):
+        """
+        Writes the changed columns back into the full frame.
+        Returns:
+            The full frame.
+        """
+        if self.frames:
+            df = self.df.copy(deep=False)
+            for column, frame in self.frames.items():
+                df[column] = frame[column]
+            self.df = df
+            self.frames = {}
+        return self.df
+
+
+def run_pipeline(df, steps, progress=None):
+    """
+    Applies normalized steps in order.
+    Args:
+        df: Private copy of the working frame.
+        steps: Output of normalize_steps.
+        progress: Optional progress.StageProgress, told about every finished step.
+    Returns:
+        Tuple of (resulting DataFrame, per-step results). As with a single model
+        call, the index of the result holds the positions in `df` of the rows
+        that were kept. Each step result holds `index`, `action`, `column`,
+        `fused`, `seconds` and `result`.
+    Raises:
+        OperationError: With `step_results` (the steps that ran) and `step` (the
+            index of the failing step) set; nothing should be persisted then.
+    """
+    progress = progress or StageProgress()
+    step_results = []
+    # Positions in `df` of the current rows, None once a step no longer maps its rows back
+    rows = np.arange(len(df))
+    run = _FusedRun(df)
+    for index, step in enumerate(steps):
+        started = time.perf_counter()
+        column = step['column']
+        fused = False
+        try:
+            if is_column_wise(step) and column in run.df.columns:
+                narrow = run.frame(column)
+                try:
+                    # On a copy, so a failed attempt leaves nothing behind for the full-frame retry
+                    result_df, response = run_operation(narrow.copy(), step)
+                    fused = (isinstance(result_df, pd.DataFrame) and list(result_df.columns) == [column]
+                             and result_df.index.equals(narrow.index))
+                except OperationError:
+                    fused = False
+                if fused:
+                    run.frames[column] = result_df
+            if not fused:
+                full = run.flush()
+                if step['action'] != 'remove_data' and column not in full.columns:
+                    raise OperationError(
+                        f'Column {column} not found in current DataFrame. It might have been deleted.', 400
+                    )
+                result_df, response = run_operation(full, step)
+                kept = row_positions(result_df, len(full)) if rows is not None else None
+                rows = rows[kept] if kept is not None else None
+                # Persisting resets the index, so the next step sees what it would see one request later
+                run = _FusedRun(result_df.reset_index(drop=True))
+        except OperationError as e:
+            e.step = index
+            e.step_results = step_results
+            raise
+
+        step_results.append({
+            'index': index,
+            'action': step['action'],
+            'column': column,
+            'fused': fused,
+            'seconds': round(time.perf_counter() - started, 6),
+            'result': response
+        })
+        progress('step', step=step_results[-1], count=len(steps))
+    result_df = run.flush()
+    if rows is not None:
+        result_df = result_df.copy(deep=False)
+        result_df.index = pd.Index(rows)
+    return result_df, step_results
@@ -0,0 +1,208 @@
+"""
+CSV schema profiles, inferred once at upload and reused by every parse.
+
+`infer_schema` looks at the head of an upload and records:
+    - encoding: utf-8 (with or without BOM), falling back to cp1252 / latin-1,
+    - delimiter: sniffed among , ; tab and |,
+    - null_tokens: per-column placeholders such as '-' or '?' in otherwise
+      numeric columns, on top of pandas' default NA strings,
+    - dtypes: the pandas dtype of each column as parsed from the sample,
+    - date_columns: text columns whose values all parse as dates; they are
+      kept as text when parsing so analysis results do not change, and the
+      list is available to callers that want datetime values.
+
+`read_csv` parses a whole payload with that schema, using explicit column
+types and the multi-threaded pyarrow CSV reader when pyarrow is installed.
+It falls back to pandas' own type inference when the file does not fit the
+schema (e.g. a column that was numeric in the sample holds text further
+down). `chunk_options` gives the matching pandas options for chunked reads.
+"""
+import codecs
+import csv
+import io
+
+import numpy as np
+import pandas as pd
+from pandas._libs.parsers import STR_NA_VALUES
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+SCHEMA_VERSION = 1
+SAMPLE_BYTES = 1024 * 1024
+DELIMITERS = ',;\t|'
+NULL_TOKEN_CANDIDATES = ('-', '--', '?', '.', 'missing', 'Missing', 'MISSING', 'nil', 'NIL', 'none')
+FALLBACK_ENCODINGS = ('cp1252', 'latin-1')
+
+
+def detect_encoding(sample, complete=False):
+    """
+    Returns:
+        Tuple of (encoding name, decoded sample text).
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+    else:
+        encoding = 'utf-8'
+    try:
+        # An incremental decoder tolerates a multi-byte character cut off at the end of the sample
+        return encoding, codecs.getincrementaldecoder(encoding)().decode(sample, final=complete)
+    except UnicodeDecodeError:
+        pass
+    for encoding in FALLBACK_ENCODINGS:
+        try:
+            return encoding, sample.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return 'latin-1', sample.decode('latin-1')
+
+
+def detect_delimiter(text):
+    header = text.split('\n', 1)[0]
+    try:
+        delimiter = csv.Sniffer().sniff(text[:64 * 1024], delimiters=DELIMITERS).delimiter
+    except csv.Error:
+        delimiter = ','
+    # A single-column file sniffs as anything; keep pandas' default unless the header splits
+    if delimiter != ',' and delimiter not in header:
+        delimiter = ','
+    return delimiter
+
+
+def _null_tokens(df):
+    tokens = {}
+    for col in df.select_dtypes(include=['object']).columns:
+        values = df[col].dropna()
+        placeholders = values[values.isin(NULL_TOKEN_CANDIDATES)]
+        rest = values[~values.isin(NULL_TOKEN_CANDIDATES)]
+        if len(placeholders) and len(rest) and pd.to_numeric(rest, errors='coerce').notna().all():
+            tokens[str(col)] = sorted(placeholders.unique().tolist())
+    return tokens
+
+
+def _date_columns(df):
+    dates = []
+    for col in df.select_dtypes(include=['object']).columns:
+        values = df[col].dropna()
+        # Object columns can hold bools or mixed cells, which have no .str accessor
+        if len(values) == 0 or pd.api.types.infer_dtype(values, skipna=True) != 'string':
+            continue
+        if not values.str.contains(r'\d[-/.:]\d', regex=True).all():
+            continue
+        parsed = pd.to_datetime(values, errors='coerce', format='mixed')
+        if parsed.notna().all():
+            dates.append(str(col))
+    return dates
+
+
+def infer_schema(sample, complete=False):
+    """
+    Infers the schema of a CSV payload from its first bytes.
+    Args:
+        sample: Up to SAMPLE_BYTES bytes from the start of the file.
+        complete: Whether `sample` is the whole file.
+    Returns:
+        Schema dict to store with the file metadata.
+    """
+    encoding, text = detect_encoding(sample, complete=complete)
+    if not complete and '\n' in text:
+        # Drop the last, probably truncated, line
+        text = text[:text.rindex('\n') + 1]
+    delimiter = detect_delimiter(text)
+
+    df = pd.read_csv(io.StringIO(text), sep=delimiter)
+    null_tokens = _null_tokens(df)
+    if null_tokens:
+        df = pd.read_csv(io.StringIO(text), sep=delimiter, na_values=null_tokens)
+
+    return {
+        'version': SCHEMA_VERSION,
+        'encoding': encoding,
+        'delimiter': delimiter,
+        'null_tokens': null_tokens,
+        'columns': [str(col) for col in df.columns],
+        'dtypes': {str(col): str(dtype) for col, dtype in df.dtypes.items()},
+        'date_columns': _date_columns(df),
+        'sample_rows': len(df)
+    }
+
+
+def chunk_options(schema):
+    """
+    pandas read_csv options for a schema, without column types, for chunked reads
+    where the chunks fix the types themselves.
+    """
+    if not schema:
+        return {}
+    options = {'sep': schema['delimiter'], 'encoding': schema['encoding']}
+    if schema['null_tokens']:
+        options['na_values'] = schema['null_tokens']
+    return options
+
+
+def _arrow_type(dtype):
+    if dtype == 'object':
+        return pa.string()
+    if dtype == 'bool':
+        return pa.bool_()
+    if dtype.startswith(('int', 'uint', 'float')):
+        return pa.from_numpy_dtype(np.dtype(dtype))
+    return None
+
+
+def _read_arrow(source, schema):
+    column_types = {}
+    for col, dtype in schema['dtypes'].items():
+        arrow_type = _arrow_type(dtype)
+        if arrow_type is not None:
+            column_types[col] = arrow_type
+    table = pa_csv.read_csv(
+        source,
+        read_options=pa_csv.ReadOptions(encoding=schema['encoding'], column_names=schema['columns'], skip_rows=1),
+        parse_options=pa_csv.ParseOptions(delimiter=schema['delimiter']),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=column_types,
+            null_values=sorted(STR_NA_VALUES),
+            strings_can_be_null=True
+        )
+    )
+    df = table.to_pandas()
+    # pandas marks missing text as NaN, Arrow as None
+    for col, dtype in schema['dtypes'].items():
+        if dtype == 'object' and df[col].isna().any():
+            series = df[col].copy()
+            series[series.isna()] = np.nan
+            df[col] = series
+    return df
+
+
+def read_csv(data, schema=None):
+    """
+    Parses a complete CSV payload.
+    Args:
+        data: The file bytes.
+        schema: Schema from infer_schema, or None for pandas' defaults.
+    Returns:
+        The parsed DataFrame.
+    """
+    if not schema:
+        return pd.read_csv(io.StringIO(data.decode('utf-8')))
+
+    # Per-column null tokens and duplicate header names are pandas-only features
+    if pa is not None and not schema['null_tokens'] and len(set(schema['columns'])) == len(schema['columns']):
+        try:
+            return _read_arrow(io.BytesIO(data), schema)
+        except (pa.ArrowInvalid, ValueError) as e:
+            print(f"Schema parse failed, falling back to type inference: {str(e)}")
+            return pd.read_csv(io.BytesIO(data), **chunk_options(schema))
+
+    try:
+        dtypes = {col: dtype for col, dtype in schema['dtypes'].items() if not dtype.startswith('int')}
+        # Integer columns are left to inference so rows with missing values still parse (as float)
+        return pd.read_csv(io.BytesIO(data), dtype=dtypes, **chunk_options(schema))
+    except (ValueError, TypeError) as e:
+        print(f"Schema parse failed, falling back to type inference: {str(e)}")
+        return pd.read_csv(io.BytesIO(data), **chunk_options(schema))
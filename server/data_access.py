@@ -0,0 +1,218 @@
+"""
+MongoDB access for the server: client and pool setup, indexes, lean
+collections and per-query latency metrics.
+
+`connect` builds the MongoClient with explicit pool settings and registers a
+`QueryMetrics` command listener, so every query is timed without touching the
+call sites. `ensure_indexes` creates the compound indexes that the routes'
+queries rely on (files by owner and upload date, working copies and their
+columns, history entries, recipes, ...). `LeanCollection` wraps a collection
+so that `find` and `find_one` without a projection never return the heavy
+fields listed in HEAVY_FIELDS (inline upload payloads, legacy row dicts,
+stored regression matrices); a query that needs one of them has to name it in
+its projection.
+"""
+import threading
+from collections import deque
+
+import numpy as np
+from bson.codec_options import CodecOptions, TypeRegistry
+from pymongo import ASCENDING, DESCENDING, MongoClient, monitoring
+from pymongo.errors import PyMongoError
+
+# Fields only returned when a query's projection asks for them
+HEAVY_FIELDS = {
+    'user_files': ('data',),
+    'result_df': ('result_df', 'history'),
+    'analysis_results': ('regression', 'sketches')
+}
+
+# Collections storing analysis output, whose numpy values are encoded by NUMPY_CODEC_OPTIONS
+NUMPY_COLLECTIONS = ('analysis_results', 'recipe_runs')
+
+# Indexes per collection, as (keys, options)
+INDEXES = {
+    'users': [([('email', ASCENDING)], {'unique': True})],
+    'user_files': [([('email', ASCENDING), ('upload_date', DESCENDING), ('_id', DESCENDING)], {})],
+    'analysis_jobs': [
+        ([('email', ASCENDING), ('status', ASCENDING)], {}),
+        ([('status', ASCENDING)], {})
+    ],
+    'result_df': [([('file_id', ASCENDING), ('email', ASCENDING)], {'unique': True})],
+    'result_df_columns': [([('file_id', ASCENDING), ('email', ASCENDING), ('name', ASCENDING)], {'unique': True})],
+    'result_df_history': [([('file_id', ASCENDING), ('email', ASCENDING), ('seq', ASCENDING)], {'unique': True})],
+    'result_df_snapshots': [([('file_id', ASCENDING), ('email', ASCENDING), ('seq', ASCENDING)], {})],
+    'analysis_states': [([('file_id', ASCENDING)], {'unique': True})],
+    'analysis_results': [([('file_id', ASCENDING), ('email', ASCENDING)], {})],
+    'plot_artifacts': [([('owners', ASCENDING)], {})],
+    'recipes': [([('email', ASCENDING), ('name', ASCENDING), ('version', DESCENDING)], {'unique': True})]
+}
+
+# Commands that are timed; handshakes, heartbeats and authentication are not
+TIMED_COMMANDS = ('find', 'getMore', 'insert', 'update', 'delete', 'findAndModify',
+                  'aggregate', 'count', 'distinct', 'createIndexes')
+# Latencies kept per query for percentiles
+LATENCY_WINDOW = 512
+
+
+class QueryMetrics(monitoring.CommandListener):
+    """
+    Command listener collecting per-query latency, keyed by `<collection>.<command>`.
+    Args:
+        slow_ms: Queries slower than this are logged and kept in `slow`.
+        keep_slow: Number of slow queries kept.
+    """
+    def __init__(self, slow_ms=100, keep_slow=50):
+        self.slow_ms = slow_ms
+        self.slow = deque(maxlen=keep_slow)
+        self._started = {}
+        self._queries = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name not in TIMED_COMMANDS:
+            return
+        command = event.command
+        collection = command.get('collection') if event.command_name == 'getMore' else command.get(event.command_name)
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = f'{collection}.{event.command_name}'
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed):
+        with self._lock:
+            key = self._started.pop((event.connection_id, event.request_id), None)
+            if key is None:
+                return
+            ms = event.duration_micros / 1000
+            query = self._queries.get(key)
+            if query is None:
+                query = self._queries[key] = {'count': 0, 'failed': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                              'recent': deque(maxlen=LATENCY_WINDOW)}
+            query['count'] += 1
+            query['failed'] += int(failed)
+            query['total_ms'] += ms
+            query['max_ms'] = max(query['max_ms'], ms)
+            query['recent'].append(ms)
+            slow = ms >= self.slow_ms
+            if slow:
+                self.slow.append({'query': key, 'ms': round(ms, 3), 'failed': failed})
+        if slow:
+            print(f"Slow query {key}: {ms:.1f} ms")
+
+    def stats(self):
+        """
+        Returns:
+            Dict of query key to count, failures, mean, p50, p95 and max latency in milliseconds.
+        """
+        with self._lock:
+            queries = {key: dict(query, recent=sorted(query['recent'])) for key, query in self._queries.items()}
+            slow = list(self.slow)
+        result = {}
+        for key, query in sorted(queries.items()):
+            recent = query['recent']
+            result[key] = {
+                'count': query['count'],
+                'failed': query['failed'],
+                'mean_ms': round(query['total_ms'] / query['count'], 3),
+                'p50_ms': round(recent[len(recent) // 2], 3),
+                'p95_ms': round(recent[min(len(recent) - 1, int(len(recent) * 0.95))], 3),
+                'max_ms': round(query['max_ms'], 3)
+            }
+        return {'queries': result, 'slow': slow, 'slow_ms': self.slow_ms}
+
+
+def connect(uri, max_pool_size=100, min_pool_size=0, max_idle_ms=None, wait_queue_timeout_ms=None,
+            server_selection_timeout_ms=30000, metrics=None, client_class=MongoClient):
+    """
+    Builds the MongoClient with explicit connection pool settings.
+    Args:
+        metrics: Optional QueryMetrics to register as command listener.
+        client_class: MongoClient, or a driver taking the same options such as Motor's AsyncIOMotorClient.
+    Returns:
+        Tuple of (client, pool settings as given).
+    """
+    settings = {
+        'maxPoolSize': max_pool_size,
+        'minPoolSize': min_pool_size,
+        'maxIdleTimeMS': max_idle_ms,
+        'waitQueueTimeoutMS': wait_queue_timeout_ms,
+        'serverSelectionTimeoutMS': server_selection_timeout_ms
+    }
+    settings = {name: value for name, value in settings.items() if value is not None}
+    listeners = [metrics] if metrics is not None else []
+    return client_class(uri, event_listeners=listeners, **settings), settings
+
+
+def ensure_indexes(db):
+    """
+    Creates the indexes of INDEXES; existing ones are left as they are.
+    Returns:
+        Number of index specifications that could not be created.
+    """
+    failed = 0
+    for name, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[name].create_index(keys, **options)
+            except PyMongoError as e:
+                failed += 1
+                print(f"Could not create index {keys} on {name}: {str(e)}")
+    return failed
+
+
+def encode_numpy(value):
+    """
+    BSON fallback encoder: numpy scalars become Python scalars and arrays lists,
+    while the documents are encoded for the server rather than in a separate walk.
+    numpy.float64 is a float and never gets here.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
+
+
+NUMPY_CODEC_OPTIONS = CodecOptions(type_registry=TypeRegistry(fallback_encoder=encode_numpy))
+
+
+def _lean(projection, heavy_fields):
+    if projection is not None:
+        return projection
+    return {field: 0 for field in heavy_fields}
+
+
+class LeanCollection:
+    """
+    A collection whose projection-less `find`/`find_one` exclude the heavy fields.
+    Every other attribute is that of the wrapped collection.
+    """
+    def __init__(self, collection, heavy_fields):
+        self.collection = collection
+        self.heavy_fields = tuple(heavy_fields)
+
+    def find(self, filter=None, projection=None, *args, **kwargs):
+        return self.collection.find(filter, _lean(projection, self.heavy_fields), *args, **kwargs)
+
+    def find_one(self, filter=None, projection=None, *args, **kwargs):
+        return self.collection.find_one(filter, _lean(projection, self.heavy_fields), *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def collection(db, name):
+    """
+    Returns:
+        `db[name]`, with NUMPY_CODEC_OPTIONS if it stores analysis output and
+        wrapped in a LeanCollection if it has heavy fields.
+    """
+    coll = db.get_collection(name, codec_options=NUMPY_CODEC_OPTIONS) if name in NUMPY_COLLECTIONS else db[name]
+    if name in HEAVY_FIELDS:
+        return LeanCollection(coll, HEAVY_FIELDS[name])
+    return coll
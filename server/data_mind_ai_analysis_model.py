@@ -2,32 +2,67 @@ import pandas as pd
 import numpy as np
 import matplotlib
 matplotlib.use('Agg') 
-import matplotlib.pyplot as plt
-from sklearn.linear_model import LinearRegression
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder
-import io
-import base64
 from io import StringIO
+from associations import MEASURES, AssociationEngine
+from plot_rendering import build_plot_specs, render_plots
+from progress import StageProgress
+from regression import BATCH_MAX_COLUMNS, GramAccumulator, batch_regression, regression_cache
+from sampling import coefficient_intervals, correlation_intervals, r2_interval, sample_frame
+from sketches import ColumnSketches
 import warnings
 warnings.filterwarnings('ignore')
 
-def analyze_csv_with_ai(csv_data):
+# Files with more columns than this report their strongest pairs instead of a full matrix
+MATRIX_MAX_COLUMNS = 50
+TOP_ASSOCIATIONS = 25
+# Insights reported with the correlation stage
+ASSOCIATION_INSIGHTS = ('association_measures', 'correlation', 'strongest_associations', 'correlation_ci')
+
+def analyze_csv_with_ai(csv_data, plot_mode='eager', plot_workers=None, approximate=False, sampling=None,
+                        top_associations=None, progress=None):
     """
     Analyzes a CSV data string with AI-driven insights and returns plots as base64 strings.
     Args:
-        csv_data: Raw CSV data as a string.
+        csv_data: Raw CSV data as a string, or an already parsed DataFrame
+            (e.g. from the DataFrame cache). The DataFrame is not modified.
+        plot_mode: 'eager' renders every plot; 'lazy' returns plot specs
+            (see plot_rendering) that are rendered on first request.
+        plot_workers: Number of processes used to render plots in eager mode.
+        approximate: Compute quartiles, categorical unique counts and top values
+            from sketches (see sketches) instead of exactly. The results then also
+            hold "approximate" (error bounds) and "sketches" (serialised sketches).
+        sampling: Options from sampling.sampling_options. When the file has more
+            rows than the budget, the regression and correlation run on a sample;
+            the results then hold "sampling" (sample size and settings), and
+            confidence intervals as "r2_score_ci", "coefficients_ci" and
+            "correlation_ci".
+            Every numerical column is fitted against the others; the fits are in
+            predictions["targets"], and the Gram matrices they came from in
+            "regression" (see regression.regression_cache).
+        top_associations: Report only this many strongest column pairs as
+            "strongest_associations" instead of the full "correlation" matrix.
+            Defaults to TOP_ASSOCIATIONS for files wider than MATRIX_MAX_COLUMNS.
+        progress: Optional progress.StageProgress, told about the parse, insights,
+            regression and correlation stages and every rendered plot, with the
+            partial results of each.
     Returns:
-        Dict with insights, predictions, and plot data as base64 strings.
+        Dict with insights, predictions, and plot data as base64 strings
+        (plot specs in lazy mode).
     """
     # Read CSV from string using StringIO
     try:
-        print("Reading CSV data into DataFrame...")
-        df = pd.read_csv(StringIO(csv_data))
+        if isinstance(csv_data, pd.DataFrame):
+            df = csv_data
+        else:
+            print("Reading CSV data into DataFrame...")
+            df = pd.read_csv(StringIO(csv_data))
         print("DataFrame Head:", df.head().to_string())
     except Exception as e:
         print("Error reading CSV:", str(e))
         return {"error": f"Error reading CSV: {str(e)}"}
+    progress = progress or StageProgress()
+    progress('parse', rows=df.shape[0], columns=df.shape[1])
 
     # Initialize results dictionary
     results = {
@@ -47,10 +82,23 @@ def analyze_csv_with_ai(csv_data):
     numerical_cols = df.select_dtypes(include=[np.number]).columns
     categorical_cols = df.select_dtypes(include=['object', 'category']).columns
 
+    sketches = None
+    if approximate:
+        print("Building column sketches...")
+        sketches = ColumnSketches(numerical_cols, categorical_cols)
+        sketches.update(df)
+
     # Statistical Insights for Numerical Columns
     if len(numerical_cols) > 0:
         print("Computing numerical stats...")
-        stats = df[numerical_cols].describe()
+        if sketches is not None:
+            numeric_df = df[numerical_cols]
+            stats = numeric_df.agg(['count', 'mean', 'std', 'min']).T
+            stats['25%'], stats['50%'], stats['75%'] = zip(*[sketches.quartiles(col) for col in numerical_cols])
+            stats['max'] = numeric_df.max()
+            stats = stats.T
+        else:
+            stats = df[numerical_cols].describe()
         results["insights"]["numerical_stats"] = stats.to_dict()
         results["insights"]["skewness"] = df[numerical_cols].skew().to_dict()
         results["insights"]["kurtosis"] = df[numerical_cols].kurtosis().to_dict()
@@ -58,145 +106,113 @@ def analyze_csv_with_ai(csv_data):
     # Categorical Insights
     if len(categorical_cols) > 0:
         print("Computing categorical insights...")
-        results["insights"]["categorical_unique"] = {
-            col: df[col].nunique() for col in categorical_cols
-        }
-        results["insights"]["categorical_top_values"] = {
-            col: df[col].value_counts().head(5).to_dict() for col in categorical_cols
-        }
-
-    # AI-Driven Predictions (Linear Regression for Numerical Data)
+        if sketches is not None:
+            results["insights"]["categorical_unique"] = {
+                col: sketches.nunique(col) for col in categorical_cols
+            }
+            results["insights"]["categorical_top_values"] = {
+                col: sketches.top(col) for col in categorical_cols
+            }
+        else:
+            results["insights"]["categorical_unique"] = {
+                col: df[col].nunique() for col in categorical_cols
+            }
+            results["insights"]["categorical_top_values"] = {
+                col: df[col].value_counts().head(5).to_dict() for col in categorical_cols
+            }
+
+    progress('insights', insights=results["insights"])
+
+    # Row budget for the regression and correlation
+    model_df, sample_info = df, None
+    if sampling:
+        model_df, sample_info = sample_frame(df, sampling, categorical_cols)
+        if sample_info is not None:
+            print(f"Sampled {sample_info['sample_rows']} of {len(df)} rows ({sample_info['method']})...")
+            results["sampling"] = sample_info
+
+    # AI-Driven Predictions: every numerical column against all the others from one
+    # pair of train/test Gram matrices; the first column stays the headline prediction
     if len(numerical_cols) >= 2:
         print("Running linear regression...")
         target_col = numerical_cols[0]
         feature_cols = numerical_cols[1:]
-        df_clean = df[[target_col] + list(feature_cols)].dropna()
+        df_clean = model_df[list(numerical_cols)].dropna()
 
         if len(df_clean) > 0:
-            X = df_clean[feature_cols]
-            y = df_clean[target_col]
-            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-            model = LinearRegression()
-            model.fit(X_train, y_train)
-            y_pred = model.predict(X_test)
+            train_rows, test_rows = train_test_split(df_clean.to_numpy(dtype=float), test_size=0.2, random_state=42)
+            train, test = GramAccumulator(numerical_cols), GramAccumulator(numerical_cols)
+            train.update(train_rows)
+            test.update(test_rows)
+            targets = None if len(numerical_cols) <= BATCH_MAX_COLUMNS else [target_col]
+            by_target = batch_regression(train, test, test_rows[:5], targets=targets)
+
+            primary = by_target[target_col]
             results["predictions"]["target"] = target_col
             results["predictions"]["features"] = list(feature_cols)
-            results["predictions"]["r2_score"] = model.score(X_test, y_test)
-            results["predictions"]["coefficients"] = dict(zip(feature_cols, model.coef_))
-            results["predictions"]["sample_predictions"] = list(zip(y_test[:5].values, y_pred[:5]))
-
-    # Encode Categorical Columns for Correlation Analysis
-    print("Encoding categorical columns...")
-    df_encoded = df.copy()
-    le = LabelEncoder()
-    for col in categorical_cols:
-        df_encoded[col] = le.fit_transform(df_encoded[col].astype(str))
-    
-    # Correlation Analysis
-    if len(numerical_cols) > 0 or len(categorical_cols) > 0:
-        print("Computing correlation matrix...")
-        corr_matrix = df_encoded.corr()
-        results["insights"]["correlation"] = corr_matrix.to_dict()
-
-    # Plotting (Return as base64 strings)
-    plot_data = []
-
-    # 1. Histogram for Numerical Columns
-    for col in numerical_cols:
-        print(f"Generating histogram for {col}...")
-        plt.figure(figsize=(8, 6))
-        plt.hist(df[col].dropna(), bins=20, color='skyblue', edgecolor='black')
-        plt.title(f'Histogram of {col}')
-        plt.xlabel(col)
-        plt.ylabel('Frequency')
-        
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        plot_data.append({
-            "name": f"histogram_{col}.png",
-            "data": base64.b64encode(buf.getvalue()).decode('utf-8')
-        })
-        plt.close()
-
-    # 2. Box Plot for Numerical Columns
-    if len(numerical_cols) > 0:
-        print("Generating box plot...")
-        plt.figure(figsize=(10, 6))
-        df[numerical_cols].boxplot()
-        plt.title('Box Plot of Numerical Columns')
-        plt.xticks(rotation=45)
-        
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        plot_data.append({
-            "name": "box_plot.png",
-            "data": base64.b64encode(buf.getvalue()).decode('utf-8')
-        })
-        plt.close()
-
-    # 3. Bar Plot for Categorical Columns (Top 5 Values)
-    for col in categorical_cols:
-        print(f"Generating bar plot for {col}...")
-        plt.figure(figsize=(8, 6))
-        value_counts = df[col].value_counts().head(5)
-        plt.bar(value_counts.index, value_counts.values, color='lightgreen', edgecolor='black')
-        plt.title(f'Top 5 Values in {col}')
-        plt.xlabel(col)
-        plt.ylabel('Count')
-        plt.xticks(rotation=45)
-        
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        plot_data.append({
-            "name": f"bar_{col}.png",
-            "data": base64.b64encode(buf.getvalue()).decode('utf-8')
-        })
-        plt.close()
-
-    # 4. Correlation Heatmap
+            results["predictions"]["r2_score"] = primary["r2_score"]
+            results["predictions"]["coefficients"] = primary["coefficients"]
+            results["predictions"]["sample_predictions"] = primary["sample_predictions"]
+            results["predictions"]["targets"] = by_target
+            cache = regression_cache(train, test, test_rows[:5])
+            if cache is not None:
+                results["regression"] = cache
+            if sample_info is not None:
+                coef = np.array([primary["coefficients"][col] for col in feature_cols])
+                y_pred = primary["intercept"] + test_rows[:, 1:] @ coef
+                results["predictions"]["r2_score_ci"] = r2_interval(test_rows[:, 0], y_pred, seed=sample_info['seed'])
+                results["predictions"]["coefficients_ci"] = coefficient_intervals(
+                    feature_cols, primary["intercept"], coef, train_rows[:, 1:], train_rows[:, 0]
+                )
+
+    progress('regression', predictions=results["predictions"])
+
+    # Association Analysis: Pearson, Cramér's V or correlation ratio depending on the column types
+    corr_matrix = None
     if len(numerical_cols) > 0 or len(categorical_cols) > 0:
-        print("Generating correlation heatmap...")
-        plt.figure(figsize=(10, 8))
-        plt.imshow(corr_matrix, cmap='coolwarm', interpolation='nearest')
-        plt.colorbar()
-        plt.xticks(np.arange(len(corr_matrix.columns)), corr_matrix.columns, rotation=45)
-        plt.yticks(np.arange(len(corr_matrix.columns)), corr_matrix.columns)
-        plt.title('Correlation Heatmap')
-        
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        plot_data.append({
-            "name": "correlation_heatmap.png",
-            "data": base64.b64encode(buf.getvalue()).decode('utf-8')
-        })
-        plt.close()
-
-    # 5. Prediction Plot (if predictions were made)
-    if "sample_predictions" in results["predictions"]:
-        print("Generating prediction plot...")
-        plt.figure(figsize=(8, 6))
-        actual = [x[0] for x in results["predictions"]["sample_predictions"]]
-        predicted = [x[1] for x in results["predictions"]["sample_predictions"]]
-        plt.scatter(range(len(actual)), actual, color='blue', label='Actual')
-        plt.scatter(range(len(predicted)), predicted, color='red', label='Predicted')
-        plt.title(f'Actual vs Predicted for {target_col}')
-        plt.xlabel('Sample Index')
-        plt.ylabel(target_col)
-        plt.legend()
-        
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        plot_data.append({
-            "name": "prediction_plot.png",
-            "data": base64.b64encode(buf.getvalue()).decode('utf-8')
-        })
-        plt.close()
-
-    results["plots"] = plot_data
+        engine = AssociationEngine(model_df, numerical_cols, categorical_cols)
+        if top_associations is None and engine.size > MATRIX_MAX_COLUMNS:
+            top_associations = TOP_ASSOCIATIONS
+        results["insights"]["association_measures"] = MEASURES
+        if top_associations:
+            print(f"Finding the {top_associations} strongest associations...")
+            strongest = engine.top_pairs(top_associations)
+            results["insights"]["strongest_associations"] = strongest
+            # The heatmap only shows the columns taking part in the strongest pairs
+            involved = {col for pair in strongest for col in pair["columns"]}
+            engine = AssociationEngine(model_df, [col for col in numerical_cols if col in involved],
+                                       [col for col in categorical_cols if col in involved])
+            corr_matrix = engine.matrix() if engine.size > 0 else None
+        else:
+            print("Computing association matrix...")
+            corr_matrix = engine.matrix()
+            results["insights"]["correlation"] = corr_matrix.to_dict()
+        if sample_info is not None and corr_matrix is not None:
+            # Fisher z intervals only apply to the Pearson (numeric-numeric) part
+            pearson = corr_matrix.loc[engine.numerical_cols, engine.numerical_cols]
+            results["insights"]["correlation_ci"] = correlation_intervals(pearson, model_df)
+
+    progress('correlation', insights={
+        key: results["insights"][key] for key in ASSOCIATION_INSIGHTS if key in results["insights"]
+    })
+
+    # Plotting: describe every plot first, then render eagerly or leave it to the client
+    print("Preparing plot specs...")
+    plot_specs = build_plot_specs(
+        df, numerical_cols, categorical_cols,
+        corr_matrix=corr_matrix,
+        predictions=results["predictions"],
+        top_values=results["insights"].get("categorical_top_values")
+    )
+    if plot_mode == 'lazy':
+        results["plots"] = plot_specs
+        progress('plots', plots=[spec["name"] for spec in plot_specs])
+    else:
+        results["plots"] = render_plots(plot_specs, workers=plot_workers, on_plot=lambda index, plot: progress(
+            'plot', index=index, count=len(plot_specs), plot=plot
+        ))
+
+    if sketches is not None:
+        results["approximate"] = sketches.error_bounds()
+        results["sketches"] = sketches.to_dict()
     return results
\ No newline at end of file
@@ -0,0 +1,222 @@
+"""
+GridFS-backed storage for uploaded files.
+
+Uploads are streamed into GridFS in fixed-size chunks. The document kept in
+`user_files` only holds a pointer to the GridFS file (`gridfs_id`), the
+payload `size` and a `sha256` content hash, so metadata queries never drag
+the file bytes over the wire.
+
+Documents written before GridFS was introduced carry the raw payload in an
+inline `data` field. They keep working: the first read of such a document
+moves the payload into GridFS, and `migrate_inline_files` migrates a whole
+collection in one go.
+"""
+import hashlib
+import io
+
+from gridfs import GridFSBucket
+from gridfs.errors import NoFile
+
+BUCKET_NAME = 'user_files_fs'
+CHUNK_SIZE = 255 * 1024
+
+# Projection for reading file metadata without any inline payload
+METADATA_PROJECTION = {'data': 0}
+# Projection for metadata that is returned to the client as JSON
+PUBLIC_PROJECTION = {'data': 0, 'gridfs_id': 0, 'schema': 0}
+
+
+class HashingReader:
+    """
+    Wraps a readable stream and hashes and counts bytes as they are read.
+    """
+    def __init__(self, stream):
+        self._stream = stream
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self._stream.read(size)
+        if chunk:
+            self.sha256.update(chunk)
+            self.size += len(chunk)
+        return chunk
+
+
+class ConcatenatedReader:
+    """
+    Reads several streams one after the other as a single stream.
+    """
+    def __init__(self, streams):
+        self._streams = list(streams)
+
+    def read(self, size=-1):
+        # GridFS treats a short read as the end of the stream, so fill `size` across streams
+        parts = []
+        while self._streams and (size < 0 or size > 0):
+            chunk = self._streams[0].read(size)
+            if not chunk:
+                self._streams.pop(0)
+                continue
+            parts.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(parts)
+
+
+class FileStorage:
+    """
+    Chunked storage backend for the `user_files` collection.
+    Args:
+        db: pymongo Database holding the GridFS bucket.
+        files_collection: Collection with the per-file metadata documents.
+    """
+    def __init__(self, db, files_collection, bucket_name=BUCKET_NAME, chunk_size=CHUNK_SIZE):
+        self.files_collection = files_collection
+        self.chunk_size = chunk_size
+        self.bucket = GridFSBucket(db, bucket_name=bucket_name, chunk_size_bytes=chunk_size)
+
+    def store_stream(self, stream, filename, metadata=None):
+        """
+        Streams a readable file object into GridFS chunk by chunk.
+        Returns:
+            Dict with `gridfs_id`, `size` and `sha256` to merge into the metadata document.
+        """
+        reader = HashingReader(stream)
+        gridfs_id = self.bucket.upload_from_stream(filename, reader, metadata=metadata)
+        return {
+            'gridfs_id': gridfs_id,
+            'size': reader.size,
+            'sha256': reader.sha256.hexdigest()
+        }
+
+    def store_bytes(self, data, filename, metadata=None):
+        """
+        Stores an in-memory payload; used when migrating inline documents.
+        """
+        return self.store_stream(io.BytesIO(data), filename, metadata=metadata)
+
+    def store_appended(self, file_doc, stream):
+        """
+        GridFS files are immutable, so appending writes a new file holding the
+        current payload followed by `stream`, copied chunk by chunk. The old
+        payload is left in place for the caller to delete once the metadata
+        document points at the new one.
+        Returns:
+            Dict with `gridfs_id`, `size` and `sha256` of the new payload.
+        """
+        file_doc = self.migrate_inline_file(file_doc)
+        streams = []
+        with self.open_stream(file_doc) as current:
+            streams.append(current)
+            if file_doc['size'] > 0:
+                current.seek(file_doc['size'] - 1)
+                if current.read(1) != b'\n':
+                    streams.append(io.BytesIO(b'\n'))
+                current.seek(0)
+            streams.append(stream)
+            return self.store_stream(ConcatenatedReader(streams), file_doc.get('filename', 'file'),
+                                     metadata={'email': file_doc.get('email')})
+
+    def migrate_inline_file(self, file_doc):
+        """
+        Moves the inline `data` payload of a legacy document into GridFS.
+        Returns:
+            The metadata document as it looks after migration, or None if it no longer exists.
+        """
+        if 'gridfs_id' in file_doc:
+            return file_doc
+
+        if 'data' not in file_doc:
+            # The payload is only read here, by naming it in the projection
+            stored_doc = self.files_collection.find_one(
+                {'_id': file_doc['_id']}, {'data': 1, 'gridfs_id': 1, 'filename': 1, 'email': 1}
+            )
+            if stored_doc is None:
+                return None
+            if 'gridfs_id' in stored_doc:
+                return self.files_collection.find_one({'_id': file_doc['_id']}, METADATA_PROJECTION)
+            file_doc = {**file_doc, **stored_doc}
+
+        data = file_doc.get('data') or b''
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        # Same GridFS metadata as a fresh upload
+        stored = self.store_bytes(bytes(data), file_doc.get('filename', 'file'),
+                                  metadata={'email': file_doc.get('email')})
+
+        # Only swap the pointer in if nobody migrated the document in the meantime
+        updated = self.files_collection.update_one(
+            {'_id': file_doc['_id'], 'gridfs_id': {'$exists': False}},
+            {'$set': stored, '$unset': {'data': ''}}
+        )
+        if updated.modified_count == 0:
+            self.bucket.delete(stored['gridfs_id'])
+            return self.files_collection.find_one({'_id': file_doc['_id']}, METADATA_PROJECTION)
+
+        print(f"Migrated inline file {file_doc['_id']} to GridFS ({stored['size']} bytes)")
+        file_doc = {k: v for k, v in file_doc.items() if k != 'data'}
+        file_doc.update(stored)
+        return file_doc
+
+    def migrate_inline_files(self):
+        """
+        Migrates every legacy document that still has an inline `data` field.
+        Returns:
+            Number of migrated documents.
+        """
+        migrated = 0
+        for file_doc in self.files_collection.find({'gridfs_id': {'$exists': False}}, {'_id': 1}):
+            if self.migrate_inline_file(file_doc) is not None:
+                migrated += 1
+        return migrated
+
+    def open_stream(self, file_doc):
+        """
+        Opens the stored payload as a seekable, chunk-buffered file object.
+        """
+        file_doc = self.migrate_inline_file(file_doc)
+        if file_doc is None:
+            raise FileNotFoundError('File data not found')
+        try:
+            return self.bucket.open_download_stream(file_doc['gridfs_id'])
+        except NoFile:
+            raise FileNotFoundError('File data not found')
+
+    def iter_range(self, file_doc, start=0, stop=None):
+        """
+        Yields the payload bytes in [start, stop) one GridFS chunk at a time.
+        The download stream is opened lazily and closed when the generator ends,
+        so a response never holds more than one chunk in memory.
+        """
+        with self.open_stream(file_doc) as grid_out:
+            if stop is None:
+                stop = grid_out.length
+            grid_out.seek(start)
+            position = start
+            while position < stop:
+                # Align reads to chunk boundaries so each read touches a single chunk
+                to_boundary = self.chunk_size - (position % self.chunk_size)
+                chunk = grid_out.read(min(to_boundary, stop - position))
+                if not chunk:
+                    break
+                position += len(chunk)
+                yield chunk
+
+    def read_bytes(self, file_doc):
+        """
+        Reads the full payload; only for callers that need the whole file in memory.
+        """
+        with self.open_stream(file_doc) as grid_out:
+            return grid_out.read()
+
+    def delete_data(self, file_doc):
+        """
+        Removes the GridFS payload belonging to a metadata document, if any.
+        """
+        if 'gridfs_id' not in file_doc:
+            return
+        try:
+            self.bucket.delete(file_doc['gridfs_id'])
+        except NoFile:
+            pass
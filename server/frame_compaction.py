@@ -0,0 +1,124 @@
+"""
+Memory-compact representation of cached DataFrames.
+
+CSV parsing produces int64, float64 and object columns. Most of that width is
+unused: small integers, integral floats that only became float because of a
+missing value, and text columns with a handful of distinct values (`Region`,
+`Category`). `compact_frame` stores such columns as:
+    - the smallest integer dtype that holds the values,
+    - a nullable integer dtype (Int8 ... Int64) for float columns holding only
+      whole numbers, typically integer columns with missing values,
+    - a categorical for text with few distinct values,
+    - Arrow-backed strings for the remaining text, when pyarrow is installed.
+
+Every conversion is lossless, and `restore_frame` turns a compact frame back
+into one that `DataFrame.equals` the original, dtypes included. Callers such
+as the model functions (`summary_csv`, `encode_categorical`,
+`aggregate_data`, ...) therefore always see the frame exactly as parsed; only
+the copy held in memory between requests is compact.
+"""
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    ARROW_STRINGS = True
+except ImportError:
+    ARROW_STRINGS = False
+
+# Text columns with at most this share of distinct values become categoricals
+CATEGORY_MAX_RATIO = 0.5
+NULLABLE_INTEGERS = ('Int8', 'Int16', 'Int32', 'Int64')
+
+
+def _nullable_integer(values):
+    low, high = values.min(), values.max()
+    for dtype in NULLABLE_INTEGERS:
+        info = np.iinfo(dtype.lower())
+        if info.min <= low and high <= info.max:
+            return dtype
+    return None
+
+
+def compact_column(series, category_max_ratio=CATEGORY_MAX_RATIO):
+    """
+    Returns:
+        The compact version of `series`, or `series` itself if no lossless
+        smaller representation applies.
+    """
+    dtype = series.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in 'iu':
+        return pd.to_numeric(series, downcast='integer' if dtype.kind == 'i' else 'unsigned')
+
+    if isinstance(dtype, np.dtype) and dtype.kind == 'f':
+        values = series.to_numpy()
+        finite = values[~np.isnan(values)]
+        if (len(finite) and np.isfinite(finite).all()
+                and (finite == np.round(finite)).all() and np.abs(finite).max() < 2 ** 53
+                and not np.signbit(finite[finite == 0]).any()):
+            target = _nullable_integer(finite)
+            if target is not None:
+                return series.astype(target)
+        return series
+
+    if dtype == object and pd.api.types.infer_dtype(series, skipna=True) == 'string':
+        non_null = series.dropna()
+        if len(non_null) and non_null.nunique() <= category_max_ratio * len(non_null):
+            return series.astype('category')
+        if ARROW_STRINGS:
+            return series.astype('string[pyarrow]')
+    return series
+
+
+def compact_frame(df, category_max_ratio=CATEGORY_MAX_RATIO):
+    """
+    Builds the compact representation of a frame.
+    Returns:
+        Tuple of (compact DataFrame, report). The report holds per-column
+        `dtype_before`, `dtype_after`, `bytes_before` and `bytes_after`, plus
+        the frame totals, and is what restore_frame needs to undo the compaction.
+    """
+    compact = df.copy(deep=False)
+    columns = []
+    before = df.memory_usage(index=False, deep=True).to_numpy()
+    for position, col in enumerate(df.columns):
+        series = df.iloc[:, position]
+        converted = compact_column(series, category_max_ratio)
+        if converted is not series:
+            compact.isetitem(position, converted)
+        columns.append({
+            'column': str(col),
+            'dtype_before': str(series.dtype),
+            'dtype_after': str(converted.dtype)
+        })
+    after = compact.memory_usage(index=False, deep=True).to_numpy()
+    for entry, bytes_before, bytes_after in zip(columns, before, after):
+        entry['bytes_before'] = int(bytes_before)
+        entry['bytes_after'] = int(bytes_after)
+    report = {
+        'columns': columns,
+        'bytes_before': int(before.sum()),
+        'bytes_after': int(after.sum())
+    }
+    return compact, report
+
+
+def restore_column(series, dtype_before):
+    if dtype_before == 'object':
+        restored = series.astype(object)
+        if not isinstance(series.dtype, pd.CategoricalDtype) and series.hasnans:
+            # Arrow strings mark missing values as pd.NA, parsed frames as NaN
+            restored = restored.where(series.notna(), np.nan)
+        return restored
+    return series.astype(dtype_before)
+
+
+def restore_frame(df, report):
+    """
+    Undoes compact_frame, returning a new frame with the original dtypes.
+    """
+    restored = df.copy(deep=False)
+    for position, entry in enumerate(report['columns']):
+        if entry['dtype_after'] != entry['dtype_before']:
+            restored.isetitem(position, restore_column(df.iloc[:, position], entry['dtype_before']))
+    return restored
@@ -0,0 +1,236 @@
+"""
+Plot rendering for analyze_csv_with_ai.
+
+Plots are described by small, JSON-serialisable specs that already hold the
+aggregated data each chart needs (histogram counts, box plot statistics, top
+values, the correlation matrix, sample predictions). A spec can be rendered
+on its own, without the source DataFrame, which allows:
+    - rendering independent plots in parallel worker processes, and
+    - storing the specs with an analysis and rendering a PNG only when the
+      client first asks for it.
+
+Rendering uses the object-oriented matplotlib API, so no pyplot global state
+is shared between plots.
+"""
+import base64
+import io
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.cbook import boxplot_stats
+from matplotlib.figure import Figure
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def _floats(values):
+    return [float(v) for v in values]
+
+
+def histogram_spec(col, values, scale=1.0):
+    """
+    Args:
+        values: Non-null values of the column, or a uniform sample of them.
+        scale: Rows represented by each value when `values` is a sample.
+    """
+    counts, edges = np.histogram(values, bins=20)
+    return {
+        "name": f"histogram_{col}.png",
+        "kind": "histogram",
+        "column": col,
+        "counts": [int(round(c * scale)) for c in counts],
+        "edges": _floats(edges)
+    }
+
+
+def box_spec(columns_values):
+    """
+    Args:
+        columns_values: List of (column, non-null values) pairs.
+    """
+    stats = []
+    for col, values in columns_values:
+        if len(values) == 0:
+            stats.append({"label": str(col), "empty": True})
+            continue
+        col_stats = boxplot_stats(values)[0]
+        stats.append({
+            "label": str(col),
+            "med": float(col_stats["med"]),
+            "q1": float(col_stats["q1"]),
+            "q3": float(col_stats["q3"]),
+            "whislo": float(col_stats["whislo"]),
+            "whishi": float(col_stats["whishi"]),
+            "fliers": _floats(col_stats["fliers"])
+        })
+    return {"name": "box_plot.png", "kind": "box", "stats": stats}
+
+
+def bar_spec(col, labels, values):
+    return {
+        "name": f"bar_{col}.png",
+        "kind": "bar",
+        "column": col,
+        "labels": [str(label) for label in labels],
+        "values": [int(v) for v in values]
+    }
+
+
+def heatmap_spec(corr_matrix):
+    return {
+        "name": "correlation_heatmap.png",
+        "kind": "heatmap",
+        "columns": [str(col) for col in corr_matrix.columns],
+        "matrix": [_floats(row) for row in corr_matrix.to_numpy()]
+    }
+
+
+def prediction_spec(target_col, sample_predictions):
+    return {
+        "name": "prediction_plot.png",
+        "kind": "prediction",
+        "target": str(target_col),
+        "actual": [float(x[0]) for x in sample_predictions],
+        "predicted": [float(x[1]) for x in sample_predictions]
+    }
+
+
+def build_plot_specs(df, numerical_cols, categorical_cols, corr_matrix=None, predictions=None, top_values=None):
+    """
+    Builds the plot specs for an analysis, in the order the plots are returned.
+    Args:
+        df: Analysed DataFrame.
+        numerical_cols, categorical_cols: Column groups from the analysis.
+        corr_matrix: Correlation DataFrame, if one was computed.
+        predictions: The analysis "predictions" dict.
+        top_values: Already computed {column: {value: count}} top values for the bar plots.
+    Returns:
+        List of plot specs.
+    """
+    specs = []
+
+    # 1. Histogram for Numerical Columns
+    for col in numerical_cols:
+        specs.append(histogram_spec(col, df[col].dropna().to_numpy(dtype=float)))
+
+    # 2. Box Plot for Numerical Columns
+    if len(numerical_cols) > 0:
+        specs.append(box_spec([(col, df[col].dropna().to_numpy(dtype=float)) for col in numerical_cols]))
+
+    # 3. Bar Plot for Categorical Columns (Top 5 Values)
+    for col in categorical_cols:
+        if top_values is not None:
+            specs.append(bar_spec(col, list(top_values[col].keys()), list(top_values[col].values())))
+        else:
+            value_counts = df[col].value_counts().head(5)
+            specs.append(bar_spec(col, value_counts.index, value_counts.values))
+
+    # 4. Correlation Heatmap
+    if corr_matrix is not None:
+        specs.append(heatmap_spec(corr_matrix))
+
+    # 5. Prediction Plot (if predictions were made)
+    if predictions and "sample_predictions" in predictions:
+        specs.append(prediction_spec(predictions["target"], predictions["sample_predictions"]))
+
+    return specs
+
+
+def render_plot(spec):
+    """
+    Renders a single plot spec.
+    Returns:
+        PNG bytes.
+    """
+    print(f"Rendering {spec['name']}...")
+    kind = spec["kind"]
+
+    if kind == "histogram":
+        fig = Figure(figsize=(8, 6))
+        ax = fig.add_subplot()
+        edges = np.asarray(spec["edges"])
+        ax.hist(edges[:-1], bins=edges, weights=spec["counts"], color='skyblue', edgecolor='black')
+        ax.set_title(f'Histogram of {spec["column"]}')
+        ax.set_xlabel(spec["column"])
+        ax.set_ylabel('Frequency')
+
+    elif kind == "box":
+        fig = Figure(figsize=(10, 6))
+        ax = fig.add_subplot()
+        stats = [s for s in spec["stats"] if not s.get("empty")]
+        if stats:
+            ax.bxp(stats, positions=range(1, len(stats) + 1))
+            ax.set_xticks(range(1, len(stats) + 1), [s["label"] for s in stats], rotation=45)
+        ax.grid(True)
+        ax.set_title('Box Plot of Numerical Columns')
+
+    elif kind == "bar":
+        fig = Figure(figsize=(8, 6))
+        ax = fig.add_subplot()
+        ax.bar(spec["labels"], spec["values"], color='lightgreen', edgecolor='black')
+        ax.set_title(f'Top 5 Values in {spec["column"]}')
+        ax.set_xlabel(spec["column"])
+        ax.set_ylabel('Count')
+        ax.tick_params(axis='x', labelrotation=45)
+
+    elif kind == "heatmap":
+        fig = Figure(figsize=(10, 8))
+        ax = fig.add_subplot()
+        image = ax.imshow(np.asarray(spec["matrix"], dtype=float), cmap='coolwarm', interpolation='nearest')
+        fig.colorbar(image)
+        ax.set_xticks(np.arange(len(spec["columns"])), spec["columns"], rotation=45)
+        ax.set_yticks(np.arange(len(spec["columns"])), spec["columns"])
+        ax.set_title('Correlation Heatmap')
+
+    elif kind == "prediction":
+        fig = Figure(figsize=(8, 6))
+        ax = fig.add_subplot()
+        ax.scatter(range(len(spec["actual"])), spec["actual"], color='blue', label='Actual')
+        ax.scatter(range(len(spec["predicted"])), spec["predicted"], color='red', label='Predicted')
+        ax.set_title(f'Actual vs Predicted for {spec["target"]}')
+        ax.set_xlabel('Sample Index')
+        ax.set_ylabel(spec["target"])
+        ax.legend()
+
+    else:
+        raise ValueError(f"Unknown plot kind: {kind}")
+
+    FigureCanvasAgg(fig)
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+def _get_executor(workers):
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=workers)
+            _executor_workers = workers
+        return _executor
+
+
+def render_plots(specs, workers=None, on_plot=None):
+    """
+    Renders plot specs into the {"name", "data"} base64 entries of an analysis.
+    Args:
+        specs: Plot specs from build_plot_specs.
+        workers: Number of worker processes; None or 1 renders in this process.
+        on_plot: Optional callable taking (index, plot entry), called as each plot is ready, in order.
+    """
+    if workers and workers > 1 and len(specs) > 1:
+        images = _get_executor(workers).map(render_plot, specs)
+    else:
+        images = (render_plot(spec) for spec in specs)
+    plots = []
+    for index, (spec, image) in enumerate(zip(specs, images)):
+        plots.append({"name": spec["name"], "data": base64.b64encode(image).decode('utf-8')})
+        if on_plot is not None:
+            on_plot(index, plots[-1])
+    return plots
@@ -0,0 +1,88 @@
+"""
+Content-addressed store for rendered plot images.
+
+Each PNG is stored once in the `plot_artifacts` collection under the SHA-256
+of its bytes. Analyses keep only `{"name", "sha256"}` references and the
+client loads the images from `/plots/<sha256>.png`. Because the URL changes
+whenever the content does, the endpoint can be cached indefinitely by the
+browser and any proxy in between. That endpoint is not authenticated: the
+digest of an image acts as a capability, so anyone who has a plot's URL can
+load it.
+
+Every image records the analyses that reference it in `owners`. Deleting
+analyses releases their images, and an image no analysis owns any more is
+deleted with them. Images stored before owners were tracked are adopted by
+the analyses that reference them when the server starts.
+"""
+import datetime
+import hashlib
+
+from bson.binary import Binary
+
+
+class PlotStore:
+    """
+    Stores PNG bytes keyed by their content hash.
+    Args:
+        collection: Collection with one document per distinct image.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+
+    def put(self, image, owner):
+        """
+        Stores an image if it is not stored yet and records `owner` as referencing it.
+        Args:
+            owner: Id of the analysis the image belongs to.
+        Returns:
+            The hex SHA-256 digest that addresses the image.
+        """
+        digest = hashlib.sha256(image).hexdigest()
+        self.collection.update_one(
+            {'_id': digest},
+            {
+                '$setOnInsert': {
+                    'data': Binary(image),
+                    'size': len(image),
+                    'mimetype': 'image/png',
+                    'created_at': datetime.datetime.utcnow()
+                },
+                '$addToSet': {'owners': owner}
+            },
+            upsert=True
+        )
+        return digest
+
+    def get(self, digest):
+        """
+        Returns the stored image bytes, or None if the digest is unknown.
+        """
+        doc = self.collection.find_one({'_id': digest}, {'data': 1})
+        return bytes(doc['data']) if doc else None
+
+    def release(self, owners):
+        """
+        Drops `owners` from the images they reference and deletes the images left without owners.
+        Returns:
+            Number of deleted images.
+        """
+        if not owners:
+            return 0
+        self.collection.update_many({'owners': {'$in': owners}}, {'$pullAll': {'owners': owners}})
+        return self.collection.delete_many({'owners': {'$size': 0}}).deleted_count
+
+    def adopt(self, analysis_collection):
+        """
+        Records the owners of images stored before owners were tracked; images no
+        analysis references are deleted.
+        Returns:
+            Number of adopted images.
+        """
+        adopted = 0
+        for doc in self.collection.find({'owners': {'$exists': False}}, {'_id': 1}):
+            owners = [analysis['_id'] for analysis in analysis_collection.find({'plots.sha256': doc['_id']}, {'_id': 1})]
+            self.collection.update_one({'_id': doc['_id'], 'owners': {'$exists': False}},
+                                       {'$set': {'owners': owners}})
+            adopted += 1
+        self.collection.delete_many({'owners': {'$size': 0}})
+        return adopted
@@ -0,0 +1,81 @@
+"""
+Progress events of long-running analyses and cleaning pipelines.
+
+analyze_csv_with_ai, analyze_csv_streaming and run_pipeline take an optional
+`StageProgress` and call it at every stage transition (parse, insights,
+regression, correlation, each plot, each pipeline step) with the partial
+results that are ready at that point. Without a callback the calls do
+nothing.
+
+`event_stream` runs such a job in a background thread and turns its events
+into server-sent events (text/event-stream): one `progress` event per stage,
+then a single `result` event with the body the JSON route would have returned,
+or an `error` event with its message and status. Event data is encoded as
+soon as it is reported, because the job keeps adding to the same result dicts.
+"""
+import queue
+import threading
+import time
+
+# Comment lines sent while a stage runs, so proxies keep the connection open
+KEEPALIVE_SECONDS = 15
+
+
+class StageProgress:
+    """
+    Reports stage transitions as {"stage", "seconds", "elapsed", ...} events.
+    `seconds` is the time since the previous event, `elapsed` since the start.
+    Args:
+        callback: Called with each event dict, or None to report nothing.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.started = self.last = time.perf_counter()
+
+    def __call__(self, stage, **data):
+        if self.callback is None:
+            return
+        now = time.perf_counter()
+        event = {'stage': stage, 'seconds': round(now - self.last, 6), 'elapsed': round(now - self.started, 6)}
+        event.update(data)
+        self.last = now
+        self.callback(event)
+
+
+def format_event(name, data):
+    return f"event: {name}\ndata: {data}\n\n"
+
+
+def event_stream(work, dumps, keepalive=KEEPALIVE_SECONDS):
+    """
+    Runs a job in a background thread and yields its progress as server-sent events.
+    Args:
+        work: Called with a StageProgress; returns (response body, status) of the job.
+        dumps: JSON encoder for the event data (single line).
+    Yields:
+        `progress` events, then a `result` event (status below 400) or an `error`
+        event, each holding the body with its `status`.
+    """
+    events = queue.Queue()
+
+    def run():
+        try:
+            try:
+                body, status = work(StageProgress(lambda event: events.put(format_event('progress', dumps(event)))))
+            except Exception as e:
+                print(f"Event stream error: {str(e)}")
+                body, status = {'message': f'Error: {str(e)}'}, 500
+            events.put(format_event('result' if status < 400 else 'error', dumps(dict(body, status=status))))
+        finally:
+            events.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        try:
+            event = events.get(timeout=keepalive)
+        except queue.Empty:
+            yield ': keepalive\n\n'
+            continue
+        if event is None:
+            return
+        yield event
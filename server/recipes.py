@@ -0,0 +1,228 @@
+"""
+Saved cleaning recipes, replayed over many files in the process pool.
+
+A recipe is a named list of pipeline steps (see cleaning_pipeline). Saving a
+recipe under an existing name adds a new version; older versions stay
+available, so a run can always name the exact steps it used.
+
+`RecipeRunner` applies one recipe version to a batch of files. Every file is
+a separate task in the analysis process pool; at most `max_parallel` files of
+a run are loaded or in flight at a time, so a run over dozens of uploads does
+not hold all of them in memory. Each file goes through `run_pipeline` exactly
+as /pipeline/<file_id> would run it and is persisted as a new working copy
+revision, and progress is kept per file in the `recipe_runs` collection.
+Runs that were in progress when the server stopped are failed on the next
+start, together with their unfinished files; files that were already
+persisted keep their results.
+"""
+import datetime
+import threading
+
+from bson.objectid import ObjectId
+
+from analysis_jobs import DONE, FAILED, INTERRUPTED, QUEUED, RUNNING
+from cleaning_pipeline import OperationError, normalize_steps, run_pipeline
+
+
+def run_recipe(df, steps):
+    """
+    Worker entry point; applies normalized steps to one file's working frame.
+    Returns:
+        Dict with the resulting `df` and per-step results in `steps`, or with
+        `error` and `failed_step` if a step failed.
+    """
+    try:
+        result_df, step_results = run_pipeline(df, steps)
+    except OperationError as e:
+        return {'error': e.message, 'failed_step': e.step, 'steps': e.step_results}
+    return {'df': result_df, 'steps': step_results}
+
+
+class RecipeStore:
+    """
+    Versioned recipes, one document per (email, name, version).
+    """
+    def __init__(self, collection):
+        self.collection = collection
+
+    def save(self, email, name, steps, description=''):
+        """
+        Stores `steps` as the next version of recipe `name`.
+        Returns:
+            The stored recipe document.
+        Raises:
+            ValueError: For a missing name or malformed steps.
+        """
+        if not isinstance(name, str) or not name.strip():
+            raise ValueError('Recipe name is missing')
+        steps = normalize_steps(steps)
+        latest = self.get(email, name)
+        recipe = {
+            'email': email,
+            'name': name.strip(),
+            'version': latest['version'] + 1 if latest else 1,
+            'description': description or '',
+            'steps': steps,
+            'created_at': datetime.datetime.utcnow()
+        }
+        recipe['_id'] = self.collection.insert_one(recipe).inserted_id
+        return recipe
+
+    def get(self, email, name, version=None):
+        """
+        Returns:
+            The given version of a recipe, the latest one if `version` is None, or None.
+        """
+        query = {'email': email, 'name': name.strip() if isinstance(name, str) else name}
+        if version is not None:
+            return self.collection.find_one({**query, 'version': int(version)})
+        return self.collection.find_one(query, sort=[('version', -1)])
+
+    def list(self, email):
+        """
+        Returns:
+            The latest version of every recipe of a user, by name.
+        """
+        latest = {}
+        for recipe in self.collection.find({'email': email}, {'steps': 0}).sort('version', 1):
+            latest[recipe['name']] = recipe
+        return [latest[name] for name in sorted(latest)]
+
+
+class RecipeRunner:
+    """
+    Runs recipes over batches of files.
+    Args:
+        runs_collection: Collection with one progress document per run.
+        executor: Callable returning the process pool to run files in.
+        load: Called in the server process as `load(file_id, email)`; returns
+            the frame to work on and an opaque value handed to `persist`.
+            Raises LookupError or ValueError for a file that cannot be used.
+        persist: Called in the server process as `persist(file_id, email, loaded, output)`
+            with the output of run_recipe; returns a dict of fields to store for the file.
+        max_parallel: Files of one run that are loaded or in flight at a time.
+    """
+    def __init__(self, runs_collection, executor, load, persist, max_parallel=2):
+        self.runs_collection = runs_collection
+        self.executor = executor
+        self.load = load
+        self.persist = persist
+        self.max_parallel = max_parallel
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def start(self, email, recipe, file_ids):
+        """
+        Queues a run of `recipe` over `file_ids`.
+        Returns:
+            The run id as a string.
+        """
+        run = {
+            'email': email,
+            'recipe': recipe['name'],
+            'version': recipe['version'],
+            'status': RUNNING,
+            'files': [{'file_id': file_id, 'status': QUEUED} for file_id in file_ids],
+            'progress': {'total': len(file_ids), 'done': 0, 'failed': 0},
+            'submitted_at': datetime.datetime.utcnow()
+        }
+        run_id = self.runs_collection.insert_one(run).inserted_id
+        with self._lock:
+            self._pending[run_id] = {
+                'email': email,
+                'steps': recipe['steps'],
+                'queue': list(enumerate(file_ids)),
+                'in_flight': 0
+            }
+        for _ in range(min(self.max_parallel, len(file_ids))):
+            self._submit_next(run_id)
+        return str(run_id)
+
+    def get(self, run_id, email):
+        return self.runs_collection.find_one({'_id': ObjectId(run_id), 'email': email})
+
+    def recover(self):
+        """
+        Fails the runs left running by a previous server process, and their unfinished files.
+        Returns:
+            Number of recovered runs.
+        """
+        now = datetime.datetime.utcnow()
+        interrupted = {'status': FAILED, 'error': INTERRUPTED, 'finished_at': now}
+        recovered = 0
+        for run in self.runs_collection.find({'status': RUNNING}, {'files.status': 1}):
+            pending = [index for index, file in enumerate(run['files']) if file['status'] in (QUEUED, RUNNING)]
+            update = {f'files.{index}.{key}': value for index in pending for key, value in interrupted.items()}
+            update.update(interrupted)
+            result = self.runs_collection.update_one(
+                {'_id': run['_id'], 'status': RUNNING},
+                {'$set': update, '$inc': {'progress.failed': len(pending)}}
+            )
+            recovered += result.modified_count
+        return recovered
+
+    def _submit_next(self, run_id):
+        while True:
+            with self._lock:
+                state = self._pending.get(run_id)
+                if state is None:
+                    return
+                if not state['queue']:
+                    if state['in_flight'] == 0:
+                        del self._pending[run_id]
+                        self._complete(run_id)
+                    return
+                index, file_id = state['queue'].pop(0)
+                state['in_flight'] += 1
+            try:
+                df, loaded = self.load(file_id, state['email'])
+            except Exception as e:
+                self._file_finished(run_id, index, {'status': FAILED, 'error': str(e)})
+                continue
+            self._update_file(run_id, index, {'status': RUNNING, 'started_at': datetime.datetime.utcnow()})
+            future = self.executor().submit(run_recipe, df, state['steps'])
+            future.add_done_callback(
+                lambda f, index=index, file_id=file_id, loaded=loaded: self._finish_file(
+                    run_id, index, file_id, state['email'], loaded, f
+                )
+            )
+            return
+
+    def _finish_file(self, run_id, index, file_id, email, loaded, future):
+        try:
+            output = future.result()
+            if 'error' in output:
+                update = {'status': FAILED, 'error': output['error'], 'failed_step': output['failed_step'],
+                          'steps': output['steps']}
+            else:
+                update = {'status': DONE, 'steps': output['steps']}
+                update.update(self.persist(file_id, email, loaded, output) or {})
+        except Exception as e:
+            print(f"Recipe run {run_id}, file {file_id} failed: {str(e)}")
+            update = {'status': FAILED, 'error': str(e)}
+        self._file_finished(run_id, index, update)
+        self._submit_next(run_id)
+
+    def _file_finished(self, run_id, index, update):
+        update['finished_at'] = datetime.datetime.utcnow()
+        counter = 'progress.done' if update['status'] == DONE else 'progress.failed'
+        self.runs_collection.update_one(
+            {'_id': run_id},
+            {'$set': {f'files.{index}.{key}': value for key, value in update.items()}, '$inc': {counter: 1}}
+        )
+        with self._lock:
+            state = self._pending.get(run_id)
+            if state is not None:
+                state['in_flight'] -= 1
+
+    def _update_file(self, run_id, index, update):
+        self.runs_collection.update_one(
+            {'_id': run_id},
+            {'$set': {f'files.{index}.{key}': value for key, value in update.items()}}
+        )
+
+    def _complete(self, run_id):
+        self.runs_collection.update_one(
+            {'_id': run_id},
+            {'$set': {'status': DONE, 'finished_at': datetime.datetime.utcnow()}}
+        )
@@ -0,0 +1,218 @@
+"""
+Linear regression from accumulated normal equations.
+
+`GramAccumulator` keeps the cross-product matrix of `[1, x_1, ..., x_k]` over
+complete rows. It can be updated chunk by chunk, merged and serialised, so a
+regression never needs the rows themselves: coefficients come from solving
+the normal equations and R² on held-out rows comes from a second Gram matrix.
+
+`solve_all` fits every accumulated variable against all the others from the
+same matrix in one pass: with P the inverse of the centred cross-product
+matrix, the coefficients of target j are -P[j, i] / P[j, j]. `batch_regression`
+turns that into per-target results, and since the Gram matrices are small
+(k + 1 squared), they are kept with the analysis so that any later
+target / feature combination is a solve away.
+"""
+import numpy as np
+
+# Above this many columns only the headline target is fitted and no Gram matrices are kept,
+# so per-target results and the cache stay well inside a MongoDB document
+BATCH_MAX_COLUMNS = 200
+
+
+class GramAccumulator:
+    """
+    Mergeable cross-product matrix Z'Z with Z = [1, columns].
+    Args:
+        columns: Names of the accumulated variables, in matrix order (after the intercept).
+    """
+    def __init__(self, columns):
+        self.columns = list(columns)
+        size = len(self.columns) + 1
+        self.gram = np.zeros((size, size))
+
+    @property
+    def n(self):
+        return int(round(self.gram[0, 0]))
+
+    def update(self, values):
+        """
+        Adds complete rows (2-D array, one column per variable, no NaN).
+        """
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        z = np.column_stack([np.ones(len(values)), values])
+        self.gram += z.T @ z
+
+    def merge(self, other):
+        self.gram += other.gram
+        return self
+
+    def index(self, names):
+        return [self.columns.index(name) + 1 for name in names]
+
+    def solve(self, target, features):
+        """
+        Least-squares fit of `target` on `features` with an intercept.
+        Returns:
+            Tuple of (intercept, coefficient array).
+        """
+        rows = [0] + self.index(features)
+        t = self.index([target])[0]
+        a = self.gram[np.ix_(rows, rows)]
+        b = self.gram[rows, t]
+        beta = np.linalg.lstsq(a, b, rcond=None)[0]
+        return beta[0], beta[1:]
+
+    def r2_score(self, target, features, intercept, coef):
+        """
+        R² of the given fit on the rows accumulated in this matrix, as sklearn's `score` computes it.
+        """
+        n = self.gram[0, 0]
+        if n == 0:
+            return float('nan')
+        rows = [0] + self.index(features)
+        t = self.index([target])[0]
+        beta = np.concatenate([[intercept], coef])
+        g_ff = self.gram[np.ix_(rows, rows)]
+        g_ft = self.gram[rows, t]
+        g_tt = self.gram[t, t]
+        sse = g_tt - 2 * beta @ g_ft + beta @ g_ff @ beta
+        sst = g_tt - self.gram[0, t] ** 2 / n
+        if sst == 0:
+            return 1.0 if sse == 0 else 0.0
+        return 1 - sse / sst
+
+    def solve_all(self):
+        """
+        Least-squares fit of every column on all the other columns, with an intercept.
+        Returns:
+            Tuple of (intercepts, coefficients): coefficients[j] holds the fit of
+            column j, with a 0 at position j.
+        """
+        k = len(self.columns)
+        n = self.gram[0, 0]
+        means = self.gram[0, 1:] / n
+        centred = self.gram[1:, 1:] - n * np.outer(means, means)
+        if k > 1 and np.linalg.matrix_rank(centred) == k:
+            precision = np.linalg.inv(centred)
+            coef = -precision / np.diag(precision)[:, None]
+            np.fill_diagonal(coef, 0.0)
+        else:
+            # Collinear columns: the inverse does not exist, fall back to one lstsq per target
+            coef = np.zeros((k, k))
+            for j, target in enumerate(self.columns):
+                features = [col for col in self.columns if col != target]
+                others = [i for i in range(k) if i != j]
+                coef[j, others] = self.solve(target, features)[1]
+        intercepts = means - coef @ means
+        return intercepts, coef
+
+    def r2_scores(self, intercepts, coef):
+        """
+        R² of the fits from solve_all on the rows accumulated in this matrix, for all targets at once.
+        """
+        n = self.gram[0, 0]
+        k = len(self.columns)
+        if n == 0:
+            return np.full(k, np.nan)
+        # Residual of target j is Z @ weights[:, j]
+        weights = np.vstack([-intercepts, np.eye(k) - coef.T])
+        sse = np.einsum('ij,ik,kj->j', weights, self.gram, weights)
+        g_tt = np.diag(self.gram)[1:]
+        sst = g_tt - self.gram[0, 1:] ** 2 / n
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = 1 - sse / sst
+        # As r2_score: a constant target scores 1 when predicted exactly, else 0
+        constant = sst == 0
+        scores[constant] = np.where(sse[constant] == 0, 1.0, 0.0)
+        return scores
+
+    def to_dict(self):
+        return {'columns': self.columns, 'gram': self.gram.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        accumulator = cls(data['columns'])
+        accumulator.gram = np.asarray(data['gram'], dtype=float)
+        return accumulator
+
+
+def batch_regression(train, test, test_rows, targets=None):
+    """
+    Fits every target on all other columns of `train` and scores the fits on `test`.
+    Args:
+        train, test: GramAccumulators over the same columns.
+        test_rows: A few complete held-out rows (all columns, in accumulator order)
+            for the sample predictions.
+        targets: Columns to report; defaults to all of them.
+    Returns:
+        {target: {"features", "intercept", "coefficients", "r2_score", "sample_predictions"}}.
+    """
+    intercepts, coef = train.solve_all()
+    scores = test.r2_scores(intercepts, coef)
+    rows = np.asarray(test_rows, dtype=float).reshape(-1, len(train.columns))
+    predictions = intercepts + rows @ coef.T
+    results = {}
+    for j, target in enumerate(train.columns):
+        if targets is not None and target not in targets:
+            continue
+        features = [col for col in train.columns if col != target]
+        results[target] = {
+            "features": features,
+            "intercept": float(intercepts[j]),
+            "coefficients": {col: float(coef[j, i]) for i, col in enumerate(train.columns) if col != target},
+            "r2_score": float(scores[j]),
+            "sample_predictions": [(float(row[j]), float(pred)) for row, pred in zip(rows, predictions[:, j])]
+        }
+    return results
+
+
+def regression_cache(train, test, test_rows):
+    """
+    Serialisable form of the matrices behind batch_regression, stored with the
+    analysis as "regression"; None for files wider than BATCH_MAX_COLUMNS.
+    """
+    if len(train.columns) > BATCH_MAX_COLUMNS:
+        return None
+    return {
+        "train": train.to_dict(),
+        "test": test.to_dict(),
+        "test_rows": np.asarray(test_rows, dtype=float).tolist()
+    }
+
+
+def fit_from_cache(cache, target, features=None):
+    """
+    Fits one target from a regression_cache without touching the data.
+    Args:
+        features: Feature columns; defaults to all other columns.
+    Returns:
+        Dict with "target", "features", "intercept", "coefficients", "r2_score"
+        and "sample_predictions".
+    Raises:
+        ValueError: For a column that is not in the cache.
+    """
+    train = GramAccumulator.from_dict(cache["train"])
+    test = GramAccumulator.from_dict(cache["test"])
+    if features is None:
+        features = [col for col in train.columns if col != target]
+    unknown = [col for col in [target] + list(features) if col not in train.columns]
+    if unknown:
+        raise ValueError(f"Unknown numerical columns: {', '.join(map(str, unknown))}")
+    if target in features or not features:
+        raise ValueError("Features must be a non-empty list of columns other than the target")
+    intercept, coef = train.solve(target, features)
+    rows = np.asarray(cache["test_rows"], dtype=float).reshape(-1, len(train.columns))
+    predictions = intercept + rows[:, [train.columns.index(col) for col in features]] @ coef
+    return {
+        "target": target,
+        "features": list(features),
+        "intercept": float(intercept),
+        "coefficients": {col: float(value) for col, value in zip(features, coef)},
+        "r2_score": float(test.r2_score(target, features, intercept, coef)),
+        "sample_predictions": [
+            (float(row[train.columns.index(target)]), float(pred)) for row, pred in zip(rows, predictions)
+        ]
+    }
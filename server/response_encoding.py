@@ -0,0 +1,89 @@
+"""
+JSON encoding and compression of API responses.
+
+`NumpyJSONProvider` lets `jsonify` encode analysis output as it comes out of
+numpy and pandas: numpy scalars and arrays, pandas Series/Index and missing
+values are handled by the encoder's `default` hook while the C encoder walks
+the tree once, instead of rebuilding the whole tree in Python first. Float
+subclasses such as numpy.float64 are written by the encoder itself, and
+everything else keeps Flask's default handling, so responses are
+byte-identical to encoding the converted tree.
+
+`compress_response` negotiates gzip or, when the optional `brotli` package is
+installed, brotli for JSON bodies above a size threshold.
+"""
+import gzip
+
+import numpy as np
+import pandas as pd
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSED_MIMETYPES = ('application/json',)
+
+
+def numpy_default(obj):
+    """
+    Encoder fallback for the types analysis results carry; the rest goes to Flask's default.
+    """
+    if isinstance(obj, np.generic):
+        # Python int, float or bool
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return obj.tolist()
+    if obj is pd.NaT or obj is pd.NA:
+        return None
+    return DefaultJSONProvider.default(obj)
+
+
+class NumpyJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that encodes numpy and pandas values in the encoder's single pass.
+    """
+    default = staticmethod(numpy_default)
+
+
+def accepted_encoding(accept_encodings):
+    """
+    Returns:
+        'br', 'gzip' or None, by the client's Accept-Encoding preferences.
+    """
+    candidates = (['br'] if brotli is not None else []) + ['gzip']
+    qualities = {encoding: accept_encodings[encoding] for encoding in candidates}
+    best = max(candidates, key=lambda encoding: qualities[encoding])
+    return best if qualities[best] > 0 else None
+
+
+def compress_response(response, accept_encodings, min_bytes=COMPRESS_MIN_BYTES):
+    """
+    Compresses a buffered JSON response if the client accepts gzip or brotli.
+    Streamed, already encoded and small responses are returned unchanged.
+    """
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 304) or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSED_MIMETYPES):
+        return response
+    # Compression depends on the request header, so caches must key on it
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < min_bytes:
+        return response
+    encoding = accepted_encoding(accept_encodings)
+    if encoding is None:
+        return response
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0))
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,461 @@
+"""
+Undo/redo log for the manual cleaning working copy.
+
+Every change to a working copy (one /analyze_missing_value operation, one
+pipeline, one recipe run) becomes an entry holding a forward and a backward
+diff between the frames before and after it. A diff only stores what
+changed:
+    - removed rows as a position set plus the removed values, column by column,
+    - changed cells of a column as a position set plus the values on the
+      other side; cells that were missing need no values at all,
+    - added, removed or retyped columns as whole encoded columns,
+    - the column order.
+Position sets are kept as packed bitmasks or as integer arrays, whichever is
+smaller, and values use the columnar encoding of the working store.
+
+Changes that cannot be expressed as a diff (rows added or reordered, diffs
+too large for one document) are stored as full snapshots of both ends, and
+every `snapshot_interval` entries a snapshot of the current frame is taken as
+a checkpoint. Moving to any position in the log starts from the current frame
+or from the snapshot that is cheapest to replay from, so the cost of an undo,
+redo or jump stays bounded however long the log grows.
+
+The log is capped by entry count and stored bytes; compaction drops the
+oldest entries (and redo entries the current state no longer needs) together
+with the snapshots outside the remaining range.
+
+Working copies saved before this log existed carry a `history` list of revert
+entries instead. `import_history` moves it into the log by undoing those
+entries on the current frame, the way the old revert did; entries that no
+longer fit the frame (a restored column whose row count changed since, a
+filled column that was dropped) are discarded together with everything older.
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from working_store import decode_column, encode_column
+
+SNAPSHOT_INTERVAL = 10
+MAX_ENTRIES = 100
+MAX_LOG_BYTES = 256 * 1024 * 1024
+# Forward and backward diff share one document, which must stay below the BSON limit
+MAX_DIFF_BYTES = 12 * 1024 * 1024
+# Columns with a larger share of changed cells are stored whole
+DENSE_CHANGE_RATIO = 0.5
+# History summaries leave the diffs out
+ENTRY_SUMMARY_PROJECTION = {'forward': 0, 'backward': 0}
+SNAPSHOT_SUMMARY_PROJECTION = {'seq': 1, 'bytes': 1}
+
+
+def _encode_positions(positions, length):
+    positions = np.asarray(positions, dtype=np.int64)
+    indices = positions.astype(np.int32) if length < 2 ** 31 else positions
+    if (length + 7) // 8 < indices.nbytes:
+        mask = np.zeros(length, dtype=bool)
+        mask[positions] = True
+        return {'format': 'bitmask', 'length': length, 'data': np.packbits(mask).tobytes()}
+    return {'format': 'indices', 'dtype': indices.dtype.str, 'data': indices.tobytes()}
+
+
+def _decode_positions(encoded):
+    if encoded['format'] == 'bitmask':
+        packed = np.frombuffer(encoded['data'], dtype=np.uint8)
+        return np.flatnonzero(np.unpackbits(packed, count=encoded['length']))
+    return np.frombuffer(encoded['data'], dtype=np.dtype(encoded['dtype'])).astype(np.intp)
+
+
+def _encoded_column(column, series):
+    fmt, blob = encode_column(series.reset_index(drop=True))
+    return {'column': column, 'format': fmt, 'blob': blob}
+
+
+def _set_column(column, series):
+    return {'op': 'set_column', **_encoded_column(column, series)}
+
+
+def _set_values(column, series, positions):
+    values = series.iloc[positions]
+    op = {'op': 'set_values', 'column': column, 'positions': _encode_positions(positions, len(series))}
+    if values.isna().all():
+        # Only missing values on this side: the position set alone restores them
+        op['values'] = None
+    else:
+        op['values'] = _encoded_column(column, values)
+    return op
+
+
+def _op_bytes(op):
+    size = len(op.get('blob', b''))
+    if op.get('positions'):
+        size += len(op['positions']['data'])
+    if op.get('values'):
+        size += len(op['values']['blob'])
+    for entry in op.get('rows', []):
+        size += len(entry['blob'])
+    return size
+
+
+def row_positions(df, old_rows):
+    """
+    Positions in the previous frame of the rows of `df`, read from its index.
+    Model functions keep the index labels of the rows they keep, so a frame
+    derived from one with a RangeIndex maps straight back to it.
+    Returns:
+        Strictly increasing int64 array, or None if the index is no such mapping.
+    """
+    index = df.index
+    if len(index) == 0:
+        return np.arange(0, dtype=np.int64)
+    if len(index) > old_rows or not pd.api.types.is_integer_dtype(index.dtype):
+        return None
+    kept = index.to_numpy(dtype=np.int64)
+    if kept[0] < 0 or kept[-1] >= old_rows or (np.diff(kept) <= 0).any():
+        return None
+    return kept
+
+
+def _changed_positions(before, after):
+    old_values, new_values = before.to_numpy(), after.to_numpy()
+    try:
+        differ = np.asarray(old_values != new_values, dtype=bool)
+    except (TypeError, ValueError):
+        return None
+    if differ.shape != old_values.shape:
+        return None
+    differ &= ~(pd.isna(old_values) & pd.isna(new_values))
+    return np.flatnonzero(differ)
+
+
+def diff_frames(old_df, new_df):
+    """
+    Diffs a working frame against the result of an operation on it.
+    Args:
+        old_df: Frame the operation ran on, with a RangeIndex.
+        new_df: Its result, still carrying the index labels of the kept rows.
+    Returns:
+        Tuple of (forward ops, backward ops, stored bytes), or None when the
+        change has to be stored as snapshots instead.
+    """
+    rows = len(old_df)
+    if not len(old_df.columns) or old_df.columns.has_duplicates or new_df.columns.has_duplicates:
+        return None
+    kept = row_positions(new_df, rows)
+    if kept is None:
+        return None
+    new_df = new_df.reset_index(drop=True)
+
+    forward, backward = [], []
+    removed = np.setdiff1d(np.arange(rows), kept) if len(kept) < rows else None
+    if removed is not None:
+        forward.append({'op': 'drop_rows', 'positions': _encode_positions(removed, rows)})
+
+    def before(column):
+        series = old_df[column]
+        return series if removed is None else series.take(kept).reset_index(drop=True)
+
+    for column in new_df.columns:
+        after = new_df[column]
+        if column not in old_df.columns:
+            forward.append(_set_column(column, after))
+            backward.append({'op': 'drop_column', 'column': column})
+            continue
+        previous = before(column)
+        if previous.dtype == after.dtype:
+            if isinstance(after.dtype, np.dtype):
+                positions = _changed_positions(previous, after)
+                if positions is not None and len(positions) <= DENSE_CHANGE_RATIO * len(after):
+                    if len(positions):
+                        forward.append(_set_values(column, after, positions))
+                        backward.append(_set_values(column, previous, positions))
+                    continue
+            elif previous.reset_index(drop=True).equals(after):
+                continue
+        forward.append(_set_column(column, after))
+        backward.append(_set_column(column, previous))
+
+    for column in old_df.columns:
+        if column not in new_df.columns:
+            forward.append({'op': 'drop_column', 'column': column})
+            backward.append(_set_column(column, before(column)))
+    if list(new_df.columns) != list(old_df.columns):
+        forward.append({'op': 'order', 'columns': list(new_df.columns)})
+        backward.append({'op': 'order', 'columns': list(old_df.columns)})
+    if removed is not None:
+        backward.append({
+            'op': 'insert_rows',
+            'positions': _encode_positions(removed, rows),
+            'rows': [_encoded_column(column, old_df[column].take(removed)) for column in old_df.columns]
+        })
+    return forward, backward, sum(_op_bytes(op) for op in forward + backward)
+
+
+def apply_ops(df, ops):
+    """
+    Applies the forward or backward ops of a diff.
+    Returns:
+        A new frame with a RangeIndex; `df` is not modified.
+    """
+    df = df.copy(deep=False)
+    for op in ops:
+        kind = op['op']
+        if kind == 'drop_rows':
+            keep = np.ones(len(df), dtype=bool)
+            keep[_decode_positions(op['positions'])] = False
+            df = df.iloc[np.flatnonzero(keep)].reset_index(drop=True)
+        elif kind == 'insert_rows':
+            positions = _decode_positions(op['positions'])
+            inserted = pd.DataFrame(
+                {entry['column']: decode_column(entry['format'], entry['blob'], entry['column']) for entry in op['rows']},
+                columns=df.columns
+            )
+            for column in df.columns:
+                if inserted[column].dtype != df[column].dtype:
+                    inserted[column] = inserted[column].astype(df[column].dtype)
+            total = len(df) + len(positions)
+            is_inserted = np.zeros(total, dtype=bool)
+            is_inserted[positions] = True
+            order = np.empty(total, dtype=np.int64)
+            order[~is_inserted] = np.arange(len(df))
+            order[is_inserted] = len(df) + np.arange(len(positions))
+            df = pd.concat([df, inserted], ignore_index=True).take(order).reset_index(drop=True)
+        elif kind == 'set_values':
+            positions = _decode_positions(op['positions'])
+            series = df[op['column']].copy()
+            if op['values'] is None:
+                series.iloc[positions] = np.nan
+            else:
+                values = op['values']
+                series.iloc[positions] = decode_column(values['format'], values['blob'], op['column']).to_numpy()
+            df[op['column']] = series
+        elif kind == 'set_column':
+            df[op['column']] = decode_column(op['format'], op['blob'], op['column'])
+        elif kind == 'drop_column':
+            df = df.drop(columns=[op['column']])
+        elif kind == 'order':
+            df = df[op['columns']]
+    return df
+
+
+
+def history_summary(position, entries, snapshots):
+    """
+    Builds the response of RevisionLog.history; asgi.py runs the same queries on Motor.
+    Args:
+        entries: Log entries in `seq` order, read with ENTRY_SUMMARY_PROJECTION.
+        snapshots: Snapshot headers (`name` None) in `seq` order, read with SNAPSHOT_SUMMARY_PROJECTION.
+    """
+    return {
+        'position': position,
+        'floor': entries[0]['seq'] - 1 if entries else position,
+        'top': entries[-1]['seq'] if entries else position,
+        'entries': [{
+            'position': entry['seq'],
+            'kind': entry['kind'],
+            'operations': entry['operations'],
+            'bytes': entry['bytes'],
+            'applied': entry['seq'] <= position,
+            'created_at': entry['created_at'].isoformat()
+        } for entry in entries],
+        'snapshots': [snapshot['seq'] for snapshot in snapshots],
+        'bytes': sum(entry['bytes'] for entry in entries) + sum(snapshot['bytes'] for snapshot in snapshots)
+    }
+
+
+def _undo_legacy_entry(df, entry):
+    """
+    Returns:
+        The frame before a legacy `history` entry, or None if the entry no longer fits `df`.
+    """
+    column = entry.get('column')
+    if entry.get('operation') == 'delete_column':
+        data = entry.get('data') or []
+        if column in df.columns or len(data) != len(df):
+            return None
+        df = df.copy(deep=False)
+        df[column] = [row.get(column) for row in data]
+        return df
+    if entry.get('operation') == 'fill_missing':
+        labels = [value['index'] for value in entry.get('old_values', [])]
+        if column not in df.columns or not pd.Index(labels).isin(df.index).all():
+            return None
+        df = df.copy(deep=False)
+        series = df[column].copy()
+        series.loc[labels] = np.nan
+        df[column] = series
+        return df
+    return None
+
+class RevisionLog:
+    """
+    Per (file_id, email) undo/redo log of working copy changes.
+    Args:
+        entries_collection: One document per change, keyed by its position `seq`.
+        snapshots_collection: Full frames, one document per column plus one
+            column-less marker document per snapshot.
+        snapshot_interval: Entries between periodic snapshots.
+        max_entries: Entries kept per working copy.
+        max_bytes: Stored bytes (diffs and snapshots) kept per working copy.
+    """
+    def __init__(self, entries_collection, snapshots_collection, snapshot_interval=SNAPSHOT_INTERVAL,
+                 max_entries=MAX_ENTRIES, max_bytes=MAX_LOG_BYTES):
+        self.entries = entries_collection
+        self.snapshots = snapshots_collection
+        self.snapshot_interval = snapshot_interval
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def record(self, file_id, email, position, old_df, new_df, operations):
+        """
+        Records the change from `old_df` (the frame at `position`) to `new_df`.
+        Entries that were undone before are discarded, as in any undo history.
+        Args:
+            operations: Summaries of what produced the change, shown in the log.
+        Returns:
+            The new position.
+        """
+        key = {'file_id': file_id, 'email': email}
+        self.entries.delete_many({**key, 'seq': {'$gt': position}})
+        self.snapshots.delete_many({**key, 'seq': {'$gt': position}})
+
+        seq = position + 1
+        entry = {**key, 'seq': seq, 'operations': operations, 'created_at': datetime.datetime.utcnow()}
+        diff = diff_frames(old_df, new_df)
+        new_df = new_df.reset_index(drop=True)
+        if diff is not None and diff[2] <= MAX_DIFF_BYTES:
+            forward, backward, size = diff
+            entry.update({'kind': 'diff', 'forward': forward, 'backward': backward, 'bytes': size})
+            if seq % self.snapshot_interval == 0:
+                self._save_snapshot(key, seq, new_df)
+        else:
+            if self.snapshots.find_one({**key, 'seq': position, 'name': None}, {'_id': 1}) is None:
+                self._save_snapshot(key, position, old_df)
+            entry.update({'kind': 'snapshot', 'bytes': self._save_snapshot(key, seq, new_df)})
+        self.entries.insert_one(entry)
+        self._compact(key, seq)
+        return seq
+
+    def import_history(self, file_id, email, df, history):
+        """
+        Replaces the log with the entries of a legacy `history` list (see the module docstring).
+        Args:
+            df: The current working frame, with a RangeIndex.
+            history: Revert entries, oldest first.
+        Returns:
+            The position of `df` in the new log.
+        """
+        frames, operations = [df], []
+        for entry in reversed(history):
+            previous = _undo_legacy_entry(frames[0], entry)
+            if previous is None:
+                break
+            frames.insert(0, previous)
+            operations.insert(0, [{'action': entry['operation'], 'column': entry['column']}])
+        position = 0
+        for old_df, new_df, summary in zip(frames, frames[1:], operations):
+            position = self.record(file_id, email, position, old_df, new_df, summary)
+        if position == 0:
+            self.delete(file_id, email)
+        return position
+
+    def checkout(self, file_id, email, position, df, target):
+        """
+        Rebuilds the frame at log position `target` from `df`, the frame at `position`.
+        Replays from the current frame or from a snapshot, whichever needs fewer stored bytes.
+        Raises:
+            LookupError: If `target` is outside the log.
+        """
+        key = {'file_id': file_id, 'email': email}
+        entries = list(self.entries.find(key, {'seq': 1, 'bytes': 1}).sort('seq', 1))
+        floor = entries[0]['seq'] - 1 if entries else position
+        top = entries[-1]['seq'] if entries else position
+        if not floor <= target <= top:
+            raise LookupError(f'Position {target} is outside the history ({floor} to {top})')
+
+        costs = {entry['seq']: entry['bytes'] for entry in entries}
+
+        def replay_cost(start):
+            low, high = sorted((start, target))
+            return sum(costs.get(seq, 0) for seq in range(low + 1, high + 1))
+
+        start, start_cost = position, replay_cost(position)
+        for snapshot in self.snapshots.find({**key, 'name': None, 'seq': {'$gte': floor, '$lte': top}},
+                                            {'seq': 1, 'bytes': 1}):
+            cost = snapshot['bytes'] + replay_cost(snapshot['seq'])
+            if cost < start_cost:
+                start, start_cost = snapshot['seq'], cost
+        if start != position:
+            df = self._load_snapshot(key, start)
+
+        while start != target:
+            step = 1 if target > start else -1
+            seq = start + 1 if step == 1 else start
+            entry = self.entries.find_one({**key, 'seq': seq})
+            if entry['kind'] == 'diff':
+                df = apply_ops(df, entry['forward'] if step == 1 else entry['backward'])
+            else:
+                df = self._load_snapshot(key, start + step)
+            start += step
+        return df
+
+    def history(self, file_id, email, position):
+        """
+        Returns:
+            Dict with the current `position`, the reachable range and one summary per entry.
+        """
+        key = {'file_id': file_id, 'email': email}
+        entries = list(self.entries.find(key, ENTRY_SUMMARY_PROJECTION).sort('seq', 1))
+        snapshots = list(self.snapshots.find({**key, 'name': None}, SNAPSHOT_SUMMARY_PROJECTION).sort('seq', 1))
+        return history_summary(position, entries, snapshots)
+
+    def delete(self, file_id, email=None):
+        query = {'file_id': file_id}
+        if email is not None:
+            query['email'] = email
+        self.entries.delete_many(query)
+        self.snapshots.delete_many(query)
+
+    def _save_snapshot(self, key, seq, df):
+        docs, size = [], 0
+        for column in df.columns:
+            fmt, blob = encode_column(df[column])
+            docs.append({**key, 'seq': seq, 'name': column, 'format': fmt, 'blob': blob})
+            size += len(blob)
+        docs.append({**key, 'seq': seq, 'name': None, 'columns': list(df.columns), 'rows': len(df), 'bytes': size})
+        self.snapshots.insert_many(docs)
+        return size
+
+    def _load_snapshot(self, key, seq):
+        series, marker = {}, None
+        for doc in self.snapshots.find({**key, 'seq': seq}):
+            if doc['name'] is None:
+                marker = doc
+            else:
+                series[doc['name']] = decode_column(doc['format'], doc['blob'], doc['name'])
+        if marker is None:
+            raise LookupError(f'Snapshot {seq} is missing')
+        if not marker['columns']:
+            return pd.DataFrame(index=pd.RangeIndex(marker['rows']))
+        return pd.DataFrame({column: series[column] for column in marker['columns']}, copy=False)
+
+    def _compact(self, key, position):
+        entries = list(self.entries.find(key, {'seq': 1, 'bytes': 1}).sort('seq', 1))
+        snapshots = list(self.snapshots.find({**key, 'name': None}, {'seq': 1, 'bytes': 1}))
+
+        def stored_bytes():
+            floor, top = entries[0]['seq'] - 1, entries[-1]['seq']
+            return (sum(entry['bytes'] for entry in entries)
+                    + sum(snapshot['bytes'] for snapshot in snapshots if floor <= snapshot['seq'] <= top))
+
+        dropped = []
+        while len(entries) > 1 and (len(entries) > self.max_entries or stored_bytes() > self.max_bytes):
+            # The oldest undo step goes first; redo steps only once nothing older is left
+            victim = entries.pop(0) if entries[0]['seq'] < position else entries.pop()
+            dropped.append(victim['seq'])
+        if not dropped:
+            return
+        floor, top = entries[0]['seq'] - 1, entries[-1]['seq']
+        self.entries.delete_many({**key, 'seq': {'$in': dropped}})
+        self.snapshots.delete_many({**key, '$or': [{'seq': {'$lt': floor}}, {'seq': {'$gt': top}}]})
+        print(f"Compacted history of {key['file_id']}: dropped {len(dropped)} entries, kept {floor} to {top}")
@@ -0,0 +1,174 @@
+"""
+Row-budget sampling for the regression and correlation of analyze_csv_with_ai.
+
+On large files a few hundred thousand rows give practically the same
+coefficients and correlations as the whole file. `sample_frame` draws a
+seeded uniform or stratified sample within a row budget, and the interval
+helpers report how far the sampled estimates can be trusted:
+    - correlation: Fisher z-transform interval on the pairwise-complete rows,
+    - coefficients: OLS standard errors with a Student t quantile,
+    - r2_score: percentile bootstrap over the held-out rows.
+"""
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+DEFAULT_SEED = 42
+CONFIDENCE_LEVEL = 0.95
+BOOTSTRAP_RESAMPLES = 200
+
+
+def sampling_options(rows=None, method='uniform', seed=DEFAULT_SEED, stratify_by=None):
+    """
+    Normalised sampling settings as passed to analyze_csv_with_ai.
+    Args:
+        rows: Row budget; None or 0 disables sampling.
+        method: 'uniform' or 'stratified' (proportional allocation).
+        seed: Seed of the sample and of the bootstrap.
+        stratify_by: Column to stratify on; defaults to the first categorical column.
+    """
+    if method not in ('uniform', 'stratified'):
+        raise ValueError(f"Unknown sampling method: {method}")
+    return {'rows': int(rows or 0), 'method': method, 'seed': int(seed), 'stratify_by': stratify_by}
+
+
+def stratum_quotas(sizes, budget):
+    """
+    Proportional allocation of `budget` rows over strata by largest remainder.
+    When there are no more strata than rows, strata whose share is below one
+    row get exactly one and the others share the rest; otherwise the smallest
+    shares round down to none. The quotas add up to the budget and never
+    exceed the size of their stratum.
+    Args:
+        sizes: Rows per stratum; their sum must exceed `budget`.
+    """
+    fixed = np.zeros(len(sizes), dtype=bool)
+    if len(sizes) <= budget:
+        while True:
+            free = np.flatnonzero(~fixed)
+            small = sizes[free] * ((budget - fixed.sum()) / sizes[free].sum()) < 1
+            if not small.any():
+                break
+            fixed[free[small]] = True
+    quotas = fixed.astype(np.int64)
+    free = ~fixed
+    remaining = budget - int(fixed.sum())
+    exact = sizes[free] * (remaining / sizes[free].sum())
+    shares = np.floor(exact).astype(np.int64)
+    # The rows lost to rounding go to the largest remainders
+    leftover = remaining - int(shares.sum())
+    shares[np.argsort(shares - exact, kind='stable')[:leftover]] += 1
+    quotas[free] = shares
+    return quotas
+
+
+def sample_frame(df, options, categorical_cols=()):
+    """
+    Draws the sample described by `options` from `df`, keeping the original row order.
+    Returns:
+        Tuple of (sampled DataFrame, sampling info dict), or (df, None) when the
+        frame already fits the budget.
+    """
+    budget = options['rows']
+    population = len(df)
+    if not budget or population <= budget:
+        return df, None
+
+    rng = np.random.default_rng(options['seed'])
+    method = options['method']
+    stratify_by = options.get('stratify_by')
+    if method == 'stratified' and stratify_by is None and len(categorical_cols) > 0:
+        stratify_by = categorical_cols[0]
+
+    if method != 'stratified' or stratify_by not in df.columns:
+        method, stratify_by = 'uniform', None
+        positions = np.sort(rng.choice(population, size=budget, replace=False))
+    else:
+        codes, _ = pd.factorize(df[stratify_by], use_na_sentinel=False)
+        sizes = np.bincount(codes)
+        quotas = stratum_quotas(sizes, budget)
+        # Random order within each stratum: sort by stratum code plus a random fraction
+        order = np.argsort(codes + rng.random(population))
+        within = np.arange(population) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        positions = np.sort(order[within < np.repeat(quotas, sizes)])
+
+    info = {
+        'method': method,
+        'seed': options['seed'],
+        'stratify_by': stratify_by,
+        'population_rows': population,
+        'sample_rows': int(len(positions)),
+        'confidence_level': CONFIDENCE_LEVEL
+    }
+    return df.iloc[positions], info
+
+
+def correlation_intervals(corr_matrix, df, level=CONFIDENCE_LEVEL):
+    """
+    Fisher z confidence intervals for a pairwise-complete Pearson correlation matrix.
+    Returns:
+        {column: {column: [low, high]}} in the shape of corr_matrix.to_dict().
+    """
+    present = df[corr_matrix.columns].notna().to_numpy(dtype=float)
+    counts = present.T @ present
+    z = stats.norm.ppf(0.5 + level / 2)
+    r = np.clip(corr_matrix.to_numpy(dtype=float), -0.9999999, 0.9999999)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        half_width = z / np.sqrt(counts - 3)
+    low = np.tanh(np.arctanh(r) - half_width)
+    high = np.tanh(np.arctanh(r) + half_width)
+    diagonal = np.eye(len(r), dtype=bool) & ~np.isnan(r)
+    low[diagonal] = high[diagonal] = 1.0
+    columns = list(corr_matrix.columns)
+    return {
+        col: {row: [float(low[i, j]), float(high[i, j])] for i, row in enumerate(columns)}
+        for j, col in enumerate(columns)
+    }
+
+
+def coefficient_intervals(features, intercept, coef, X, y, level=CONFIDENCE_LEVEL):
+    """
+    Confidence intervals of fitted linear regression coefficients from OLS standard errors.
+    Returns:
+        {feature: [low, high]}.
+    """
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n, k = X.shape
+    dof = n - k - 1
+    if dof <= 0:
+        return {feature: [float('nan'), float('nan')] for feature in features}
+    residuals = y - (intercept + X @ coef)
+    sigma2 = residuals @ residuals / dof
+    design = np.column_stack([np.ones(n), X])
+    covariance = sigma2 * np.linalg.pinv(design.T @ design)
+    se = np.sqrt(np.diag(covariance)[1:])
+    t = stats.t.ppf(0.5 + level / 2, dof)
+    return {
+        feature: [float(value - t * err), float(value + t * err)]
+        for feature, value, err in zip(features, coef, se)
+    }
+
+
+def r2_interval(y_true, y_pred, seed=DEFAULT_SEED, level=CONFIDENCE_LEVEL, resamples=BOOTSTRAP_RESAMPLES):
+    """
+    Percentile bootstrap interval of the R² of held-out predictions.
+    Returns:
+        [low, high].
+    """
+    y_true = np.asarray(y_true, dtype=float)
+    y_pred = np.asarray(y_pred, dtype=float)
+    n = len(y_true)
+    if n < 2:
+        return [float('nan'), float('nan')]
+    rng = np.random.default_rng(seed)
+    scores = np.empty(resamples)
+    for i in range(resamples):
+        idx = rng.integers(0, n, n)
+        truth = y_true[idx]
+        sst = np.sum((truth - truth.mean()) ** 2)
+        sse = np.sum((truth - y_pred[idx]) ** 2)
+        scores[i] = 1 - sse / sst if sst > 0 else np.nan
+    tail = (1 - level) / 2 * 100
+    low, high = np.nanpercentile(scores, [tail, 100 - tail])
+    return [float(low), float(high)]
@@ -0,0 +1,327 @@
+"""
+Approximate column statistics from small, mergeable sketches.
+
+Exact distinct counts, value counts and quantiles need memory proportional to
+the number of distinct values or rows of a column. The sketches below have a
+fixed size instead, can be updated chunk by chunk, merged with the sketch of
+another part of the same column, and serialised with `to_dict` for storage
+in Mongo.
+
+Error bounds (n = non-null values in the column):
+    - HyperLogLog distinct count: relative standard error 1.04 / sqrt(2**p),
+      0.81% for the default p=14 (16 KiB per column). Counts below about
+      2.5 * 2**p use linear counting and are close to exact.
+    - SpaceSaving heavy hitters: a reported count never underestimates the
+      true count and overestimates it by at most its `error`, which is never
+      more than n / capacity. Every value occurring more than n / capacity
+      times is reported.
+    - TDigest quantiles: a centroid at quantile q covers at most
+      2*pi*sqrt(q*(1-q)) / compression of the ranks, so the rank error of an
+      interpolated quantile is at most about pi*sqrt(q*(1-q)) / compression:
+      0.79% at the median and 0.68% at the quartiles for the default
+      compression=200, shrinking towards the tails. Results are exact while
+      the column has fewer values than the digest keeps centroids.
+"""
+import numpy as np
+import pandas as pd
+
+HLL_PRECISION = 14
+HEAVY_HITTER_CAPACITY = 1024
+TDIGEST_COMPRESSION = 200
+
+
+def hash_values(values):
+    """
+    64-bit hashes of a 1-D array or Series. Stable across processes, so
+    sketches built in different workers can be merged.
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    return pd.util.hash_pandas_object(series, index=False).to_numpy()
+
+
+def _bit_length(x):
+    x = x.copy()
+    length = np.zeros(len(x), dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        wide = x >= (np.uint64(1) << np.uint64(shift))
+        length[wide] += shift
+        x[wide] >>= np.uint64(shift)
+    return length + (x > 0)
+
+
+class HyperLogLog:
+    """
+    Distinct count estimator with 2**p one-byte registers.
+    """
+    def __init__(self, p=HLL_PRECISION):
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+
+    def update(self, values):
+        if len(values) == 0:
+            return
+        hashes = hash_values(values)
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.intp)
+        rest = hashes << np.uint64(self.p)
+        # Position of the first 1 bit in the remaining 64 - p bits
+        rank = np.minimum(65 - _bit_length(rest).astype(np.int64), 64 - self.p + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+    def relative_error(self):
+        return 1.04 / np.sqrt(len(self.registers))
+
+    def to_dict(self):
+        return {'p': self.p, 'registers': self.registers.tobytes()}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['p'])
+        sketch.registers = np.frombuffer(bytes(data['registers']), dtype=np.uint8).copy()
+        return sketch
+
+
+class SpaceSaving:
+    """
+    Heavy-hitter summary keeping at most `capacity` values with an upper
+    bound `count` and the maximum overestimate `error` of each.
+    `floor` bounds the count of any value that is not tracked.
+    """
+    def __init__(self, capacity=HEAVY_HITTER_CAPACITY):
+        self.capacity = capacity
+        self.n = 0
+        self.floor = 0
+        self.table = pd.DataFrame({'count': pd.Series(dtype='int64'), 'error': pd.Series(dtype='int64')})
+
+    def update(self, values):
+        counts = pd.Series(values).value_counts()
+        counts = counts[counts > 0]
+        if len(counts) == 0:
+            return
+        chunk = SpaceSaving(self.capacity)
+        chunk.n = int(counts.sum())
+        chunk.table = pd.DataFrame({'count': counts.astype('int64'), 'error': 0})
+        chunk._truncate()
+        self.merge(chunk)
+
+    def merge(self, other):
+        # Mergeable summaries (Agarwal et al.): a value missing on one side
+        # may have occurred up to that side's floor times
+        mine, theirs = self.table.align(other.table, join='outer')
+        self.table = mine.fillna(self.floor) + theirs.fillna(other.floor)
+        self.table = self.table.astype('int64')
+        self.n += other.n
+        self.floor += other.floor
+        self._truncate()
+        return self
+
+    def _truncate(self):
+        self.table = self.table.sort_values('count', ascending=False, kind='stable')
+        if len(self.table) > self.capacity:
+            self.floor = max(self.floor, int(self.table['count'].iloc[self.capacity]))
+            self.table = self.table.iloc[:self.capacity]
+
+    def top(self, k=5):
+        return {value: int(count) for value, count in self.table['count'].head(k).items()}
+
+    def max_error(self):
+        return int(self.table['error'].max()) if len(self.table) else 0
+
+    def to_dict(self):
+        return {
+            'capacity': self.capacity, 'n': self.n, 'floor': self.floor,
+            'values': self.table.index.tolist(),
+            'counts': self.table['count'].tolist(),
+            'errors': self.table['error'].tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['capacity'])
+        sketch.n = data['n']
+        sketch.floor = data['floor']
+        sketch.table = pd.DataFrame(
+            {'count': data['counts'], 'error': data['errors']},
+            index=pd.Index(data['values'], dtype=object), dtype='int64'
+        )
+        return sketch
+
+
+class TDigest:
+    """
+    Merging t-digest with the k1 (arcsine) scale function.
+    Centroids are kept as sorted `means` with `weights`.
+    """
+    def __init__(self, compression=TDIGEST_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = float('nan')
+        self.max = float('nan')
+
+    @property
+    def n(self):
+        return int(self.weights.sum())
+
+    def update(self, values, block=65536):
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        self.min = float(np.fmin(self.min, values.min()))
+        self.max = float(np.fmax(self.max, values.max()))
+        for start in range(0, len(values), block):
+            part = values[start:start + block]
+            self._compress(np.concatenate([self.means, part]),
+                           np.concatenate([self.weights, np.ones(len(part))]))
+
+    def merge(self, other):
+        if len(other.means):
+            self.min = float(np.fmin(self.min, other.min))
+            self.max = float(np.fmax(self.max, other.max))
+            self._compress(np.concatenate([self.means, other.means]),
+                           np.concatenate([self.weights, other.weights]))
+        return self
+
+    def _compress(self, means, weights):
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        if len(means) <= self.compression // 2:
+            self.means, self.weights = means, weights
+            return
+        # Points whose left cumulative quantile falls into the same unit of
+        # the scale function share a centroid
+        q = (np.cumsum(weights) - weights) / weights.sum()
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        group = np.floor(k - k[0]).astype(np.intp)
+        total = np.bincount(group, weights=weights)
+        kept = total > 0
+        self.means = np.bincount(group, weights=weights * means)[kept] / total[kept]
+        self.weights = total[kept]
+
+    def quantile(self, qs):
+        """
+        Interpolated quantiles; matches pandas' linear interpolation while
+        every centroid holds a single value.
+        """
+        n = self.weights.sum()
+        if n == 0:
+            return [float('nan')] * len(qs)
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.concatenate([[0.0], centers, [n]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+        targets = np.asarray(qs, dtype=float) * (n - 1) + 0.5
+        return [float(v) for v in np.interp(targets, positions, values)]
+
+    def to_dict(self):
+        return {
+            'compression': self.compression, 'min': self.min, 'max': self.max,
+            'means': self.means.tobytes(), 'weights': self.weights.tobytes()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        digest = cls(data['compression'])
+        digest.min = data['min']
+        digest.max = data['max']
+        digest.means = np.frombuffer(bytes(data['means']), dtype=float).copy()
+        digest.weights = np.frombuffer(bytes(data['weights']), dtype=float).copy()
+        return digest
+
+
+class ColumnSketches:
+    """
+    Quantile digests for numeric columns and distinct-count / heavy-hitter
+    sketches for categorical columns of one dataset.
+    """
+    def __init__(self, numerical_cols=(), categorical_cols=()):
+        self.digests = {col: TDigest() for col in numerical_cols}
+        self.distinct = {col: HyperLogLog() for col in categorical_cols}
+        self.heavy_hitters = {col: SpaceSaving() for col in categorical_cols}
+
+    def update_numeric(self, col, values):
+        """
+        Args:
+            values: Non-null float values of the column.
+        """
+        self.digests[col].update(values)
+
+    def update_categorical(self, col, values):
+        """
+        Args:
+            values: Non-null values of the column.
+        """
+        self.distinct[col].update(values)
+        self.heavy_hitters[col].update(values)
+
+    def update(self, df):
+        for col in self.digests:
+            self.update_numeric(col, pd.to_numeric(df[col], errors='coerce').dropna().to_numpy(dtype=float))
+        for col in self.distinct:
+            self.update_categorical(col, df[col].dropna())
+
+    def merge(self, other):
+        for name in ('digests', 'distinct', 'heavy_hitters'):
+            mine, theirs = getattr(self, name), getattr(other, name)
+            for col, sketch in theirs.items():
+                if col in mine:
+                    mine[col].merge(sketch)
+                else:
+                    mine[col] = sketch
+        return self
+
+    def quartiles(self, col):
+        return self.digests[col].quantile([0.25, 0.5, 0.75])
+
+    def nunique(self, col):
+        return self.distinct[col].count()
+
+    def top(self, col, k=5):
+        return self.heavy_hitters[col].top(k)
+
+    def error_bounds(self):
+        """
+        Error bounds of the reported statistics, as described in the module docstring.
+        """
+        bounds = {}
+        if self.distinct:
+            bounds['distinct_count_relative_error'] = float(
+                next(iter(self.distinct.values())).relative_error()
+            )
+            bounds['top_value_max_overcount'] = {
+                col: sketch.max_error() for col, sketch in self.heavy_hitters.items()
+            }
+        if self.digests:
+            bounds['quantile_rank_error'] = {
+                label: float(np.pi * np.sqrt(q * (1 - q)) / TDIGEST_COMPRESSION)
+                for label, q in (('25%', 0.25), ('50%', 0.5), ('75%', 0.75))
+            }
+        return bounds
+
+    def to_dict(self):
+        return {
+            'digests': {col: sketch.to_dict() for col, sketch in self.digests.items()},
+            'distinct': {col: sketch.to_dict() for col, sketch in self.distinct.items()},
+            'heavy_hitters': {col: sketch.to_dict() for col, sketch in self.heavy_hitters.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketches = cls()
+        sketches.digests = {col: TDigest.from_dict(d) for col, d in data['digests'].items()}
+        sketches.distinct = {col: HyperLogLog.from_dict(d) for col, d in data['distinct'].items()}
+        sketches.heavy_hitters = {col: SpaceSaving.from_dict(d) for col, d in data['heavy_hitters'].items()}
+        return sketches
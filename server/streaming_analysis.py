@@ -0,0 +1,568 @@
+"""
+Out-of-core variant of analyze_csv_with_ai for larger-than-memory CSVs.
+
+The file is read in chunks and every statistic is kept in a mergeable
+accumulator, so peak memory depends on the chunk size and the number of
+columns, not on the number of rows:
+    - shape, missing counts and dtypes,
+    - count/mean/M2/M3/M4/min/max per numeric column (Pébay's pairwise update),
+      giving describe() moments, skewness and kurtosis with pandas' bias
+      corrections,
+    - a bounded uniform reservoir per numeric column for quartiles, histograms
+      and the box plot (exact while the column fits in the reservoir),
+    - bounded value counters per categorical column for unique counts and top values,
+    - pairwise-complete co-moment sums for the numeric correlation matrix,
+    - train/test normal equations for the linear regression.
+
+The result has the same `insights` / `predictions` / `plots` structure as
+analyze_csv_with_ai. Differences from the in-memory path:
+    - column types are taken from the first chunk; later values that do not
+      fit a numeric column are treated as missing,
+    - associations are only measured between numeric columns (Pearson): the
+      Cramér's V and correlation ratio pairs of associations need the most
+      frequent levels of the whole column. `insights["association_measures"]`
+      only lists the Pearson measure and `results["streaming"]` lists the
+      categorical columns that were left out,
+    - the regression uses a seeded random 80/20 row split instead of
+      train_test_split,
+    - quartiles, histograms and unique counts become approximate once a column
+      outgrows its reservoir or counter; `results["streaming"]` lists those columns.
+
+With `approximate=True` quartiles come from t-digests and categorical unique
+counts and top values from HyperLogLog and SpaceSaving sketches (see
+sketches), which keep their documented error bounds however large the
+column grows; the bounded value counters are then not kept.
+
+`StreamingAnalysisState` can be serialised with `to_dict` and updated with
+more rows later, which is what incremental re-analysis builds on.
+"""
+import numpy as np
+import pandas as pd
+
+from associations import MEASURES
+from plot_rendering import (bar_spec, box_spec, heatmap_spec, histogram_spec, prediction_spec,
+                            render_plots)
+from progress import StageProgress
+from regression import BATCH_MAX_COLUMNS, GramAccumulator, batch_regression, regression_cache
+from sketches import ColumnSketches
+
+CHUNK_ROWS = 100_000
+RESERVOIR_SIZE = 4096
+MAX_TRACKED_VALUES = 50_000
+TEST_FRACTION = 0.2
+
+
+class MomentAccumulator:
+    """
+    Count, mean, central moment sums M2..M4, min and max of a numeric column.
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.m3 = 0.0
+        self.m4 = 0.0
+        self.min = float('nan')
+        self.max = float('nan')
+
+    def update(self, values):
+        if len(values) == 0:
+            return
+        other = MomentAccumulator()
+        other.n = len(values)
+        other.mean = float(values.mean())
+        d = values - other.mean
+        d2 = d * d
+        other.m2 = float(d2.sum())
+        other.m3 = float((d2 * d).sum())
+        other.m4 = float((d2 * d2).sum())
+        other.min = float(values.min())
+        other.max = float(values.max())
+        self.merge(other)
+
+    def merge(self, other):
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.__dict__.update(other.__dict__)
+            return self
+        na, nb = self.n, other.n
+        n = na + nb
+        delta = other.mean - self.mean
+        delta2 = delta * delta
+        m2 = self.m2 + other.m2 + delta2 * na * nb / n
+        m3 = (self.m3 + other.m3
+              + delta * delta2 * na * nb * (na - nb) / (n * n)
+              + 3 * delta * (na * other.m2 - nb * self.m2) / n)
+        m4 = (self.m4 + other.m4
+              + delta2 * delta2 * na * nb * (na * na - na * nb + nb * nb) / (n ** 3)
+              + 6 * delta2 * (na * na * other.m2 + nb * nb * self.m2) / (n * n)
+              + 4 * delta * (na * other.m3 - nb * self.m3) / n)
+        self.mean += delta * nb / n
+        self.m2, self.m3, self.m4 = m2, m3, m4
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def std(self):
+        return float(np.sqrt(self.m2 / (self.n - 1))) if self.n > 1 else float('nan')
+
+    def skew(self):
+        # Same adjusted Fisher-Pearson estimator as pandas' Series.skew
+        n = self.n
+        if n < 3:
+            return float('nan')
+        if self.m2 == 0:
+            return 0.0
+        return (n * (n - 1) ** 0.5 / (n - 2)) * (self.m3 / self.m2 ** 1.5)
+
+    def kurtosis(self):
+        # Same bias-corrected excess kurtosis as pandas' Series.kurtosis
+        n = self.n
+        if n < 4:
+            return float('nan')
+        denominator = (n - 2) * (n - 3) * self.m2 ** 2
+        if denominator == 0:
+            return 0.0
+        numerator = n * (n + 1) * (n - 1) * self.m4
+        adjustment = 3 * (n - 1) ** 2 / ((n - 2) * (n - 3))
+        return numerator / denominator - adjustment
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data):
+        accumulator = cls()
+        accumulator.__dict__.update(data)
+        return accumulator
+
+
+class Reservoir:
+    """
+    Bounded uniform sample (bottom-k by random key), mergeable across chunks.
+    """
+    def __init__(self, size=RESERVOIR_SIZE):
+        self.size = size
+        self.values = np.empty(0)
+        self.keys = np.empty(0)
+
+    def update(self, values, rng):
+        self._keep(np.concatenate([self.values, values]), np.concatenate([self.keys, rng.random(len(values))]))
+
+    def merge(self, other):
+        self._keep(np.concatenate([self.values, other.values]), np.concatenate([self.keys, other.keys]))
+        return self
+
+    def _keep(self, values, keys):
+        if len(values) > self.size:
+            kept = np.argpartition(keys, self.size)[:self.size]
+            values, keys = values[kept], keys[kept]
+        self.values, self.keys = values, keys
+
+    def to_dict(self):
+        return {'size': self.size, 'values': self.values.tolist(), 'keys': self.keys.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        reservoir = cls(data['size'])
+        reservoir.values = np.asarray(data['values'], dtype=float)
+        reservoir.keys = np.asarray(data['keys'], dtype=float)
+        return reservoir
+
+
+class ValueCounter:
+    """
+    Value counts of a categorical column, pruned to the most frequent values
+    once more than `max_tracked` distinct values have been seen.
+    """
+    def __init__(self, max_tracked=MAX_TRACKED_VALUES):
+        self.max_tracked = max_tracked
+        self.counts = {}
+        self.pruned = False
+
+    def update(self, values):
+        for value, count in values.value_counts(sort=False).items():
+            self.counts[value] = self.counts.get(value, 0) + int(count)
+        self._prune()
+
+    def merge(self, other):
+        for value, count in other.counts.items():
+            self.counts[value] = self.counts.get(value, 0) + count
+        self.pruned = self.pruned or other.pruned
+        self._prune()
+        return self
+
+    def _prune(self):
+        if len(self.counts) > self.max_tracked:
+            top = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:self.max_tracked // 2]
+            self.counts = dict(top)
+            self.pruned = True
+
+    def nunique(self):
+        return len(self.counts)
+
+    def top(self, k=5):
+        return dict(sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:k])
+
+    def to_dict(self):
+        return {'max_tracked': self.max_tracked, 'pruned': self.pruned, 'counts': list(self.counts.items())}
+
+    @classmethod
+    def from_dict(cls, data):
+        counter = cls(data['max_tracked'])
+        counter.pruned = data['pruned']
+        counter.counts = {value: count for value, count in data['counts']}
+        return counter
+
+
+class PairwiseCorrelation:
+    """
+    Pairwise-complete Pearson correlation, like DataFrame.corr(), from co-moment sums.
+    Values are shifted by the first chunk's means to keep the sums well conditioned.
+    """
+    def __init__(self, columns):
+        self.columns = list(columns)
+        k = len(self.columns)
+        self.shift = None
+        self.n = np.zeros((k, k))
+        self.sx = np.zeros((k, k))
+        self.sxx = np.zeros((k, k))
+        self.sxy = np.zeros((k, k))
+
+    def update(self, values):
+        if self.shift is None:
+            self.shift = np.nan_to_num(np.nanmean(values, axis=0)) if len(values) else np.zeros(len(self.columns))
+        mask = ~np.isnan(values)
+        x = np.where(mask, values - self.shift, 0.0)
+        m = mask.astype(float)
+        self.n += m.T @ m
+        self.sx += x.T @ m
+        self.sxx += (x * x).T @ m
+        self.sxy += x.T @ x
+
+    def merge(self, other):
+        if other.shift is None:
+            return self
+        if self.shift is None:
+            self.__dict__.update(other.__dict__)
+            return self
+        # Re-express the other sums around this accumulator's shift
+        d = other.shift - self.shift
+        sx = other.sx + d[:, None] * other.n
+        self.sxx += other.sxx + 2 * d[:, None] * other.sx + (d * d)[:, None] * other.n
+        self.sxy += (other.sxy + d[:, None] * other.sx.T + d[None, :] * other.sx
+                     + np.outer(d, d) * other.n)
+        self.sx += sx
+        self.n += other.n
+        return self
+
+    def matrix(self):
+        sy = self.sx.T
+        syy = self.sxx.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = self.n * self.sxy - self.sx * sy
+            var = (self.n * self.sxx - self.sx * self.sx) * (self.n * syy - sy * sy)
+            corr = cov / np.sqrt(var)
+        corr[(self.n < 2) | (var <= 0)] = np.nan
+        corr = np.clip(corr, -1.0, 1.0)
+        diagonal = np.diag(corr).copy()
+        np.fill_diagonal(corr, np.where(np.isnan(diagonal), np.nan, 1.0))
+        return pd.DataFrame(corr, index=self.columns, columns=self.columns)
+
+    def to_dict(self):
+        return {
+            'columns': self.columns,
+            'shift': None if self.shift is None else self.shift.tolist(),
+            'n': self.n.tolist(), 'sx': self.sx.tolist(), 'sxx': self.sxx.tolist(), 'sxy': self.sxy.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        accumulator = cls(data['columns'])
+        accumulator.shift = None if data['shift'] is None else np.asarray(data['shift'], dtype=float)
+        for key in ('n', 'sx', 'sxx', 'sxy'):
+            setattr(accumulator, key, np.asarray(data[key], dtype=float))
+        return accumulator
+
+
+class StreamingAnalysisState:
+    """
+    All accumulators of a streaming analysis. Created from the first chunk,
+    which fixes the column order and the numeric/categorical split.
+    """
+    def __init__(self, columns, numerical_cols, categorical_cols, seed=42, approximate=False):
+        self.columns = list(columns)
+        self.numerical_cols = list(numerical_cols)
+        self.categorical_cols = list(categorical_cols)
+        self.seed = seed
+        self.rows = 0
+        self.chunks = 0
+        self.missing = {col: 0 for col in self.columns}
+        self.dtypes = {}
+        self.moments = {col: MomentAccumulator() for col in self.numerical_cols}
+        self.reservoirs = {col: Reservoir() for col in self.numerical_cols}
+        if approximate:
+            self.sketches = ColumnSketches(self.numerical_cols, self.categorical_cols)
+            self.counters = {}
+        else:
+            self.sketches = None
+            self.counters = {col: ValueCounter() for col in self.categorical_cols}
+        self.correlation = PairwiseCorrelation(self.numerical_cols)
+        if len(self.numerical_cols) >= 2:
+            self.target = self.numerical_cols[0]
+            self.features = self.numerical_cols[1:]
+            self.train = GramAccumulator(self.numerical_cols)
+            self.test = GramAccumulator(self.numerical_cols)
+        else:
+            self.target = None
+            self.features = []
+            self.train = self.test = None
+        self.test_rows = []
+
+    @classmethod
+    def from_chunk(cls, chunk, approximate=False):
+        numerical_cols = chunk.select_dtypes(include=[np.number]).columns
+        categorical_cols = chunk.select_dtypes(include=['object', 'category']).columns
+        return cls(chunk.columns, numerical_cols, categorical_cols, approximate=approximate)
+
+    def _rng(self):
+        # One deterministic stream per chunk, so results do not depend on how chunks are merged
+        return np.random.default_rng([self.seed, self.chunks])
+
+    def update(self, chunk):
+        """
+        Folds one DataFrame chunk into the accumulators.
+        """
+        rng = self._rng()
+        self.chunks += 1
+        self.rows += len(chunk)
+
+        for col, count in chunk.isnull().sum().items():
+            if col in self.missing:
+                self.missing[col] += int(count)
+
+        numeric = {}
+        for col in self.numerical_cols:
+            series = chunk[col]
+            if not pd.api.types.is_numeric_dtype(series):
+                series = pd.to_numeric(series, errors='coerce')
+            numeric[col] = series.to_numpy(dtype=float, na_value=np.nan)
+            self._track_dtype(col, series.dtype)
+            values = numeric[col][~np.isnan(numeric[col])]
+            self.moments[col].update(values)
+            self.reservoirs[col].update(values, rng)
+            if self.sketches is not None:
+                self.sketches.update_numeric(col, values)
+
+        for col in self.categorical_cols:
+            series = chunk[col].dropna()
+            if series.dtype != object:
+                series = series.astype(str)
+            if self.sketches is not None:
+                self.sketches.update_categorical(col, series)
+            else:
+                self.counters[col].update(series)
+            self.dtypes[col] = 'object'
+
+        if self.numerical_cols:
+            matrix = np.column_stack([numeric[col] for col in self.numerical_cols])
+            self.correlation.update(matrix)
+            if self.target is not None:
+                complete = matrix[~np.isnan(matrix).any(axis=1)]
+                is_test = rng.random(len(complete)) < TEST_FRACTION
+                self.train.update(complete[~is_test])
+                self.test.update(complete[is_test])
+                if len(self.test_rows) < 5:
+                    self.test_rows.extend(complete[is_test][:5 - len(self.test_rows)].tolist())
+
+    def _track_dtype(self, col, dtype):
+        # A column that is integer in one chunk and float in another is float64 as a whole
+        current = self.dtypes.get(col)
+        dtype = str(dtype)
+        if current is None:
+            self.dtypes[col] = dtype
+        elif current != dtype:
+            self.dtypes[col] = 'float64'
+
+    def results(self, plot_mode='eager', plot_workers=None, progress=None):
+        """
+        Builds the analyze_csv_with_ai result structure from the accumulators,
+        reporting the same stages to `progress` as analyze_csv_with_ai.
+        """
+        progress = progress or StageProgress()
+        results = {"insights": {}, "predictions": {}, "plots": []}
+        insights = results["insights"]
+        insights["shape"] = {"rows": self.rows, "columns": len(self.columns)}
+        insights["columns"] = list(self.columns)
+        insights["missing_values"] = dict(self.missing)
+        insights["data_types"] = {col: self.dtypes.get(col, 'object') for col in self.columns}
+
+        approximate = []
+        if self.numerical_cols:
+            stats = {}
+            for col in self.numerical_cols:
+                moments = self.moments[col]
+                sample = self.reservoirs[col].values
+                if self.sketches is not None:
+                    q25, q50, q75 = self.sketches.quartiles(col)
+                else:
+                    if moments.n > len(sample):
+                        approximate.append(col)
+                    q25, q50, q75 = np.quantile(sample, [0.25, 0.5, 0.75]) if len(sample) else [np.nan] * 3
+                stats[col] = {
+                    "count": float(moments.n),
+                    "mean": moments.mean if moments.n else float('nan'),
+                    "std": moments.std(),
+                    "min": moments.min,
+                    "25%": float(q25),
+                    "50%": float(q50),
+                    "75%": float(q75),
+                    "max": moments.max
+                }
+            insights["numerical_stats"] = stats
+            insights["skewness"] = {col: self.moments[col].skew() for col in self.numerical_cols}
+            insights["kurtosis"] = {col: self.moments[col].kurtosis() for col in self.numerical_cols}
+
+        if self.categorical_cols:
+            if self.sketches is not None:
+                insights["categorical_unique"] = {col: self.sketches.nunique(col) for col in self.categorical_cols}
+                insights["categorical_top_values"] = {col: self.sketches.top(col) for col in self.categorical_cols}
+            else:
+                insights["categorical_unique"] = {col: self.counters[col].nunique() for col in self.categorical_cols}
+                insights["categorical_top_values"] = {col: self.counters[col].top(5) for col in self.categorical_cols}
+                approximate.extend(col for col in self.categorical_cols if self.counters[col].pruned)
+        progress('insights', insights=insights)
+
+        if self.target is not None and self.train.n > 0 and self.test.n > 0:
+            targets = None if len(self.numerical_cols) <= BATCH_MAX_COLUMNS else [self.target]
+            by_target = batch_regression(self.train, self.test, self.test_rows, targets=targets)
+            primary = by_target[self.target]
+            results["predictions"]["target"] = self.target
+            results["predictions"]["features"] = list(self.features)
+            results["predictions"]["r2_score"] = primary["r2_score"]
+            results["predictions"]["coefficients"] = primary["coefficients"]
+            results["predictions"]["sample_predictions"] = primary["sample_predictions"]
+            results["predictions"]["targets"] = by_target
+            cache = regression_cache(self.train, self.test, self.test_rows)
+            if cache is not None:
+                results["regression"] = cache
+        progress('regression', predictions=results["predictions"])
+
+        corr_matrix = None
+        if self.numerical_cols:
+            corr_matrix = self.correlation.matrix()
+            insights["association_measures"] = {"numeric-numeric": MEASURES["numeric-numeric"]}
+            insights["correlation"] = corr_matrix.to_dict()
+            progress('correlation', insights={
+                key: insights[key] for key in ("association_measures", "correlation")
+            })
+
+        specs = []
+        for col in self.numerical_cols:
+            sample = self.reservoirs[col].values
+            scale = self.moments[col].n / len(sample) if len(sample) else 1.0
+            specs.append(histogram_spec(col, sample, scale=scale))
+        if self.numerical_cols:
+            specs.append(box_spec([(col, self.reservoirs[col].values) for col in self.numerical_cols]))
+        for col in self.categorical_cols:
+            top = insights["categorical_top_values"][col]
+            specs.append(bar_spec(col, list(top.keys()), list(top.values())))
+        if corr_matrix is not None:
+            specs.append(heatmap_spec(corr_matrix))
+        if "sample_predictions" in results["predictions"]:
+            specs.append(prediction_spec(self.target, results["predictions"]["sample_predictions"]))
+        if plot_mode == 'lazy':
+            results["plots"] = specs
+            progress('plots', plots=[spec["name"] for spec in specs])
+        else:
+            results["plots"] = render_plots(specs, workers=plot_workers, on_plot=lambda index, plot: progress(
+                'plot', index=index, count=len(specs), plot=plot
+            ))
+
+        results["streaming"] = {"chunks": self.chunks, "approximate_columns": approximate,
+                                # Categorical columns have no association values, unlike in analyze_csv_with_ai
+                                "unassociated_columns": list(self.categorical_cols)}
+        if self.sketches is not None:
+            results["approximate"] = self.sketches.error_bounds()
+            results["sketches"] = self.sketches.to_dict()
+        return results
+
+    def to_dict(self):
+        return {
+            'columns': self.columns,
+            'numerical_cols': self.numerical_cols,
+            'categorical_cols': self.categorical_cols,
+            'seed': self.seed,
+            'rows': self.rows,
+            'chunks': self.chunks,
+            'missing': self.missing,
+            'dtypes': self.dtypes,
+            'moments': {col: acc.to_dict() for col, acc in self.moments.items()},
+            'reservoirs': {col: acc.to_dict() for col, acc in self.reservoirs.items()},
+            'counters': {col: acc.to_dict() for col, acc in self.counters.items()},
+            'sketches': self.sketches.to_dict() if self.sketches is not None else None,
+            'correlation': self.correlation.to_dict(),
+            'train': self.train.to_dict() if self.train else None,
+            'test': self.test.to_dict() if self.test else None,
+            'test_rows': self.test_rows
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['columns'], data['numerical_cols'], data['categorical_cols'], seed=data['seed'])
+        state.rows = data['rows']
+        state.chunks = data['chunks']
+        state.missing = dict(data['missing'])
+        state.dtypes = dict(data['dtypes'])
+        state.moments = {col: MomentAccumulator.from_dict(acc) for col, acc in data['moments'].items()}
+        state.reservoirs = {col: Reservoir.from_dict(acc) for col, acc in data['reservoirs'].items()}
+        state.counters = {col: ValueCounter.from_dict(acc) for col, acc in data['counters'].items()}
+        if data.get('sketches') is not None:
+            state.sketches = ColumnSketches.from_dict(data['sketches'])
+        state.correlation = PairwiseCorrelation.from_dict(data['correlation'])
+        if data['train']:
+            state.train = GramAccumulator.from_dict(data['train'])
+            state.test = GramAccumulator.from_dict(data['test'])
+        state.test_rows = data['test_rows']
+        return state
+
+
+def stream_chunks(source, chunk_rows=CHUNK_ROWS, **read_csv_kwargs):
+    """
+    Yields DataFrame chunks of a CSV file object without reading it whole.
+    """
+    yield from pd.read_csv(source, chunksize=chunk_rows, **read_csv_kwargs)
+
+
+def analyze_csv_streaming(source, chunk_rows=CHUNK_ROWS, plot_mode='eager', plot_workers=None, state=None,
+                          approximate=False, read_options=None, progress=None):
+    """
+    Analyzes a CSV file object chunk by chunk with bounded memory.
+    Args:
+        source: Readable binary or text file object (e.g. a GridFS download stream).
+        chunk_rows: Rows per chunk.
+        plot_mode, plot_workers: As for analyze_csv_with_ai.
+        state: Optional StreamingAnalysisState to continue from.
+        approximate: Use sketches for quartiles and categorical statistics (new states only).
+        read_options: Extra pandas read_csv options, e.g. csv_schema.chunk_options of the file.
+        progress: Optional progress.StageProgress; a `parse` stage is reported per chunk.
+    Returns:
+        Tuple of (results dict like analyze_csv_with_ai, final StreamingAnalysisState).
+    """
+    progress = progress or StageProgress()
+    try:
+        for chunk in stream_chunks(source, chunk_rows=chunk_rows, **(read_options or {})):
+            if state is None:
+                state = StreamingAnalysisState.from_chunk(chunk, approximate=approximate)
+            print(f"Streaming chunk {state.chunks + 1} ({len(chunk)} rows)...")
+            state.update(chunk)
+            progress('parse', rows=state.rows, columns=len(state.columns), chunks=state.chunks)
+    except Exception as e:
+        print("Error reading CSV:", str(e))
+        return {"error": f"Error reading CSV: {str(e)}"}, state
+
+    if state is None:
+        return {"error": "Error reading CSV: No columns to parse from file"}, None
+    return state.results(plot_mode=plot_mode, plot_workers=plot_workers, progress=progress), state
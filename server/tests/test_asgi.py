@@ -0,0 +1,98 @@
+"""
+Smoke test of the ASGI entry point: serves asgi.application with uvicorn and
+calls one async route (Motor) and one route of the wrapped Flask app.
+
+Needs a MongoDB server at DATAMIND_MONGO_URI (default mongodb://localhost:27017/)
+and is skipped without one. The test user it creates is removed afterwards.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import pytest
+
+pymongo = pytest.importorskip('pymongo')
+uvicorn = pytest.importorskip('uvicorn')
+pytest.importorskip('motor')
+pytest.importorskip('a2wsgi')
+
+MONGO_URI = os.environ.get('DATAMIND_MONGO_URI', 'mongodb://localhost:27017/')
+START_TIMEOUT = 10
+
+
+def call(url, method='GET', body=None, token=None):
+    """
+    Returns:
+        Tuple of (status, decoded JSON body).
+    """
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    request = urllib.request.Request(url, data=data, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+@pytest.fixture(scope='module')
+def server():
+    try:
+        pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=1000).admin.command('ping')
+    except pymongo.errors.PyMongoError:
+        pytest.skip(f'No MongoDB server at {MONGO_URI}')
+    # The cleaning model app.py imports is not part of every checkout
+    pytest.importorskip('model')
+    import app
+    import asgi
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    uvicorn_server = uvicorn.Server(uvicorn.Config(asgi.application, host='127.0.0.1', port=port,
+                                                   lifespan='on', log_level='warning'))
+    thread = threading.Thread(target=uvicorn_server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + START_TIMEOUT
+    while not uvicorn_server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            pytest.fail('uvicorn did not start')
+        time.sleep(0.05)
+    yield app, f'http://127.0.0.1:{port}'
+    uvicorn_server.should_exit = True
+    thread.join(START_TIMEOUT)
+
+
+def test_async_and_wrapped_routes(server):
+    app, base_url = server
+    users = app.users_collection
+    email = f'asgi-smoke-{uuid.uuid4().hex}@example.com'
+    users.insert_one({
+        'email': email,
+        'password': app.bcrypt.generate_password_hash('secret').decode('utf-8'),
+        'username': 'smoke',
+        'avatar': None
+    })
+    try:
+        # Async route on Motor
+        status, body = call(f'{base_url}/login', 'POST', {'email': email, 'password': 'wrong'})
+        assert status == 401
+        status, body = call(f'{base_url}/login', 'POST', {'email': email, 'password': 'secret'})
+        assert status == 200
+        token = body['token']
+
+        # Flask route behind the WSGI middleware
+        status, body = call(f'{base_url}/dashboard', token=token)
+        assert status == 200
+        assert body['username'] == 'smoke'
+        assert body['email'] == email
+    finally:
+        users.delete_one({'email': email})
+        app.authenticator.invalidate_user(email)
@@ -0,0 +1,27 @@
+"""
+Tests of the schema inferred at upload and of parsing with it.
+"""
+import pandas as pd
+import pytest
+
+from csv_schema import _date_columns, infer_schema, read_csv
+
+
+def test_date_columns():
+    schema = infer_schema(b'a,t\n1,2020-01-02\n2,\n3,2020-01-04\n', complete=True)
+    assert schema['date_columns'] == ['t']
+
+
+@pytest.mark.parametrize('data', [
+    pytest.param(b'a,d\n1,True\n2,\n', id='bool-with-blanks'),
+    pytest.param(b'a,d\n1,True\n2,\n3,False\n', id='bools'),
+])
+def test_non_text_object_columns(data):
+    schema = infer_schema(data, complete=True)
+    assert schema['date_columns'] == []
+    assert list(read_csv(data, schema).columns) == ['a', 'd']
+
+
+def test_mixed_object_column_is_not_a_date():
+    df = pd.DataFrame({'m': ['2020-01-02', 3, True, None]}, dtype=object)
+    assert _date_columns(df) == []
@@ -0,0 +1,208 @@
+"""
+Tests of the undo/redo log: diff round-trips, replay across snapshots,
+compaction and the import of legacy revert lists. The log is kept in
+mongomock collections.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from revision_log import RevisionLog, apply_ops, diff_frames
+
+mongomock = pytest.importorskip('mongomock')
+
+FILE_ID = 'file'
+EMAIL = 'user@example.com'
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(0)
+    n = 200
+    # Missing text is NaN, as the CSV reader and the working store produce it
+    text = rng.choice(np.array(['x', 'y', np.nan], dtype=object), n)
+    df = pd.DataFrame({
+        'a': rng.normal(size=n),
+        'b': rng.integers(0, 5, n),
+        'c': text,
+        'd': pd.Categorical(rng.choice(['p', 'q'], n)),
+        't': pd.date_range('2020-01-01', periods=n)
+    })
+    df.loc[rng.choice(n, 20, replace=False), 'a'] = np.nan
+    return df
+
+
+def make_log(**options):
+    db = mongomock.MongoClient().db
+    return RevisionLog(db['result_df_history'], db['result_df_snapshots'], **options)
+
+
+def record_changes(log, df, changes):
+    """
+    Records each change in turn.
+    Returns:
+        Tuple of (frame at every position, final position).
+    """
+    frames, position = [df], 0
+    for index, change in enumerate(changes):
+        current = frames[-1]
+        new_df = change(current)
+        position = log.record(FILE_ID, EMAIL, position, current, new_df, [{'action': f'step {index}'}])
+        frames.append(new_df.reset_index(drop=True))
+    return frames, position
+
+
+def shift(amount):
+    return lambda df: df.assign(a=df['a'] + amount)
+
+
+def shuffle(df):
+    # Reordered rows cannot be diffed and are stored as snapshots
+    return df.sample(frac=1, random_state=0)
+
+
+@pytest.mark.parametrize('change', [
+    pytest.param(lambda df: df.assign(a=df['a'].fillna(0)), id='fill-nan'),
+    pytest.param(lambda df: df.assign(a=df['a'].where(df['b'] != 1)), id='set-nan'),
+    pytest.param(lambda df: df.assign(c=df['c'].str.upper()), id='strings-with-missing'),
+    pytest.param(lambda df: df.assign(b=df['b'].astype(float)), id='int-to-float'),
+    pytest.param(lambda df: df.assign(c=df['c'].astype('category')), id='object-to-category'),
+    pytest.param(lambda df: df.assign(d=df['d'].cat.rename_categories(['P', 'Q'])), id='categories'),
+    pytest.param(lambda df: df.assign(z=df['b'] * 2)[['z', 'a', 'b', 'c', 'd', 't']], id='add-column'),
+    pytest.param(lambda df: df.drop(columns=['c']), id='drop-column'),
+    pytest.param(lambda df: df.dropna(subset=['a']), id='drop-rows'),
+    pytest.param(lambda df: df.dropna(subset=['a']).reset_index(drop=True), id='drop-rows-reset-index'),
+    pytest.param(lambda df: df.drop_duplicates(subset=['b']).assign(b=lambda x: x['b'].astype(float)),
+                 id='drop-rows-and-retype'),
+])
+def test_diff_round_trip(frame, change):
+    new_df = change(frame)
+    forward, backward, size = diff_frames(frame, new_df)
+    expected = new_df.reset_index(drop=True)
+
+    assert size > 0
+    assert_frame_equal(apply_ops(frame, forward), expected)
+    assert_frame_equal(apply_ops(expected, backward), frame)
+
+
+def test_diff_keeps_missing_values(frame):
+    new_df = frame.assign(a=frame['a'].fillna(0))
+    forward, backward, _ = diff_frames(frame, new_df)
+
+    restored = apply_ops(new_df, backward)
+    assert restored['a'].isna().sum() == frame['a'].isna().sum() == 20
+    assert restored['c'].isna().equals(frame['c'].isna())
+
+
+def test_unchanged_frame_has_an_empty_diff(frame):
+    assert diff_frames(frame, frame.copy()) == ([], [], 0)
+
+
+def test_reordered_rows_are_not_diffed(frame):
+    assert diff_frames(frame, shuffle(frame)) is None
+
+
+def test_undo_and_redo_across_snapshots(frame):
+    log = make_log(snapshot_interval=3)
+    frames, position = record_changes(log, frame, [shift(1), shift(2), shift(3), shuffle, shift(5), shift(6)])
+
+    history = log.history(FILE_ID, EMAIL, position)
+    assert [entry['kind'] for entry in history['entries']] == ['diff', 'diff', 'diff', 'snapshot', 'diff', 'diff']
+    # Periodic checkpoints at 3 and 6, both ends of the reorder at 3 and 4
+    assert history['snapshots'] == [3, 4, 6]
+
+    current = frames[-1]
+    for target in [5, 4, 3, 2, 1, 0, 1, 2, 3, 4, 5, 6]:
+        current = log.checkout(FILE_ID, EMAIL, position, current, target)
+        assert_frame_equal(current, frames[target])
+        position = target
+
+
+def test_jump_across_snapshots(frame):
+    log = make_log(snapshot_interval=3)
+    frames, position = record_changes(log, frame, [shift(1), shuffle, shift(3), shift(4), shift(5)])
+
+    assert_frame_equal(log.checkout(FILE_ID, EMAIL, position, frames[-1], 0), frames[0])
+    assert_frame_equal(log.checkout(FILE_ID, EMAIL, 0, frames[0], position), frames[-1])
+
+
+def test_record_after_undo_discards_redo_entries(frame):
+    log = make_log()
+    frames, position = record_changes(log, frame, [shift(1), shift(2), shift(3)])
+
+    position = log.record(FILE_ID, EMAIL, 1, frames[1], frames[1].assign(b=0), [{'action': 'branch'}])
+
+    history = log.history(FILE_ID, EMAIL, position)
+    assert position == 2
+    assert [entry['operations'] for entry in history['entries']] == [[{'action': 'step 0'}], [{'action': 'branch'}]]
+
+
+def test_compaction_by_entry_count(frame):
+    log = make_log(snapshot_interval=3, max_entries=3)
+    frames, position = record_changes(log, frame, [shift(amount) for amount in range(1, 9)])
+
+    history = log.history(FILE_ID, EMAIL, position)
+    assert (history['floor'], history['top']) == (5, 8)
+    assert [entry['position'] for entry in history['entries']] == [6, 7, 8]
+    # Snapshots outside the kept range are dropped with the entries
+    assert history['snapshots'] == [6]
+    assert_frame_equal(log.checkout(FILE_ID, EMAIL, position, frames[-1], 5), frames[5])
+    with pytest.raises(LookupError):
+        log.checkout(FILE_ID, EMAIL, position, frames[-1], 4)
+
+
+def test_compaction_by_size(frame):
+    entry_bytes = diff_frames(frame, shift(1)(frame))[2]
+    log = make_log(max_bytes=int(entry_bytes * 2.5))
+    frames, position = record_changes(log, frame, [shift(amount) for amount in range(1, 6)])
+
+    history = log.history(FILE_ID, EMAIL, position)
+    assert len(history['entries']) == 2
+    assert history['bytes'] <= log.max_bytes
+    assert_frame_equal(log.checkout(FILE_ID, EMAIL, position, frames[-1], history['floor']),
+                       frames[history['floor']])
+
+
+def test_import_legacy_history():
+    original = pd.DataFrame({'a': [1.0, np.nan, 3.0], 'b': ['x', 'y', 'z']})
+    filled = original.assign(a=original['a'].fillna(2.0))
+    current = filled.drop(columns=['b'])
+    history = [
+        {'operation': 'fill_missing', 'column': 'a', 'method': 'mean', 'old_values': [{'index': 1, 'value': None}]},
+        {'operation': 'delete_column', 'column': 'b', 'data': [{'b': 'x'}, {'b': 'y'}, {'b': 'z'}]}
+    ]
+    log = make_log()
+
+    position = log.import_history(FILE_ID, EMAIL, current, history)
+
+    assert position == 2
+    entries = log.history(FILE_ID, EMAIL, position)['entries']
+    assert [entry['operations'] for entry in entries] == [[{'action': 'fill_missing', 'column': 'a'}],
+                                                          [{'action': 'delete_column', 'column': 'b'}]]
+    assert_frame_equal(log.checkout(FILE_ID, EMAIL, 2, current, 1), filled)
+    assert_frame_equal(log.checkout(FILE_ID, EMAIL, 2, current, 0), original)
+
+
+def test_import_discards_entries_that_no_longer_fit():
+    # A row was removed after column b was deleted, so b cannot be restored
+    current = pd.DataFrame({'a': [1.0, 2.0]})
+    history = [
+        {'operation': 'delete_column', 'column': 'b', 'data': [{'b': 'x'}, {'b': 'y'}, {'b': 'z'}]},
+        {'operation': 'fill_missing', 'column': 'a', 'method': 'mean', 'old_values': [{'index': 1, 'value': None}]}
+    ]
+    log = make_log()
+
+    position = log.import_history(FILE_ID, EMAIL, current, history)
+
+    assert position == 1
+    history = log.history(FILE_ID, EMAIL, position)
+    assert history['floor'] == 0
+    restored = log.checkout(FILE_ID, EMAIL, position, current, 0)
+    assert restored['a'].isna().tolist() == [False, True]
+
+
+def test_import_empty_history(frame):
+    log = make_log()
+    assert log.import_history(FILE_ID, EMAIL, frame, []) == 0
+    assert log.history(FILE_ID, EMAIL, 0)['entries'] == []
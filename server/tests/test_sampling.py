@@ -0,0 +1,67 @@
+"""
+Tests of the row-budget sampling.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from sampling import sample_frame, sampling_options, stratum_quotas
+
+
+@pytest.mark.parametrize('sizes, budget', [
+    ([1000, 1, 1, 1, 1, 1, 1, 1, 1, 1], 10),
+    ([50, 30, 20], 7),
+    ([3, 3, 3, 991], 5),
+    ([1] * 20 + [80], 10),
+    ([5, 5], 9),
+])
+def test_quotas_fill_the_budget_within_strata(sizes, budget):
+    sizes = np.array(sizes)
+    quotas = stratum_quotas(sizes, budget)
+
+    assert quotas.sum() == budget
+    assert (quotas <= sizes).all()
+    if len(sizes) <= budget:
+        assert (quotas >= 1).all()
+
+
+def test_quotas_are_proportional():
+    assert stratum_quotas(np.array([600, 300, 100]), 10).tolist() == [6, 3, 1]
+    assert stratum_quotas(np.array([540, 360, 100]), 10).tolist() == [5, 4, 1]
+
+
+def test_small_strata_get_one_row():
+    # Rounding alone would give the small strata nothing and the large one all ten rows
+    assert stratum_quotas(np.array([1000, 1, 1, 1, 1, 1, 1, 1, 1, 1]), 10).tolist() == [1] * 10
+    assert stratum_quotas(np.array([970, 10, 10, 10]), 10).tolist() == [7, 1, 1, 1]
+
+
+def test_more_strata_than_rows_drops_the_smallest():
+    assert stratum_quotas(np.array([40, 30, 20, 5, 5]), 3).tolist() == [1, 1, 1, 0, 0]
+
+
+def test_stratified_sample_stays_within_budget():
+    df = pd.DataFrame({'group': ['big'] * 1000 + [f'small{i}' for i in range(9)], 'value': np.arange(1009)})
+    sample, info = sample_frame(df, sampling_options(rows=10, method='stratified', stratify_by='group'))
+
+    assert len(sample) == info['sample_rows'] == 10
+    assert info['method'] == 'stratified'
+    assert sample['group'].nunique() == 10
+    assert sample.index.is_monotonic_increasing
+
+
+def test_stratified_sample_with_more_strata_than_rows():
+    df = pd.DataFrame({'group': np.arange(100) % 20, 'value': np.arange(100)})
+    sample, info = sample_frame(df, sampling_options(rows=10, method='stratified', stratify_by='group'))
+
+    assert len(sample) == 10
+    assert info['method'] == 'stratified'
+
+
+def test_uniform_sample():
+    df = pd.DataFrame({'value': np.arange(100)})
+    sample, info = sample_frame(df, sampling_options(rows=10))
+
+    assert len(sample) == 10
+    assert info['method'] == 'uniform'
+    assert sample_frame(df, sampling_options(rows=100))[1] is None
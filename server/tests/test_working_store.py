@@ -0,0 +1,64 @@
+"""
+Tests of the column encoding of the working store.
+"""
+import decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_series_equal
+
+import working_store
+from working_store import decode_column, encode_column
+
+
+@pytest.fixture(params=['arrow', 'json'])
+def codec(request, monkeypatch):
+    """
+    Runs a test with pyarrow and with the JSON fallback used without it.
+    """
+    if request.param == 'arrow':
+        pytest.importorskip('pyarrow')
+    else:
+        monkeypatch.setattr(working_store, 'pa', None)
+    return request.param
+
+
+def round_trip(series):
+    fmt, blob = encode_column(series)
+    return fmt, decode_column(fmt, blob, series.name)
+
+
+@pytest.mark.parametrize('series', [
+    pd.Series([1.5, np.nan, 3.0], name='float'),
+    pd.Series([1, 2, 3], name='int'),
+    pd.Series([True, False, True], name='bool'),
+    pd.Series(pd.to_datetime(['2020-01-01', None, '2020-01-03']), name='time'),
+    pd.Series(pd.Categorical(['p', 'q', None]), name='category'),
+], ids=lambda series: series.name)
+def test_typed_columns_round_trip(codec, series):
+    _, decoded = round_trip(series)
+    assert_series_equal(decoded, series)
+
+
+def test_missing_text_is_nan(codec):
+    _, decoded = round_trip(pd.Series(['x', None, 'y'], name='text'))
+    assert decoded.dtype == object
+    assert decoded[0] == 'x' and decoded[2] == 'y'
+    assert isinstance(decoded[1], float) and np.isnan(decoded[1])
+
+
+def test_mixed_column_is_stored_as_json(codec):
+    series = pd.Series([1, 'a', None, 2.5, decimal.Decimal('1.5'), True], name='mixed')
+    fmt, decoded = round_trip(series)
+    assert fmt == 'json'
+    assert decoded.dtype == object
+    assert decoded.tolist()[:2] == [1, 'a']
+    assert np.isnan(decoded[2])
+    # Values JSON has no type for are kept as text
+    assert decoded.tolist()[3:] == [2.5, '1.5', True]
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        decode_column('pickle', b'', 'column')
@@ -0,0 +1,184 @@
+"""
+Columnar storage for the manual cleaning working copy.
+
+Instead of one `result_df` list of row dicts, the working dataset is stored as
+one document per column holding the column in a compact binary encoding
+(Arrow IPC when pyarrow is installed). Columns Arrow cannot encode, such as
+object columns of mixed types, and every column without pyarrow are stored
+as JSON: numbers, booleans and strings as they are, other values cast to
+str, and the dtype restored on load where the values allow it. Missing
+values of text columns come back as NaN, as the CSV reader produces them. The
+`result_collection` document keeps the ordered column names, the row count
+and the revision. Saving a new revision only rewrites the columns that
+changed, so a one-column operation costs one column write.
+
+Documents written before this store existed (inline `result_df`) are read
+as before and converted to the columnar layout on first load.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+from pymongo import UpdateOne
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+def _json_value(value):
+    """
+    JSON form of one cell; values that are not numbers, booleans or strings are cast to str.
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    if isinstance(value, float):
+        return None if value != value else value
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+    return str(value)
+
+
+def encode_column(series):
+    """
+    Encodes a single column.
+    Returns:
+        Tuple of (format name, bytes).
+    """
+    if pa is not None:
+        try:
+            table = pa.Table.from_pandas(series.to_frame(), preserve_index=False)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return 'arrow', sink.getvalue().to_pybytes()
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            # Mixed-type object columns cannot be expressed in Arrow
+            pass
+    payload = {'dtype': str(series.dtype), 'values': [_json_value(value) for value in series.tolist()]}
+    return 'json', json.dumps(payload).encode('utf-8')
+
+
+def decode_column(fmt, blob, name):
+    """
+    Raises:
+        ValueError: For a format this store does not write.
+    """
+    if fmt == 'arrow':
+        # Reads straight from the BSON buffer; numeric columns are not copied by Arrow
+        table = pa.ipc.open_stream(pa.py_buffer(blob)).read_all()
+        series = table.to_pandas().iloc[:, 0]
+    elif fmt == 'json':
+        payload = json.loads(blob)
+        series = pd.Series(payload['values'], dtype=object)
+        if payload['dtype'] != 'object':
+            try:
+                series = series.astype(payload['dtype'])
+            except (TypeError, ValueError):
+                # Values cast to str may not convert back; they stay as text
+                pass
+    else:
+        raise ValueError(f'Column {name} is stored in an unsupported format: {fmt}')
+    # pandas marks missing text as NaN, Arrow and JSON as None
+    if series.dtype == object and series.isna().any():
+        series = series.copy()
+        series[series.isna()] = np.nan
+    series.name = name
+    return series
+
+
+def changed_columns(old_df, new_df):
+    """
+    Names of the columns of `new_df` that differ from `old_df`.
+    Every column counts as changed when the rows were added, removed or reordered.
+    """
+    if old_df is None or len(old_df) != len(new_df):
+        return list(new_df.columns)
+    changed = []
+    for column in new_df.columns:
+        if column not in old_df.columns:
+            changed.append(column)
+            continue
+        old_values = old_df[column].reset_index(drop=True)
+        if old_values.dtype != new_df[column].dtype or not old_values.equals(new_df[column]):
+            changed.append(column)
+    return changed
+
+
+class WorkingStore:
+    """
+    Per-column persistence of working DataFrames.
+    Args:
+        result_collection: Collection with one metadata document per (file_id, email).
+        columns_collection: Collection with one document per stored column.
+    """
+    def __init__(self, result_collection, columns_collection):
+        self.result_collection = result_collection
+        self.columns_collection = columns_collection
+
+    def load(self, meta):
+        """
+        Loads the working DataFrame described by a `result_collection` document.
+        """
+        query = {'file_id': meta['file_id'], 'email': meta['email']}
+        if meta.get('storage') != 'columnar':
+            legacy = self.result_collection.find_one(query, {'result_df': 1})
+            df = pd.DataFrame(legacy.get('result_df', []))
+            self.save(meta['file_id'], meta['email'], df, revision=meta.get('revision', 0))
+            print(f"Converted working copy of {meta['file_id']} to columnar storage")
+            return df
+
+        columns = meta.get('columns', [])
+        series = {}
+        for doc in self.columns_collection.find({**query, 'name': {'$in': columns}}):
+            series[doc['name']] = decode_column(doc['format'], doc['blob'], doc['name'])
+        missing = [column for column in columns if column not in series]
+        if missing:
+            raise ValueError(f'Working copy is missing columns: {missing}')
+        if not columns:
+            return pd.DataFrame(index=pd.RangeIndex(meta.get('rows', 0)))
+        return pd.DataFrame({column: series[column] for column in columns}, copy=False)
+
+    def save(self, file_id, email, new_df, old_df=None, revision=0, extra=None):
+        """
+        Persists `new_df`, rewriting only the columns that differ from `old_df`.
+        Returns:
+            The saved frame with a fresh RangeIndex, as a later `load` returns it.
+        """
+        new_df = new_df.reset_index(drop=True)
+        query = {'file_id': file_id, 'email': email}
+
+        operations = []
+        for column in changed_columns(old_df, new_df):
+            fmt, blob = encode_column(new_df[column])
+            operations.append(UpdateOne(
+                {**query, 'name': column},
+                {'$set': {'format': fmt, 'blob': blob, 'dtype': str(new_df[column].dtype), 'revision': revision}},
+                upsert=True
+            ))
+        if operations:
+            self.columns_collection.bulk_write(operations, ordered=False)
+
+        stale = {**query, 'name': {'$nin': list(new_df.columns)}}
+        if old_df is None or any(column not in new_df.columns for column in old_df.columns):
+            self.columns_collection.delete_many(stale)
+
+        update = {
+            'storage': 'columnar',
+            'columns': list(new_df.columns),
+            'rows': len(new_df),
+            'revision': revision
+        }
+        update.update(extra or {})
+        self.result_collection.update_one(query, {'$set': update, '$unset': {'result_df': ''}}, upsert=True)
+        return new_df
+
+    def delete(self, file_id, email=None):
+        query = {'file_id': file_id}
+        if email is not None:
+            query['email'] = email
+        self.columns_collection.delete_many(query)
+        self.result_collection.delete_many(query)